@@ -0,0 +1,331 @@
+"""
+Batch runs and parameter sweeps of simulation scenarios.
+
+A sweep starts from a base configuration (as used by `dtv_backend.simulate.v3_run`)
+and a parameter grid, for example::
+
+    {"discharge_lobith": [1000, 2000, 3000], "n_ships": [1, 5], "with_berth": [true]}
+
+Every combination is a run. Runs are spread over a pool of worker processes that
+each load the FIS network once. The key performance indicators (KPIs) of each run
+are collected in one table as soon as the run is finished.
+
+Supported parameters:
+
+- ``discharge_lobith``, ``discharge_st_pieter``, ``sealevel``: the climate. The
+  bathymetry quantities are recomputed for the climate.
+- ``fleet``: the fleet mix, a list of ships (features) or indices into the fleet of
+  the base configuration.
+- ``n_ships``: the number of ships, the fleet is repeated (or cut) to this number.
+- ``shift_start_time``, ``shift_end_time``: the shift of all ships ("HH:MM").
+- ``with_berth``: use berths.
+"""
+
+import concurrent.futures
+import copy
+import datetime
+import functools
+import itertools
+import logging
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import dtv_backend.climate
+import dtv_backend.fis
+import dtv_backend.jobs
+import dtv_backend.postprocessing
+import dtv_backend.simulate
+
+logger = logging.getLogger(__name__)
+
+climate_parameters = ["discharge_lobith", "discharge_st_pieter", "sealevel"]
+fleet_parameters = ["fleet", "n_ships", "shift_start_time", "shift_end_time"]
+option_parameters = ["with_berth"]
+parameters = climate_parameters + fleet_parameters + option_parameters
+
+
+def expand_grid(grid):
+    """
+    Expand a parameter grid into a list of runs.
+
+    Parameters
+    ----------
+    grid : dict or list
+        A dict of parameter: list of values (all combinations are used) or a list of
+        dicts (one per run).
+
+    Returns
+    -------
+    list
+        The parameters per run.
+    """
+    if isinstance(grid, dict):
+        names = list(grid)
+        return [
+            dict(zip(names, values))
+            for values in itertools.product(*(grid[name] for name in names))
+        ]
+    return [dict(run) for run in grid]
+
+
+def _as_time(value):
+    """convert "HH:MM" to datetime.time"""
+    if isinstance(value, datetime.time):
+        return value
+    return datetime.time.fromisoformat(value)
+
+
+def apply_parameters(config, run_parameters):
+    """
+    Apply the parameters of a run to (a copy of) the base configuration.
+
+    Parameters
+    ----------
+    config : dict
+        The base configuration.
+    run_parameters : dict
+        The parameters of the run, see the module documentation.
+
+    Returns
+    -------
+    dict
+        The configuration of the run.
+    """
+    unknown = set(run_parameters) - set(parameters)
+    if unknown:
+        raise ValueError(f"Unknown parameters {unknown}, expected one of {parameters}")
+    config = copy.deepcopy(config)
+
+    for name in climate_parameters:
+        if name in run_parameters:
+            config.setdefault("climate", {})[name] = run_parameters[name]
+
+    fleet = config["fleet"]
+    if "fleet" in run_parameters:
+        fleet = [
+            copy.deepcopy(config["fleet"][ship]) if isinstance(ship, int) else ship
+            for ship in run_parameters["fleet"]
+        ]
+    if "n_ships" in run_parameters:
+        n_ships = run_parameters["n_ships"]
+        fleet = [
+            copy.deepcopy(ship)
+            for ship in itertools.islice(itertools.cycle(fleet), n_ships)
+        ]
+        for i, ship in enumerate(fleet):
+            ship["id"] = i
+            name = ship["properties"].get("name", "Ship")
+            ship["properties"]["name"] = f"{name} {i}"
+    for name in ("shift_start_time", "shift_end_time"):
+        if name in run_parameters:
+            for ship in fleet:
+                ship["properties"][name] = _as_time(run_parameters[name])
+    config["fleet"] = fleet
+
+    if "with_berth" in run_parameters:
+        config.setdefault("options", {})["with_berth"] = run_parameters["with_berth"]
+    return config
+
+
+@functools.lru_cache(maxsize=4)
+def _edges_gdf(graph):
+    """the network edges with bathymetry, computed once per worker"""
+    return dtv_backend.fis.get_edges_gdf(graph=graph)
+
+
+def climate_quantities(climate):
+    """
+    Compute the bathymetry quantities (waterlevel, velocity, depth per edge) for a
+    climate, as the /climate route of the server does.
+
+    Returns
+    -------
+    dict
+        The quantities as a GeoJSON feature collection.
+    """
+    graph = dtv_backend.fis.load_fis_network(dtv_backend.simulate.network_url)
+    interpolators = dtv_backend.climate.get_climate_tables()
+    result = dtv_backend.climate.get_variables_for_climate(
+        climate=climate, interpolators=interpolators, edges_gdf=_edges_gdf(graph)
+    )
+    return result._to_geo()
+
+
+def compute_kpis(result):
+    """
+    Compute the key performance indicators of a simulation.
+
+    Parameters
+    ----------
+    result : dict
+        The result of `dtv_backend.simulate.v3_run`.
+
+    Returns
+    -------
+    dict
+        trips (number of deliveries), tonnage (delivered cargo), distance [m],
+        duration of the simulation [s], energy [Wh], fuel [m3], CO2, PM10 and NOX [g].
+    """
+    log_df = dtv_backend.postprocessing.logbook_to_df(result["operator"].logbook)
+    kpis = {
+        "trips": 0,
+        "tonnage": 0.0,
+        "distance": 0.0,
+        "duration": result["env"].now - result["env"].epoch.timestamp(),
+        "energy": 0.0,
+        "fuel": 0.0,
+        "CO2": 0.0,
+        "PM10": 0.0,
+        "NOX": 0.0,
+    }
+    if log_df.empty:
+        return kpis
+    is_stop = log_df["state"] == "STOP"
+
+    # cargo delivered at a port
+    port_containers = {id(port.container) for port in result["ports"]}
+    is_load = is_stop & (log_df["Message"] == "Load")
+    is_delivery = is_load.copy()
+    is_delivery[is_load] = dtv_backend.postprocessing.log_meta(log_df)[is_load].apply(
+        lambda x: id((x or {}).get("destination")) in port_containers
+    )
+    kpis["trips"] = int(is_delivery.sum())
+    kpis["tonnage"] = float(log_df["Value"][is_delivery].fillna(0).sum())
+
+    if ((log_df["Message"] == "Sailing") & is_stop).any():
+        energy_gdf = dtv_backend.postprocessing.energy_gdf_from_log_df(log_df)
+        for column in ["distance", "energy", "fuel", "CO2", "PM10", "NOX"]:
+            kpis[column] = float(np.sum(energy_gdf[column]))
+    return kpis
+
+
+def run_scenario(config, run_parameters, progress=None):
+    """
+    Run one scenario of a sweep and compute its KPIs. Errors are reported in the
+    result, so that one failing run does not stop the sweep.
+
+    Parameters
+    ----------
+    config : dict
+        The base configuration.
+    run_parameters : dict
+        The parameters of the run.
+    progress : callable, optional
+        Progress reporter, see `dtv_backend.simulate.run_env`.
+
+    Returns
+    -------
+    dict
+        The parameters, the KPIs, the status (ok or error), the error and the
+        run time [s].
+    """
+    tic = time.perf_counter()
+    row = dict(run_parameters)
+    try:
+        run_config = apply_parameters(config, run_parameters)
+        if set(run_parameters) & set(climate_parameters):
+            run_config.setdefault("quantities", {})["bathymetry"] = climate_quantities(
+                run_config["climate"]
+            )
+        result = dtv_backend.simulate.v3_run(run_config, progress=progress)
+        row.update(compute_kpis(result))
+        row["status"] = "ok"
+    except Exception as e:
+        logger.exception("Run %s failed", run_parameters)
+        row["status"] = "error"
+        row["error"] = repr(e)
+    row["run_time"] = time.perf_counter() - tic
+    row["pid"] = os.getpid()
+    return row
+
+
+def iter_batch(
+    config,
+    grid,
+    max_workers=None,
+    network_url=dtv_backend.simulate.network_url,
+    mp_context=None,
+):
+    """
+    Run all scenarios of a grid on a process pool and yield the results as they
+    finish.
+
+    Parameters
+    ----------
+    config : dict
+        The base configuration.
+    grid : dict or list
+        The parameter grid, see `expand_grid`.
+    max_workers : int, optional
+        The number of worker processes. The default is the number of cpus.
+    network_url : str, optional
+        The network that each worker loads once. The default is
+        `dtv_backend.simulate.network_url`.
+    mp_context : str, optional
+        The multiprocessing start method. The default is the DTV_MP_CONTEXT
+        environment variable or "spawn". With "fork" the network is loaded once and
+        shared with the workers, see `dtv_backend.jobs.preload_network`.
+
+    Yields
+    ------
+    dict
+        The run index, parameters and KPIs of a run, see `run_scenario`.
+    """
+    runs = expand_grid(grid)
+    if max_workers is None:
+        max_workers = min(len(runs), os.cpu_count() or 1) or 1
+    if mp_context is None:
+        mp_context = dtv_backend.jobs.default_mp_context()
+    if mp_context == "fork" and network_url is not None:
+        dtv_backend.jobs.preload_network(network_url)
+    logger.info("Running %s scenarios on %s workers", len(runs), max_workers)
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context(mp_context),
+        initializer=dtv_backend.jobs.init_worker,
+        initargs=(network_url,),
+    ) as executor:
+        futures = {
+            executor.submit(run_scenario, config, run_parameters): i
+            for i, run_parameters in enumerate(runs)
+        }
+        for future in concurrent.futures.as_completed(futures):
+            row = {"run": futures[future], **future.result()}
+            logger.info("Finished run %s (%s)", row["run"], row["status"])
+            yield row
+
+
+def run_batch(config, grid, output=None, **kwargs):
+    """
+    Run all scenarios of a grid and collect the KPIs in a table.
+
+    Parameters
+    ----------
+    config : dict
+        The base configuration.
+    grid : dict or list
+        The parameter grid, see `expand_grid`.
+    output : str or pathlib.Path, optional
+        A csv file. Each finished run is appended immediately.
+    **kwargs
+        Passed to `iter_batch`.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per run, sorted by run index.
+    """
+    rows = []
+    for row in iter_batch(config, grid, **kwargs):
+        rows.append(row)
+        if output is not None:
+            # stream the results, rewrite to keep the columns consistent
+            pd.DataFrame(rows).sort_values("run").to_csv(output, index=False)
+    results_df = pd.DataFrame(rows)
+    if not results_df.empty:
+        results_df = results_df.sort_values("run").reset_index(drop=True)
+    return results_df
@@ -11,14 +11,19 @@ with the ship's dimensions;
 
 """
 import datetime
+import numpy as np
 import pandas as pd
-import networkx as nx
 
 from opentnsim import core
 
+import dtv_backend.distance_matrix
 import dtv_backend.logbook
 import dtv_backend.scheduling
-from dtv_backend.fis import shorted_path, compute_path_length
+from dtv_backend.fis import (
+    shorted_path,
+    compute_path_length,
+    nodes_within_distance,
+)
 
 
 #%%
@@ -74,6 +79,16 @@ class CanBerth(dtv_backend.scheduling.HasTimeboard, core.SimpyObject):
         """Check if node index starts with berth_keyword."""
         return n.startswith(self.berth_keyword)
 
+    @property
+    def __distance_matrix(self) -> dtv_backend.distance_matrix.DistanceMatrix:
+        """
+        The shortest path trees from and towards all berths in the graph. They are
+        computed once and shared by all ships sailing on the same graph.
+        """
+        return dtv_backend.distance_matrix.get_berth_distance_matrix(
+            self.graph, self.berth_keyword, weight=self.edge_distance
+        )
+
     def __find_path(self, src_node, dst_node) -> list:
         """Finds a path (list of nodes)  from src to dst on the given graph."""
         return shorted_path(self.graph, src_node, dst_node)
@@ -86,18 +101,12 @@ class CanBerth(dtv_backend.scheduling.HasTimeboard, core.SimpyObject):
         # determine the path
         path = self.__find_path(src_node, dst_node)
 
-        # capture feasible berths in a set
-        berths = set()
-
-        # loop the nodes in the path
-        for node in path:
-            # generate a subgraph within given distance of the node
-            new_graph = nx.generators.ego_graph(
-                self.graph, node, radius=max_distance, distance=self.edge_distance
-            )
-            # look for berths
-            candidate_berths = [n for n in new_graph.nodes if self.__is_berth(n)]
-            berths = berths.union(set(candidate_berths))
+        # all nodes within given distance of the nodes in the path
+        nearby_nodes = nodes_within_distance(
+            self.graph, path, radius=max_distance, weight=self.edge_distance
+        )
+        # look for berths
+        berths = set(n for n in nearby_nodes if self.__is_berth(n))
 
         return [b for b in list(berths) if not b==src_node]
 
@@ -118,17 +127,25 @@ class CanBerth(dtv_backend.scheduling.HasTimeboard, core.SimpyObject):
         the distance from the berth to the final destination.
         """
         # compute the ETA of all candidate nodes from the current node
+        distance_matrix = self.__distance_matrix
         rows = []
         for berth in berth_nodes:
-            # get the path from src_node to berth and compute distance and speed-based duration
-            path_src_to_node = self.__find_path(src_node, berth)
-            distance_src_to_node = compute_path_length(self.graph, path_src_to_node)
+            if berth in distance_matrix.terminal_index:
+                # lookup the distances in the precomputed trees of the berth
+                distance_src_to_node = distance_matrix.distance(src_node, berth)
+                distance_node_to_dst = distance_matrix.distance(berth, dst_node)
+            else:
+                # get the path from src_node to berth and compute the distance
+                path_src_to_node = self.__find_path(src_node, berth)
+                distance_src_to_node = compute_path_length(self.graph, path_src_to_node)
+                # compute the distance from berth to destination
+                path_node_to_dst = self.__find_path(berth, dst_node)
+                distance_node_to_dst = compute_path_length(self.graph, path_node_to_dst)
+            # skip berths that can not be reached
+            if np.isinf(distance_src_to_node) or np.isinf(distance_node_to_dst):
+                continue
             duration_src_to_node = distance_src_to_node / mean_speed
 
-            # compute the distance from berth to destination
-            path_node_to_dst = self.__find_path(berth, dst_node)
-            distance_node_to_dst = compute_path_length(self.graph, path_node_to_dst)
-
             # define a row to add to rows
             row = {
                 "berth": berth,
@@ -142,8 +159,17 @@ class CanBerth(dtv_backend.scheduling.HasTimeboard, core.SimpyObject):
             # add the row
             rows.append(row)
 
-        # convert to dataframe
-        df = pd.DataFrame(rows)
+        # convert to dataframe, also without reachable berths
+        df = pd.DataFrame(
+            rows,
+            columns=[
+                "berth",
+                "distance from src",
+                "duration from src",
+                "eta",
+                "distance to dst",
+            ],
+        )
 
         # compute the distance of the direct path from src to dst
         direct_path = self.__find_path(src_node, dst_node)
@@ -242,6 +268,12 @@ class CanBerth(dtv_backend.scheduling.HasTimeboard, core.SimpyObject):
                 berth_nodes=berths,
                 mean_speed=mean_speed,
             )
+            if eta_df.empty:
+                print(
+                    f"No reachable berths were found on the route from src "
+                    f'"{src_node}" to dst "{dst_node}", sailing to the destination'
+                )
+                return dst_node
 
             # use the output to suggest the best berth
             berth = self.__find_best_berth(df=eta_df, max_timestamp=max_timestamp)
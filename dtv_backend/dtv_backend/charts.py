@@ -3,21 +3,43 @@ Functionalities for generating charts.
 """
 
 import copy
+import functools
 
 import pandas as pd
 import geopandas as gpd
 import numpy as np
-import plotly.express as px
 
-import matplotlib
 
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
+import dtv_backend.chart_templates
+import dtv_backend.postprocessing
+import dtv_backend.results
 
 
-import dtv_backend.chart_templates
+@functools.lru_cache(maxsize=1)
+def _pyplot():
+    """import and configure matplotlib on first use, it is slow to import"""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    plt.style.use("dark_background")
+    return plt
 
-plt.style.use("dark_background")
+
+def _result_table(results, name):
+    """
+    Return a table of the results: from the result store if the body has a
+    result_id (see `dtv_backend.results`), otherwise from the posted features.
+    Tables from the store are shared, do not modify them.
+    """
+    if "result_id" in results:
+        store = dtv_backend.results.get_result_store()
+        return store.table(results["result_id"], name)
+    features = results[name]
+    if isinstance(features, dict):
+        features = features["features"]
+    return gpd.GeoDataFrame.from_features(features)
 
 
 def trip_duration(results):
@@ -35,7 +57,7 @@ def trip_duration(results):
         Echarts JSON-like dictionary for trip duration plot.
     """
     # read log features
-    gdf = gpd.GeoDataFrame.from_features(results["log"]["features"])
+    gdf = _result_table(results, "log")
 
     cycle_idx = np.logical_and(gdf["Actor type"] == "Ship", gdf["Name"] == "Cycle")
     selected = gdf[cycle_idx].reset_index(drop=True)
@@ -61,7 +83,9 @@ def gantt(results):
     fig : plotly.graph_objs._figure.Figure
         Gantt chart figure.
     """
-    gdf = gpd.GeoDataFrame.from_features(results["log"]["features"])
+    import plotly.express as px
+
+    gdf = _result_table(results, "log")
     fig = px.timeline(
         gdf, x_start="Start", x_end="Stop", y="Name", color="Actor", opacity=0.3
     )
@@ -85,7 +109,7 @@ def duration_breakdown(results):
         Echarts JSON-like dictionary for duration breakdown plot.
     """
     # read log features
-    gdf = gpd.GeoDataFrame.from_features(results["log"]["features"])
+    gdf = _result_table(results, "log")
 
     # filter on the desired activities
     cycle_idx = (
@@ -134,7 +158,7 @@ def trip_histogram(results):
     echart = copy.deepcopy(dtv_backend.chart_templates.trips_template)
 
     # convert log to geodataframe
-    gdf = gpd.GeoDataFrame.from_features(results["log"]["features"])
+    gdf = _result_table(results, "log")
 
     # we're only counting cycles
     cycle_idx = np.logical_and(gdf["Actor type"] == "Ship", gdf["Name"] == "Cycle")
@@ -177,11 +201,12 @@ def energy_per_time(results):
     echart = copy.deepcopy(dtv_backend.chart_templates.energy_per_time_template)
 
     # convert log to geodataframe
-    energy_gdf = gpd.GeoDataFrame.from_features(results["energy_log"]["features"])
+    energy_gdf = _result_table(results, "energy_log")
 
-    rows = np.c_[
-        energy_gdf["t"], energy_gdf["energy"] / energy_gdf["distance"]
-    ].tolist()
+    # t is a string in a posted response and a datetime in a stored result
+    times = dtv_backend.postprocessing._format_times(pd.to_datetime(energy_gdf["t"]))
+    energy = energy_gdf["energy"] / energy_gdf["distance"]
+    rows = [list(row) for row in zip(times, energy.tolist())]
 
     echart["series"][0]["data"] = rows
 
@@ -207,7 +232,7 @@ def energy_per_distance(results):
     echart = copy.deepcopy(dtv_backend.chart_templates.energy_per_distance_template)
 
     # convert log to geodataframe
-    energy_gdf = gpd.GeoDataFrame.from_features(results["energy_log"]["features"])
+    energy_gdf = _result_table(results, "energy_log")
 
     rows = np.c_[
         energy_gdf["distance"].cumsum(), energy_gdf["energy"] / energy_gdf["distance"]
@@ -232,17 +257,26 @@ def route_gdf_from_config(config):
     route_gdf : gpd.GeoDataFrame
         Route geodataframe with quantities.
     """
-    route_gdf = gpd.GeoDataFrame.from_features(config["route"])
-
-    waterlevel_gdf = gpd.GeoDataFrame.from_features(
-        config["quantities"]["waterlevels"]["features"]
-    )
-    depth_gdf = gpd.GeoDataFrame.from_features(
-        config["quantities"]["bathymetry"]["features"]
-    )
-    velocity_gdf = gpd.GeoDataFrame.from_features(
-        config["quantities"]["velocities"]["features"]
-    )
+    if "result_id" in config:
+        # the quantities of a stored result, the route can be posted
+        route = config.get("route")
+        if route is None:
+            store = dtv_backend.results.get_result_store()
+            route = store.config(config["result_id"])["route"]
+        route_gdf = gpd.GeoDataFrame.from_features(route)
+    else:
+        route_gdf = gpd.GeoDataFrame.from_features(config["route"])
+
+    def quantity_gdf(name):
+        if "result_id" in config:
+            # a copy, the e_sorted column is added below
+            store = dtv_backend.results.get_result_store()
+            return store.table(config["result_id"], f"quantities_{name}").copy()
+        return gpd.GeoDataFrame.from_features(config["quantities"][name]["features"])
+
+    waterlevel_gdf = quantity_gdf("waterlevels")
+    depth_gdf = quantity_gdf("bathymetry")
+    velocity_gdf = quantity_gdf("velocities")
 
     route_gdf["e_sorted"] = route_gdf["e"].apply(lambda e: tuple(sorted(e)))
     waterlevel_gdf["e_sorted"] = waterlevel_gdf.apply(
@@ -312,6 +346,7 @@ def route_profile(config):
     )
     bridges_gdf = structures_gdf.query('structure_type == "Bridge"')
 
+    plt = _pyplot()
     fig, axes = plt.subplots(
         figsize=(13, 8), nrows=2, sharex=True, gridspec_kw=dict(height_ratios=[3, 1])
     )
@@ -375,7 +410,9 @@ def gantt(results):
     fig : plotly.graph_objs._figure.Figure
         Gantt chart figure.
     """
-    log_gdf = gpd.GeoDataFrame.from_features(results["log"])
+    import plotly.express as px
+
+    log_gdf = _result_table(results, "log")
     fig = px.timeline(
         log_gdf,
         x_start="Start",
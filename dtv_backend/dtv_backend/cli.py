@@ -1,29 +1,36 @@
 """
 Console script for dtv_backend.
 """
+import os
 import sys
+import json
 import logging
 
 import click
 import geojson
-import pandas as pd
 # add Flask CLI
 from flask.cli import FlaskGroup
 
-# dependencies
-import dtv_backend.network.network_utilities
-import dtv_backend.simple
-import dtv_backend.simulate
-import dtv_backend.postprocessing
+# dependencies, the simulation modules are imported by the commands that use them
 import dtv_backend.server
+import dtv_backend.warmup
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 @click.group(cls=FlaskGroup, create_app=dtv_backend.server.create_app)
-def main():
+@click.option(
+    '--warmup',
+    type=click.Choice(dtv_backend.warmup.warmup_modes),
+    default=None,
+    help='load the network and climate when the server starts (default DTV_WARMUP or off)',
+)
+def main(warmup):
     """server"""
     logger.info("Starting Digital Twin Vaarwegen 👥")
+    if warmup is not None:
+        # the app is created after this callback, see dtv_backend.warmup
+        os.environ["DTV_WARMUP"] = warmup
 
 
 
@@ -31,6 +38,8 @@ def main():
 @click.argument('input', type=click.File('r'))
 def simulate(input):
     """run a simulation"""
+    import dtv_backend.postprocessing
+    import dtv_backend.simulate
 
     logger.info("Loading configuration file ⚙")
     # read input file
@@ -41,12 +50,43 @@ def simulate(input):
     result = dtv_backend.simulate.run(config)
 
     logger.info("Writing logbook     ")
-    log_df = pd.DataFrame(result["operator"].logbook)
+    log_df = dtv_backend.postprocessing.logbook_to_df(result["operator"].logbook)
     log_df.to_csv('logbook.csv')
     logger.info("Writing charts 📊")
     fig = dtv_backend.postprocessing.log2gantt(log_df)
     fig.write_image('gantt.svg')
 
 
+@main.command()
+@click.argument('input', type=click.File('r'))
+@click.argument('grid', type=click.File('r'))
+@click.option('--output', default='results.csv', help='csv file with the KPIs per run')
+@click.option('--workers', type=int, default=None, help='number of worker processes')
+def batch(input, grid, output, workers):
+    """run a parameter sweep, GRID is a json file with parameter: values"""
+    import dtv_backend.batch
+
+    logger.info("Loading configuration file ⚙")
+    config = geojson.load(input)
+    grid = json.load(grid)
+
+    results_df = dtv_backend.batch.run_batch(
+        config, grid, output=output, max_workers=workers
+    )
+    logger.info("Finished %s runs, results in %s", len(results_df), output)
+
+
+@main.command()
+@click.option('--steps', default=None, help='comma separated warmup steps (default all)')
+def warmup(steps):
+    """load the network and climate and fill the caches, before starting servers"""
+    warmup = dtv_backend.warmup.Warmup(dtv_backend.server.warmup_steps(steps))
+    warmup.run()
+    for name, state in warmup.status()["steps"].items():
+        logger.info("%s: %s (%.1fs)", name, state["status"], state["duration"])
+    if not warmup.ready:
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     sys.exit(main())  # pragma: no cover
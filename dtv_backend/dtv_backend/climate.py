@@ -1,16 +1,33 @@
 """
 Climate related functions for DTV backend.
+
+The waterlevel and velocity along the rivers depend on the discharge at Lobith
+(Rhine) or St. Pieter (Meuse). A `ClimateTable` stores them as a discharge grid x
+location matrix per discharge station, so a climate is evaluated with one
+vectorized interpolation over all locations. The tables are built once from the
+river data and stored in the cache directory. The nearest location of each
+network edge does not depend on the climate, it is computed once per network and
+table and stored as well. Evaluating a climate for the network is then an array
+lookup, without reprojection or spatial join.
 """
 
 
 import functools
+import hashlib
+import logging
+import os
 import pathlib
+import weakref
 
+import numpy as np
 import pandas as pd
-import scipy.interpolate
+import shapely
 import geopandas as gpd
 
 import dtv_backend.fis
+import dtv_backend.network_cache
+
+logger = logging.getLogger(__name__)
 
 
 src_dir = pathlib.Path(__file__).parent.parent
@@ -36,6 +53,218 @@ group_columns = [
 value_columns = ["discharge"]
 columns = location_columns + value_columns
 
+# the climate parameter with the discharge at each discharge location
+discharge_parameters = {
+    "Lobith": "discharge_lobith",
+    "st Pieter": "discharge_st_pieter",
+}
+
+CLIMATE_CACHE_VERSION = 1
+
+
+def interpolate_linear(x, xp, fp):
+    """
+    Linear interpolation of fp (the last axis) from xp to x. Values outside xp are
+    extrapolated with the first or last segment, as `scipy.interpolate.interp1d`
+    with fill_value="extrapolate".
+    """
+    if len(xp) == 1:
+        return np.broadcast_to(fp[..., :1], fp.shape[:-1] + np.shape(x)).copy()
+    i = np.clip(np.searchsorted(xp, x) - 1, 0, len(xp) - 2)
+    weight = (x - xp[i]) / (xp[i + 1] - xp[i])
+    return fp[..., i] * (1 - weight) + fp[..., i + 1] * weight
+
+
+def _unique_samples(x, y):
+    """average the values of repeated discharges, they give nan in interp1d"""
+    x, inverse = np.unique(np.asarray(x, dtype="float64"), return_inverse=True)
+    y = np.bincount(inverse, weights=y) / np.bincount(inverse)
+    return x, y
+
+
+class ClimateTable:
+    """
+    A quantity (waterlevel or velocity) at the river locations as a function of the
+    discharge at their discharge location.
+
+    The values are stored per discharge location as a matrix of locations x
+    discharges. The discharge grid is the union of the discharges of the
+    interpolators, so linear interpolation on the grid (with linear extrapolation
+    beyond the grid) gives the same values as the piecewise linear interpolators.
+    Values of repeated discharges are averaged.
+
+    Parameters
+    ----------
+    locations : gpd.GeoDataFrame
+        The locations (river, km_markering, discharge_location, geometry).
+    grids : dict
+        The discharge grid per discharge location.
+    values : dict
+        The values (locations of the discharge location x grid) per discharge
+        location.
+    value_column : str, optional
+        The quantity, by default "waterlevel"
+    """
+
+    def __init__(self, locations, grids, values, value_column="waterlevel"):
+        """Create a table from the arrays."""
+        self.locations = locations.reset_index(drop=True)
+        self.grids = grids
+        self.values = values
+        self.value_column = value_column
+        station = self.locations["discharge_location"].to_numpy()
+        self.rows = {name: np.flatnonzero(station == name) for name in grids}
+        # (id(edges_gdf), max_distance) -> (weakref to edges_gdf, index, distance)
+        self._edge_index = {}
+
+    def __len__(self):
+        return len(self.locations)
+
+    @classmethod
+    def from_interpolator_gdf(cls, river_interpolator_gdf, value_column="waterlevel"):
+        """
+        Create a table from a geodataframe with interpolation functions per location,
+        see `create_river_interpolator_gdf`.
+        """
+        river_interpolator_gdf = river_interpolator_gdf.reset_index(drop=True)
+        interpolators = river_interpolator_gdf["interpolate"].tolist()
+        station = river_interpolator_gdf["discharge_location"].to_numpy()
+        grids = {}
+        values = {}
+        for name in pd.unique(station):
+            rows = np.flatnonzero(station == name)
+            grid = np.unique(np.concatenate([interpolators[i].x for i in rows]))
+            grids[name] = grid
+            values[name] = np.stack(
+                [
+                    interpolate_linear(
+                        grid, *_unique_samples(interpolators[i].x, interpolators[i].y)
+                    )
+                    for i in rows
+                ]
+            )
+        locations = gpd.GeoDataFrame(
+            river_interpolator_gdf.drop(columns=["interpolate"]),
+            geometry="geometry",
+        )
+        if locations.crs is None:
+            locations = locations.set_crs(epsg_wgs84)
+        return cls(locations, grids, values, value_column=value_column)
+
+    def evaluate(self, climate):
+        """
+        Compute the values at all locations for a climate.
+
+        Parameters
+        ----------
+        climate : dict
+            A climate dictionary with discharge values at Lobith and St Pieter.
+
+        Returns
+        -------
+        np.ndarray
+            The value per location.
+        """
+        result = np.full(len(self), np.nan)
+        for name, grid in self.grids.items():
+            discharge = climate[discharge_parameters[name]]
+            result[self.rows[name]] = interpolate_linear(
+                discharge, grid, self.values[name]
+            )
+        return result
+
+    def value_gdf(self, climate):
+        """
+        Return the locations with the values for a climate, see `value_for_climate`.
+        """
+        result = self.locations.copy()
+        result[self.value_column] = self.evaluate(climate)
+        return result
+
+    def edge_index(self, edges_gdf, max_distance=1500, use_cache=True):
+        """
+        Return the nearest location of each edge. The mapping does not depend on
+        the climate, it is computed once per edges and locations and stored in the
+        cache directory, see `nearest_locations`.
+
+        Parameters
+        ----------
+        edges_gdf : gpd.GeoDataFrame
+            A geodataframe with the network edges.
+        max_distance : int, optional
+            The maximum distance [m] to search for a location, by default 1500.
+        use_cache : bool, optional
+            Read and write the stored mapping, by default True
+
+        Returns
+        -------
+        index : np.ndarray
+            The location per edge, -1 if there is no location within max_distance.
+        distance : np.ndarray
+            The distance [m] per edge, nan if there is no location.
+        """
+        key = (id(edges_gdf), max_distance)
+        cached = self._edge_index.get(key)
+        if cached is not None and cached[0]() is edges_gdf:
+            return cached[1], cached[2]
+
+        if use_cache:
+            index, distance = _cached_nearest_locations(
+                edges_gdf, self.locations, max_distance
+            )
+        else:
+            index, distance = nearest_locations(edges_gdf, self.locations, max_distance)
+
+        ref = weakref.ref(edges_gdf, lambda _: self._edge_index.pop(key, None))
+        self._edge_index[key] = (ref, index, distance)
+        return index, distance
+
+    def edge_values(self, climate, edges_gdf, max_distance=1500):
+        """
+        Return the value of the nearest location of each edge for a climate, nan if
+        there is no location within max_distance.
+        """
+        index, _ = self.edge_index(edges_gdf, max_distance=max_distance)
+        values = self.evaluate(climate)
+        return np.where(index >= 0, values[index], np.nan)
+
+    def save(self, path):
+        """store the table as arrays in a .npz file"""
+        arrays = {
+            "value_column": np.array(self.value_column),
+            "stations": np.array(list(self.grids)),
+            "columns": np.array([c for c in self.locations.columns if c != "geometry"]),
+            "x": self.locations.geometry.x.to_numpy(),
+            "y": self.locations.geometry.y.to_numpy(),
+        }
+        for column in arrays["columns"]:
+            array = self.locations[column].to_numpy()
+            if array.dtype == object:
+                array = array.astype(str)
+            arrays[f"column_{column}"] = array
+        for i, name in enumerate(self.grids):
+            arrays[f"grid_{i}"] = self.grids[name]
+            arrays[f"values_{i}"] = self.values[name]
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """load a table stored with `save`"""
+        with np.load(path) as arrays:
+            locations = gpd.GeoDataFrame(
+                {
+                    column: arrays[f"column_{column}"]
+                    for column in arrays["columns"].tolist()
+                },
+                geometry=gpd.points_from_xy(arrays["x"], arrays["y"]),
+                crs=epsg_wgs84,
+            )
+            stations = arrays["stations"].tolist()
+            grids = {name: arrays[f"grid_{i}"] for i, name in enumerate(stations)}
+            values = {name: arrays[f"values_{i}"] for i, name in enumerate(stations)}
+            value_column = str(arrays["value_column"])
+        return cls(locations, grids, values, value_column=value_column)
+
 
 def value_for_climate(river_interpolator_gdf, climate, value_column="waterlevel"):
     """
@@ -100,6 +329,8 @@ def create_river_interpolator_gdf(river_with_discharges_gdf, value_column="water
         A geodataframe with interpolation functions per location.
     """
 
+    import scipy.interpolate
+
     # define interpolation function that interpolates between discharge and waterlevel, 
     # extrpolate if needed
     def interpolate(df_i):
@@ -154,11 +385,13 @@ def interpolated_values_for_climate(
         A climate dictionary with discharge values at Lobith and St Pieter.
     graph : networkx.MultiDiGraph
         A FIS graph.
-    river_interpolator_gdf : gpd.GeoDataFrame
+    river_interpolator_gdf : gpd.GeoDataFrame or ClimateTable
         A geodataframe with interpolation functions per location. Created with
-        `create_river_interpolator_gdf`.
+        `create_river_interpolator_gdf`. Or a climate table, see
+        `get_climate_table`.
     epsg : int, optional
-        The epsg code to use for distance calculations, by default epsg_utm31n
+        The epsg code of the result, by default epsg_utm31n. Distances are
+        computed in utm zone 31n.
     max_distance : int, optional
         The maximum distance to search for a waterlevel point, by default 1500
     value_column : str, optional
@@ -172,32 +405,27 @@ def interpolated_values_for_climate(
     """
 
     # use 1500 as max distance because we have a 1km input
-    value_gdf = value_for_climate(
-        river_interpolator_gdf, climate, value_column=value_column
-    )
-    value_gdf_utm = value_gdf.to_crs(epsg)
-    edges_gdf_utm = dtv_backend.fis.get_edges_gdf(graph).to_crs(epsg)
-
-    edges_merged = gpd.sjoin_nearest(
-        left_df=edges_gdf_utm,
-        right_df=value_gdf_utm,
-        how="left",
-        max_distance=max_distance,
-        lsuffix="left",
-        rsuffix="right",
-        distance_col="distance",
+    table = as_climate_table(river_interpolator_gdf, value_column=value_column)
+    edges_gdf = dtv_backend.fis.get_edges_gdf(graph)
+    index, distance = table.edge_index(edges_gdf, max_distance=max_distance)
+    found = index >= 0
+
+    locations = table.locations.iloc[index[found]].reset_index(drop=True)
+    result = gpd.GeoDataFrame(
+        {
+            "source": edges_gdf["source"].to_numpy()[found],
+            "target": edges_gdf["target"].to_numpy()[found],
+            "geometry": edges_gdf.geometry.to_crs(epsg).to_numpy()[found],
+            "km_markering": locations["km_markering"],
+            "km_markering_int": locations["km_markering_int"],
+            "discharge_location": locations["discharge_location"],
+            "distance": distance[found],
+            value_column: table.evaluate(climate)[index[found]],
+        },
+        geometry="geometry",
+        crs=epsg,
     )
-
-    columns = [
-        "source",
-        "target",
-        "geometry",
-        "km_markering",
-        "km_markering_int",
-        "discharge_location",
-        "distance",
-    ] + [value_column]
-    result = edges_merged.loc[:, columns].dropna()
+    result = result.dropna()
     return result
 
 
@@ -272,6 +500,171 @@ def get_interpolators():
     return interpolators
 
 
+def get_climate_cache_dir():
+    """
+    Return the directory where climate tables and edge mappings are stored, next
+    to the network cache (DTV_CACHE_DIR).
+    """
+    return dtv_backend.network_cache.get_cache_dir().parent / "climate"
+
+
+def nearest_locations(edges_gdf, locations, max_distance=1500):
+    """
+    Find the nearest location of each edge, as `gpd.sjoin_nearest` (the first
+    location if several are equally near).
+
+    Parameters
+    ----------
+    edges_gdf : gpd.GeoDataFrame
+        A geodataframe with the network edges.
+    locations : gpd.GeoDataFrame
+        The locations (points) of a climate table.
+    max_distance : int, optional
+        The maximum distance [m] to search for a location, by default 1500.
+
+    Returns
+    -------
+    index : np.ndarray
+        The location per edge, -1 if there is no location within max_distance.
+    distance : np.ndarray
+        The distance [m] per edge, nan if there is no location.
+    """
+    # We need to match spatially. We'll do it in meters.
+    # For EU or other country networks, we need to this on the sphere
+    edges_utm = edges_gdf.geometry.to_crs(epsg_utm31n).to_numpy()
+    locations_utm = locations.geometry.to_crs(epsg_utm31n).to_numpy()
+    tree = shapely.STRtree(locations_utm)
+    (edge_idx, location_idx), distances = tree.query_nearest(
+        edges_utm,
+        max_distance=max_distance,
+        return_distance=True,
+        all_matches=False,
+    )
+    index = np.full(len(edges_utm), -1)
+    index[edge_idx] = location_idx
+    distance = np.full(len(edges_utm), np.nan)
+    distance[edge_idx] = distances
+    return index, distance
+
+
+def _geometry_digest(gdf, digest):
+    """add the crs and coordinates of the geometries to a hash"""
+    geometries = gdf.geometry.to_numpy()
+    digest.update(str(gdf.crs).encode())
+    digest.update(shapely.get_num_coordinates(geometries).tobytes())
+    digest.update(shapely.get_coordinates(geometries).tobytes())
+
+
+def _cached_nearest_locations(edges_gdf, locations, max_distance=1500):
+    """
+    `nearest_locations`, stored in the climate cache directory by a hash of the
+    edge and location geometries.
+    """
+    digest = hashlib.sha1(f"{CLIMATE_CACHE_VERSION}:{max_distance}".encode())
+    _geometry_digest(edges_gdf, digest)
+    _geometry_digest(locations, digest)
+    path = get_climate_cache_dir() / f"edges-{digest.hexdigest()[:16]}.npz"
+    if path.exists():
+        try:
+            with np.load(path) as arrays:
+                return arrays["index"], arrays["distance"]
+        except (OSError, KeyError, ValueError):
+            logger.exception("Could not read edge mapping %s, recomputing", path)
+    index, distance = nearest_locations(edges_gdf, locations, max_distance)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.npz")
+        np.savez(tmp_path, index=index, distance=distance)
+        tmp_path.replace(path)
+    except OSError:
+        logger.exception("Could not store edge mapping %s", path)
+    return index, distance
+
+
+def _climate_source(value_column):
+    """the river data to build a climate table from"""
+    src_path = dtv_backend.get_src_path()
+    path = src_path / "data" / f"river_{value_column}.geojson"
+    if path.exists():
+        return path
+    # the precomputed interpolators
+    return src_path / "data" / f"river_{value_column}_interpolator_gdf.pickle"
+
+
+def _build_climate_table(source, value_column):
+    """build a climate table from the river data"""
+    if source.suffix == ".pickle":
+        river_interpolator_gdf = get_river_interpolator_gdf(value_column)
+    else:
+        river_gdf = gpd.read_file(source)
+        river_interpolator_gdf = create_river_interpolator_gdf(
+            river_gdf, value_column=value_column
+        )
+    return ClimateTable.from_interpolator_gdf(
+        river_interpolator_gdf, value_column=value_column
+    )
+
+
+@functools.lru_cache(maxsize=16)
+def get_climate_table(value_column="waterlevel", use_cache=True):
+    """
+    Return the climate table of a quantity. The table is stored in the cache
+    directory (DTV_CACHE_DIR) and rebuilt when the river data changes.
+
+    Parameters
+    ----------
+    value_column : str, optional
+        The quantity, "waterlevel" or "velocity", by default "waterlevel"
+    use_cache : bool, optional
+        Read and write the stored table, by default True
+
+    Returns
+    -------
+    ClimateTable
+        The climate table.
+    """
+    source = _climate_source(value_column)
+    if not use_cache:
+        return _build_climate_table(source, value_column)
+    stat = source.stat()
+    key = f"{CLIMATE_CACHE_VERSION}:{source.name}:{stat.st_size}:{stat.st_mtime_ns}"
+    key = hashlib.sha1(key.encode()).hexdigest()[:16]
+    cache_dir = get_climate_cache_dir()
+    path = cache_dir / f"{value_column}-{key}.npz"
+    if path.exists():
+        try:
+            return ClimateTable.load(path)
+        except (OSError, KeyError, ValueError):
+            logger.exception("Could not read climate table %s, rebuilding", path)
+    table = _build_climate_table(source, value_column)
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.npz")
+        table.save(tmp_path)
+        tmp_path.replace(path)
+    except OSError:
+        logger.exception("Could not store climate table %s", path)
+    return table
+
+
+def get_climate_tables():
+    """
+    Return a dictionary of quantity: climate table, to use as interpolators in
+    `get_variables_for_climate`.
+    """
+    return {
+        value_column: get_climate_table(value_column)
+        for value_column in ["velocity", "waterlevel"]
+    }
+
+
+def as_climate_table(interpolator, value_column="waterlevel"):
+    """return a climate table for a climate table or an interpolator geodataframe"""
+    if isinstance(interpolator, ClimateTable):
+        return interpolator
+    return ClimateTable.from_interpolator_gdf(interpolator, value_column=value_column)
+
+
 def get_variables_for_climate(climate, interpolators, edges_gdf, max_distance=1500):
     """
     Use the climate interpolators to get waterlevels, velocities and bathymetry for 
@@ -282,7 +675,8 @@ def get_variables_for_climate(climate, interpolators, edges_gdf, max_distance=15
     climate : dict
         A climate dictionary with discharge values at Lobith and St Pieter.
     interpolators : dict
-        A dictionary of quantity: interpolator geodataframe.
+        A dictionary of quantity: climate table (see `get_climate_tables`) or
+        interpolator geodataframe.
     edges_gdf : gpd.GeoDataFrame
         A geodataframe with the network edges.
     max_distance : int, optional
@@ -294,37 +688,28 @@ def get_variables_for_climate(climate, interpolators, edges_gdf, max_distance=15
         A geodataframe with network edges and interpolated variables.
     """
     # TODO: filter by route first
-
-    # Interpolate values for the current variable (for example for discharge 1000 @ Lobith)
-    values_utm = {}
-    for value_column, interpolator_gdf in interpolators.items():
-        # these are the variables for the current climate (for example waterlevels at each location)
-        value_gdf = value_for_climate(
-            interpolator_gdf, climate, value_column=value_column
-        )
-        # We need to interpolate spatial. We'll do it in meters.
-        # For EU or other country networks, we need to this on the sphere
-        values_utm[value_column] = value_gdf.to_crs(epsg_utm31n)
-
-    # conver to utm for spatial matching
-    edges_gdf_with_variables_gdf = edges_gdf.to_crs(epsg_utm31n)
-
-    # merge computed variables with graph
-    # lookup the nearest waterlevel
+    result = edges_gdf[
+        [
+            "source",
+            "target",
+            "length_m",
+            "geometry",
+            "nap_p5",
+            "nap_p50",
+            "nap_p95",
+            "lat_p5",
+            "lat_p50",
+            "lat_p95",
+        ]
+    ].copy()
+
+    # the value of the nearest location of each edge, for example the waterlevel
+    # for discharge 1000 @ Lobith
     for variable in ["velocity", "waterlevel"]:
-        edges_gdf_with_variables_gdf = gpd.sjoin_nearest(
-            left_df=edges_gdf_with_variables_gdf,
-            right_df=values_utm[variable][["geometry", variable]],
-            how="left",
-            max_distance=max_distance,
-            lsuffix="left",
-            rsuffix="right",
+        table = as_climate_table(interpolators[variable], value_column=variable)
+        result[variable] = table.edge_values(
+            climate, edges_gdf, max_distance=max_distance
         )
-        # remove created index columns
-        if "index_right" in edges_gdf_with_variables_gdf.columns:
-            edges_gdf_with_variables_gdf.drop(columns=["index_right"], inplace=True)
-        if "index_left" in edges_gdf_with_variables_gdf.columns:
-            edges_gdf_with_variables_gdf.drop(columns=["index_left"], inplace=True)
 
     columns = [
         "source",
@@ -340,13 +725,7 @@ def get_variables_for_climate(climate, interpolators, edges_gdf, max_distance=15
         "lat_p50",
         "lat_p95",
     ]
-    result_utm = edges_gdf_with_variables_gdf[columns]
+    result = result[columns]
     # if none of these variables are available, drop the row
-
-    result_utm = result_utm.dropna(
-        subset=["nap_p50", "velocity", "waterlevel"], how="all"
-    )
-
-    # project back to wgs84 and return
-    result = result_utm.to_crs(4326)
-    return result
+    result = result.dropna(subset=["nap_p50", "velocity", "waterlevel"], how="all")
+    return result.to_crs(epsg_wgs84)
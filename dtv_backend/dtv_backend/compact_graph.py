@@ -0,0 +1,566 @@
+"""
+Compact, array-backed representation of the FIS network for routing.
+
+The networkx representation of the FIS network stores every edge as a python
+dictionary. For shortest paths we only need the adjacency and a few numeric edge
+attributes. The `CompactGraph` stores these in a CSR (compressed sparse row) layout
+with integer node ids and numpy arrays per edge attribute, and uses the compiled
+scipy.sparse.csgraph routines for shortest paths. Node ids are mapped back to FIS
+node ids at the boundary, so results can be used with the networkx graph.
+
+A compact graph can be saved to a directory of ``.npy`` files and loaded as
+read-only memory maps (see `CompactGraph.save` and `CompactGraph.load`). Processes
+that load the same directory share the pages of the arrays, so extra workers do not
+need their own copy of the routing network.
+"""
+
+import functools
+import json
+import logging
+import pathlib
+import weakref
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+import scipy.sparse
+import scipy.sparse.csgraph
+
+logger = logging.getLogger(__name__)
+
+# numeric edge attributes that are stored as arrays (NaN if missing)
+numeric_attributes = [
+    "length_m",
+    "length",
+    "GeneralWidth",
+    "GeneralHeight",
+    "GeneralDepth",
+    "GeneralLength",
+]
+# categorical edge attributes that are stored as integer codes (-1 if missing)
+categorical_attributes = ["Code"]
+
+
+def _as_float(value):
+    """convert an attribute value to float, missing values become NaN"""
+    if value is None:
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class CompactGraph:
+    """
+    Array-backed graph in CSR layout.
+
+    Parameters
+    ----------
+    nodes : sequence
+        The node ids (for example FIS node ids).
+    sources : numpy.ndarray
+        Integer index of the source node per edge.
+    targets : numpy.ndarray
+        Integer index of the target node per edge.
+    edge_attributes : dict, optional
+        Mapping of attribute name to an array with a value per edge.
+    directed : bool, optional
+        Whether edges can only be traversed from source to target. The default is True.
+    categories : dict, optional
+        Mapping of categorical attribute name to its categories, for attributes that
+        are stored as integer codes.
+    """
+
+    def __init__(
+        self,
+        nodes,
+        sources,
+        targets,
+        edge_attributes=None,
+        directed=True,
+        categories=None,
+    ):
+        """Build the CSR adjacency."""
+        self.nodes = np.asarray(nodes, dtype=object)
+        self.node_index = {n: i for i, n in enumerate(self.nodes)}
+        self.directed = directed
+        self.sources = np.asarray(sources, dtype=np.int32)
+        self.targets = np.asarray(targets, dtype=np.int32)
+        self.edge_attributes = dict(edge_attributes or {})
+        self.categories = dict(categories or {})
+        self._csr_cache = {}
+
+        # each edge is an entry in the adjacency (twice for undirected graphs)
+        edge_ids = np.arange(len(self.sources), dtype=np.int32)
+        rows, cols = self.sources, self.targets
+        if not directed:
+            rows = np.concatenate([self.sources, self.targets])
+            cols = np.concatenate([self.targets, self.sources])
+            edge_ids = np.concatenate([edge_ids, edge_ids])
+        order = np.lexsort((cols, rows))
+        self.indices = cols[order]
+        self.entry_edge = edge_ids[order]
+        self.indptr = np.zeros(len(self.nodes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(self.nodes)), out=self.indptr[1:])
+        self._entry_rows = rows[order]
+        # parallel edges (multigraphs) need to be reduced to the lightest edge
+        self._has_parallel_edges = bool(
+            np.any((np.diff(self._entry_rows) == 0) & (np.diff(self.indices) == 0))
+        )
+
+    @classmethod
+    def from_networkx(cls, graph, attributes=None):
+        """
+        Create a compact graph from a networkx graph.
+
+        Parameters
+        ----------
+        graph : networkx.Graph
+            The graph to convert.
+        attributes : list, optional
+            Numeric edge attributes to store. The default is `numeric_attributes`.
+            The categorical attributes (CEMT Code) are always stored.
+
+        Returns
+        -------
+        CompactGraph
+            The compact graph.
+        """
+        if attributes is None:
+            attributes = numeric_attributes
+        nodes = list(graph.nodes)
+        node_index = {n: i for i, n in enumerate(nodes)}
+        edges = list(graph.edges(data=True))
+
+        sources = np.array([node_index[u] for u, _, _ in edges], dtype=np.int32)
+        targets = np.array([node_index[v] for _, v, _ in edges], dtype=np.int32)
+
+        edge_attributes = {}
+        for attribute in attributes:
+            edge_attributes[attribute] = np.array(
+                [_as_float(edge.get(attribute)) for _, _, edge in edges],
+                dtype="float64",
+            )
+        categories = {}
+        for attribute in categorical_attributes:
+            values = pd.Categorical([edge.get(attribute) for _, _, edge in edges])
+            edge_attributes[attribute] = values.codes.astype(np.int16)
+            categories[attribute] = list(values.categories)
+
+        compact_graph = cls(
+            nodes,
+            sources,
+            targets,
+            edge_attributes=edge_attributes,
+            directed=graph.is_directed(),
+            categories=categories,
+        )
+        logger.info(
+            "Created compact graph with %s nodes and %s edges (%.1fMB)",
+            len(nodes),
+            len(edges),
+            compact_graph.nbytes / 1000**2,
+        )
+        return compact_graph
+
+    def save(self, path):
+        """
+        Write the arrays of the compact graph to a directory.
+
+        Parameters
+        ----------
+        path : pathlib.Path
+            The directory, it is created if needed.
+        """
+        path = pathlib.Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        nodes = np.asarray(self.nodes.tolist())
+        if nodes.dtype == object:
+            raise ValueError("Only graphs with string or integer node ids can be saved")
+        arrays = {
+            "nodes": nodes,
+            "sources": self.sources,
+            "targets": self.targets,
+            "indices": self.indices,
+            "entry_edge": self.entry_edge,
+            "entry_rows": self._entry_rows,
+            "indptr": self.indptr,
+        }
+        for name, values in self.edge_attributes.items():
+            arrays[f"edge_{name}"] = values
+        for name, values in arrays.items():
+            np.save(path / f"{name}.npy", np.asarray(values))
+        meta = {
+            "directed": self.directed,
+            "has_parallel_edges": self._has_parallel_edges,
+            "edge_attributes": list(self.edge_attributes),
+            "categories": self.categories,
+        }
+        # the metadata is written last, it marks the directory as complete
+        with open(path / "compact_graph.json", "w") as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """
+        Load a compact graph written by `save`. The arrays are memory-mapped, so
+        processes that load the same directory share them.
+
+        Parameters
+        ----------
+        path : pathlib.Path
+            The directory.
+        mmap_mode : str, optional
+            The numpy memory map mode. The default is "r" (read only).
+
+        Returns
+        -------
+        CompactGraph
+            The compact graph.
+        """
+        path = pathlib.Path(path)
+        with open(path / "compact_graph.json") as f:
+            meta = json.load(f)
+
+        def load_array(name):
+            return np.load(path / f"{name}.npy", mmap_mode=mmap_mode)
+
+        # the adjacency is stored, so skip the construction in __init__
+        compact_graph = cls.__new__(cls)
+        compact_graph.nodes = load_array("nodes")
+        compact_graph.node_index = {
+            n: i for i, n in enumerate(compact_graph.nodes.tolist())
+        }
+        compact_graph.directed = meta["directed"]
+        compact_graph.sources = load_array("sources")
+        compact_graph.targets = load_array("targets")
+        compact_graph.indices = load_array("indices")
+        compact_graph.entry_edge = load_array("entry_edge")
+        compact_graph.indptr = load_array("indptr")
+        compact_graph._entry_rows = load_array("entry_rows")
+        compact_graph._has_parallel_edges = meta["has_parallel_edges"]
+        compact_graph.edge_attributes = {
+            name: load_array(f"edge_{name}") for name in meta["edge_attributes"]
+        }
+        compact_graph.categories = meta["categories"]
+        compact_graph._csr_cache = {}
+        logger.info(
+            "Loaded compact graph with %s nodes and %s edges from %s",
+            len(compact_graph.nodes),
+            compact_graph.n_edges,
+            path,
+        )
+        return compact_graph
+
+    @property
+    def nbytes(self):
+        """approximate memory used by the arrays (excluding the node ids)"""
+        arrays = [
+            self.sources,
+            self.targets,
+            self.indices,
+            self.entry_edge,
+            self.indptr,
+            *self.edge_attributes.values(),
+        ]
+        return sum(array.nbytes for array in arrays)
+
+    @property
+    def n_edges(self):
+        """the number of edges"""
+        return len(self.sources)
+
+    def set_edge_attribute(self, name, values):
+        """
+        Add or replace an edge attribute array.
+
+        Parameters
+        ----------
+        name : str
+            The attribute name.
+        values : numpy.ndarray
+            A value per edge, in edge order.
+        """
+        values = np.asarray(values)
+        if values.shape[0] != self.n_edges:
+            raise ValueError(
+                f"Expected {self.n_edges} values for {name}, got {values.shape[0]}"
+            )
+        self.edge_attributes[name] = values
+        self._csr_cache.pop(name, None)
+
+    def category_codes(self, name, values):
+        """
+        Lookup the integer codes of categorical values (-1 if unknown).
+
+        Parameters
+        ----------
+        name : str
+            The categorical attribute, for example "Code".
+        values : sequence
+            The values to lookup.
+
+        Returns
+        -------
+        numpy.ndarray
+            The codes per value.
+        """
+        lookup = {category: i for i, category in enumerate(self.categories[name])}
+        return np.array([lookup.get(value, -1) for value in values], dtype=np.int16)
+
+    def index(self, node):
+        """return the integer index of a node id"""
+        try:
+            return self.node_index[node]
+        except KeyError:
+            raise nx.NodeNotFound(f"Node {node} not found in graph")
+
+    def edge_weights(self, weight="length_m"):
+        """
+        Return the weight per edge.
+
+        Parameters
+        ----------
+        weight : str or None
+            The edge attribute to use as weight, None for unweighted (hop count).
+        """
+        if weight is None:
+            return np.ones(self.n_edges)
+        return self.edge_attributes[weight]
+
+    def csr(self, weight="length_m", edge_mask=None):
+        """
+        Return the adjacency as a sparse matrix with edge weights.
+
+        Parameters
+        ----------
+        weight : str or None, optional
+            The edge attribute to use as weight. The default is "length_m". None gives
+            a weight of 1 per edge.
+        edge_mask : numpy.ndarray, optional
+            Boolean array, edges that are False are left out.
+
+        Returns
+        -------
+        scipy.sparse.csr_matrix
+            The weighted adjacency matrix. Explicit zeros are edges of length 0.
+        """
+        if edge_mask is None:
+            # the unmasked adjacency is reused
+            if weight not in self._csr_cache:
+                self._csr_cache[weight] = self._build_csr(weight, None)
+            return self._csr_cache[weight]
+        entry_mask = edge_mask[self.entry_edge]
+        return self._build_csr(weight, entry_mask)
+
+    def _build_csr(self, weight, entry_mask):
+        """build a csr matrix for a weight and an optional mask of the entries"""
+        data = self.edge_weights(weight)[self.entry_edge].astype("float64")
+        # edges without a known weight can not be used
+        valid = ~np.isnan(data)
+        if entry_mask is not None:
+            valid &= entry_mask
+        rows = self._entry_rows[valid]
+        indices = self.indices[valid]
+        data = data[valid]
+        if self._has_parallel_edges:
+            # keep the lightest of the parallel edges
+            order = np.lexsort((data, indices, rows))
+            rows, indices, data = rows[order], indices[order], data[order]
+            first = np.ones(len(rows), dtype=bool)
+            first[1:] = (np.diff(rows) != 0) | (np.diff(indices) != 0)
+            rows, indices, data = rows[first], indices[first], data[first]
+        indptr = np.zeros(len(self.nodes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(self.nodes)), out=indptr[1:])
+        n = len(self.nodes)
+        return scipy.sparse.csr_matrix((data, indices, indptr), shape=(n, n))
+
+    def shortest_path_tree(
+        self, sources, weight="length_m", edge_mask=None, reverse=False, limit=np.inf
+    ):
+        """
+        Compute shortest path trees from one or more sources.
+
+        Parameters
+        ----------
+        sources : sequence
+            Node ids of the sources.
+        weight : str or None, optional
+            The edge attribute to use as weight. The default is "length_m".
+        edge_mask : numpy.ndarray, optional
+            Boolean array, edges that are False are not used.
+        reverse : bool, optional
+            Compute trees towards the sources instead of from the sources.
+        limit : float, optional
+            Do not search beyond this distance.
+
+        Returns
+        -------
+        distances : numpy.ndarray
+            Array of shape (n_sources, n_nodes) with distances (inf if unreachable).
+        predecessors : numpy.ndarray
+            Array of shape (n_sources, n_nodes) with the predecessor index in the
+            tree (-9999 for no predecessor). For reversed trees this is the next node
+            on the path towards the source.
+        """
+        source_idx = np.array([self.index(source) for source in sources], dtype=int)
+        csgraph = self.csr(weight=weight, edge_mask=edge_mask)
+        if reverse and self.directed:
+            csgraph = csgraph.T.tocsr()
+        distances, predecessors = scipy.sparse.csgraph.dijkstra(
+            csgraph,
+            directed=self.directed,
+            indices=source_idx,
+            return_predecessors=True,
+            limit=limit,
+        )
+        return np.atleast_2d(distances), np.atleast_2d(predecessors)
+
+    def path_from_tree(self, predecessors, target_idx):
+        """
+        Reconstruct a path (as integer indices) from a predecessor array.
+
+        Returns
+        -------
+        list
+            The node indices from the root of the tree to target_idx, or an empty list
+            if target_idx is not reachable.
+        """
+        path = [target_idx]
+        while predecessors[path[-1]] >= 0:
+            path.append(predecessors[path[-1]])
+        return path[::-1]
+
+    def shortest_path(self, source, target, weight="length_m", edge_mask=None):
+        """
+        Compute the shortest path between two nodes.
+
+        Parameters
+        ----------
+        source : str
+            The source node id.
+        target : str
+            The target node id.
+        weight : str or None, optional
+            The edge attribute to use as weight. The default is "length_m".
+        edge_mask : numpy.ndarray, optional
+            Boolean array, edges that are False are not used.
+
+        Returns
+        -------
+        list
+            The shortest path as a list of node ids.
+
+        Raises
+        ------
+        networkx.NodeNotFound
+            If source or target is not in the graph.
+        networkx.NetworkXNoPath
+            If target can not be reached from source.
+        """
+        source_idx = self.index(source)
+        target_idx = self.index(target)
+        if source_idx == target_idx:
+            return [source]
+        distances, predecessors = self.shortest_path_tree(
+            [source], weight=weight, edge_mask=edge_mask
+        )
+        if np.isinf(distances[0, target_idx]):
+            raise nx.NetworkXNoPath(f"No path between {source} and {target}.")
+        path_idx = self.path_from_tree(predecessors[0], target_idx)
+        return self.nodes[path_idx].tolist()
+
+    def nodes_within_distance(self, sources, radius, weight="length_m"):
+        """
+        Find all nodes within radius of any of the sources (following edge direction).
+
+        Returns
+        -------
+        list
+            The node ids within radius, including the sources.
+        """
+        source_idx = np.array([self.index(source) for source in sources], dtype=int)
+        distances = scipy.sparse.csgraph.dijkstra(
+            self.csr(weight=weight),
+            directed=self.directed,
+            indices=source_idx,
+            min_only=True,
+            limit=radius,
+        )
+        return self.nodes[np.flatnonzero(distances <= radius)].tolist()
+
+    def edge_ids(self, path):
+        """
+        Lookup the edge index for each step of a path.
+
+        Parameters
+        ----------
+        path : list
+            A path as a list of node ids.
+
+        Returns
+        -------
+        numpy.ndarray
+            The edge index per step (len(path) - 1 values).
+        """
+        path_idx = np.array([self.index(n) for n in path], dtype=np.int64)
+        result = np.empty(max(len(path_idx) - 1, 0), dtype=np.int64)
+        for i, (u, v) in enumerate(zip(path_idx[:-1], path_idx[1:])):
+            start, end = self.indptr[u], self.indptr[u + 1]
+            position = start + np.searchsorted(self.indices[start:end], v)
+            if position >= end or self.indices[position] != v:
+                raise KeyError(f"No edge between {path[i]} and {path[i + 1]}")
+            result[i] = self.entry_edge[position]
+        return result
+
+    def path_length(self, path, weight="length_m"):
+        """return the summed weight of a path (list of node ids)"""
+        return float(np.sum(self.edge_weights(weight)[self.edge_ids(path)]))
+
+
+# compact graphs that were loaded for a graph (for example from the network cache)
+_registered_compact_graphs = weakref.WeakKeyDictionary()
+
+
+def register_compact_graph(graph, compact_graph):
+    """
+    Use compact_graph (for example a memory-mapped one, see `CompactGraph.load`) as
+    the compact representation of graph, instead of converting graph.
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        The graph.
+    compact_graph : CompactGraph
+        The compact graph, with the same nodes and edges as graph.
+    """
+    _registered_compact_graphs[graph] = compact_graph
+
+
+@functools.lru_cache(maxsize=100)
+def _convert_graph(graph):
+    """convert a graph, once per graph"""
+    return CompactGraph.from_networkx(graph)
+
+
+def get_compact_graph(graph):
+    """
+    Return the compact graph for a networkx graph. It is the registered compact
+    graph (see `register_compact_graph`) or it is created on first use and reused
+    for as long as the graph is loaded.
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        The graph to convert.
+
+    Returns
+    -------
+    CompactGraph
+        The compact representation of graph.
+    """
+    compact_graph = _registered_compact_graphs.get(graph)
+    if compact_graph is None:
+        compact_graph = _convert_graph(graph)
+    return compact_graph
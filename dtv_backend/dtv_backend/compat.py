@@ -6,16 +6,13 @@ import datetime
 import numpy as np
 import logging
 
-import opentnsim.core
-import shapely.geometry
-
-from pint import UnitRegistry
 import opentnsim.core
 
 import dtv_backend.berthing
-
-
-ureg = UnitRegistry()
+import dtv_backend.edge_quantities
+import dtv_backend.energy
+import dtv_backend.spatial
+import dtv_backend.units
 
 
 logger = logging.getLogger(__name__)
@@ -33,41 +30,37 @@ class CanWork(
         # print(super().__init__)
         super().__init__(*args, **kwargs)
         self.quantity_df = None
+        self._edge_quantities = None
 
     @property
     def max_load(self):
         """return the maximum cargo to load"""
         return self.container.capacity - self.container.level
 
-    def get_waterdepth(self, e):
-        """get a waterdepth for edge e on the geodataframe with bathymetry and waterlevel information (nap_p50)"""
+    @property
+    def edge_quantities(self):
+        """
+        The edge indexed quantities (waterdepth, velocity), see
+        `dtv_backend.edge_quantities.EdgeQuantities`. Normally shared by all ships
+        (see `dtv_backend.simulate.create_ships`), otherwise built from quantity_df.
+        """
+        if self._edge_quantities is None:
+            assert (
+                self.quantity_df is not None
+            ), "we need a quantity_df to compute depths"
+            self._edge_quantities = dtv_backend.edge_quantities.EdgeQuantities(
+                self.quantity_df
+            )
+        return self._edge_quantities
 
-        assert self.quantity_df is not None, "we need a quantity_df to compute depths"
-        quantity_df = self.quantity_df
+    @edge_quantities.setter
+    def edge_quantities(self, edge_quantities):
+        self._edge_quantities = edge_quantities
 
+    def get_waterdepth(self, e):
+        """get a waterdepth for edge e on the geodataframe with bathymetry and waterlevel information (nap_p50)"""
         # TODO: add sealevel
-        #
-        #
-        # similar to a channel
-        default_waterdepth = 6
-
-        # are both source and target in our edge
-        idx = np.logical_and(quantity_df.source.isin(e), quantity_df.target.isin(e))
-        # lookup the edge
-        selected = quantity_df[idx]
-
-        # did we find records
-        if not selected.shape[0]:
-            # no, return default
-            return default_waterdepth
-
-        quantity_row = selected.iloc[0]
-        if np.isnan(quantity_row["waterlevel"]) or np.isnan(quantity_row["nap_p5"]):
-            return default_waterdepth
-
-        # we found waterlevel and depth, so we can compute the real waterdepth
-        waterdepth = quantity_row["waterlevel"] - quantity_row["nap_p50"]
-        return waterdepth
+        return self.edge_quantities.get_waterdepth(e)
 
     def get_velocity(self, e):
         """
@@ -82,41 +75,9 @@ class CanWork(
         Returns
         -------
         velocity : float
-            velocity in m/s
+            velocity in m/s, negative if we're going against the flow
         """
-
-        assert self.quantity_df is not None, "we need a quantity_df to compute depths"
-        quantity_df = self.quantity_df
-        # similar to a channel
-        default_velocity = 0
-
-        # are both source and target in our edge
-        idx = np.logical_and(quantity_df.source.isin(e), quantity_df.target.isin(e))
-        # lookup the edge
-        selected = quantity_df[idx]
-
-        # did we find records
-        if not selected.shape[0]:
-            # no, return default
-            return default_velocity
-
-        quantity_row = selected.iloc[0]
-        if np.isnan(quantity_row["velocity"]):
-            return default_velocity
-
-        # we found a velocity
-        velocity = quantity_row.velocity
-
-        # Which way is it going?
-        # From source to target
-        if e[0] == quantity_row.source:
-            velocity = velocity
-        else:
-            # We're going against the flow
-            # we're going backward through this edge, velocity should be negative of given velocity
-            velocity = -velocity
-
-        return velocity
+        return self.edge_quantities.get_velocity(e)
 
     def work_for(self, operator, with_berth=False):
         """Work for an operator by listening to tasks"""
@@ -264,6 +225,15 @@ class CanWork(
 
         """
         graph = self.env.FG
+        if hasattr(destination, "node"):
+            destination_node = destination.node
+        elif isinstance(destination, str):
+            destination_node = destination
+        else:
+            raise ValueError(
+                f"destination has no node and is not a string: {destination}"
+            )
+
         if limited:
             width = self.metadata["Beam [m]"]
             length = self.metadata["Length [m]"]
@@ -271,100 +241,42 @@ class CanWork(
             height = self.metadata["Height average [m]"]
             # TODO: validate network dimensions (Duisburg was not reached with Vb)
             path = dtv_backend.fis.shorted_path_by_dimensions(
-                graph, self.node, destination.node, width, height, depth, length
+                graph, self.node, destination_node, width, height, depth, length
             )
         else:
-            if hasattr(destination, "node"):
-                # TODO: rename to shortest_path
-                path = dtv_backend.fis.shorted_path(graph, self.node, destination.node)
-            elif isinstance(destination, str):
-                path = dtv_backend.fis.shorted_path(graph, self.node, destination)
-            else:
-                raise ValueError(
-                    f"destination has no node and is not a string: {destination}"
-                )
+            # TODO: rename to shortest_path
+            path = dtv_backend.fis.shorted_path(graph, self.node, destination_node)
         if not path:
             raise ValueError(f"We need a path to move on {self}")
 
-        total_distance = 0
-        total_duration = 0
         # TODO: move to on_pass_edge
+        edge_list = list(zip(path[:-1], path[1:]))
+        edges = [graph.edges[e] for e in edge_list]
+        distances = np.array([edge["length_m"] for edge in edges], dtype="float64")
+
+        # lookup depth and velocity for the whole path at once
+        depths, velocities = self.edge_quantities.path_quantities(path)
+
+        # use energy module from opentnsim to compute speed, energy and emissions,
+        # once per unique sailing condition
+        sailing = dtv_backend.energy.sail_path(self, distances, depths, velocities)
+        # keep duration if not sailing at constant speed
+        end_durations = np.cumsum(sailing["duration"])
+        total_duration = float(end_durations[-1]) if len(edges) else 0
+        total_distance = float(np.sum(distances))
+        # plain floats per edge for the log
+        sailing = {name: values.tolist() for name, values in sailing.items()}
+
+        # edge geometries and oriented coordinates are shared per network
+        edge_coordinates = dtv_backend.spatial.get_edge_coordinates(graph)
+
+        timestamp = self.env.now
         energy_profile = []
-        for e in zip(path[:-1], path[1:]):
-            edge = graph.edges[e]
-            distance = edge["length_m"]
-
-            # TODO: move this part to on_pass_edge_func
-            # compute power used to pass this edge
-            # use energy module from opentnsim to compute emissions
-            emissions = {}
-            timestamp = self.env.now
-
-            depth = self.get_waterdepth(e)
-            velocity = self.get_velocity(e)
-
-            # # estimate 'grounding speed' as a useful upperbound
-            try:
-                (
-                    upperbound,
-                    selected,
-                    results_df,
-                ) = opentnsim.strategy.get_upperbound_for_power2v(
-                    self, width=150, depth=depth, margin=0
-                )
-            except:
-                upperbound = None
-                logger.warn(f"Could not compute upperbound for e {e}")
-            v = self.power2v(self, edge, upperbound, h_0=depth)
-
-            # true ship velocity - water velocity
-            v = v - velocity
-
-            # sail at least 0.1 m/s
-            v = max(v, 0.1)
-
-            # TODO: add some warning if we get below 0.1m/s
-            # sail at least 0.1 m / s
-            # v = min(v, 0.1)
-
-            # # use computed power
-            power_given = self.P_given
-
-            # duration in s
-            duration = distance / v
-            # keep duration if not sailing at constant speed
-            total_duration += duration
-
-            # energy used over edge W(s /  s/h -> s * h /s -> h) -> Wh
-            energy = power_given * (duration / 3600)
-
-            self.calculate_total_resistance(v, h_0=depth)
-            self.calculate_total_power_required(v=v, h_0=depth)
-
-            self.calculate_emission_factors_total(v=v, h_0=depth)
-            self.calculate_SFC_final(v=v, h_0=depth)
-
-            delta_diesel_C_year = self.final_SFC_diesel_C_year_ICE_mass * energy  # in g
-            delta_diesel_ICE_mass = self.final_SFC_diesel_ICE_mass * energy  # in g
-            # in m3
-            delta_diesel_ICE_vol = self.final_SFC_diesel_ICE_vol * energy
-
-            emission_delta_CO2 = (
-                self.total_factor_CO2 * energy
-            )  # Energy consumed per time step delta_t in the                                                                                              #stationary phase # in g
-            emission_delta_PM10 = self.total_factor_PM10 * energy  # in g
-            emission_delta_NOX = self.total_factor_NOX * energy  # in g
-            # in grams
-            emissions = {
-                "CO2": emission_delta_CO2,
-                "PM10": emission_delta_PM10,
-                "NOX": emission_delta_NOX,
-            }
-
-            edge_geom = shapely.wkt.loads(edge["Wkt"])
+        for i, (e, edge) in enumerate(zip(edge_list, edges)):
+            edge_geom = edge_coordinates.edge_geometry(*e)
             #
             t = datetime.datetime.utcfromtimestamp(timestamp) + datetime.timedelta(
-                seconds=total_duration
+                seconds=float(end_durations[i])
             )
 
             energy_profile.append(
@@ -372,18 +284,20 @@ class CanWork(
                     "e": e,
                     "geometry": edge_geom,
                     "t": t,
-                    "duration": duration,
-                    "power": power_given,
-                    "energy": energy,
-                    "fuel": delta_diesel_ICE_vol,
-                    "distance": distance,
+                    "duration": sailing["duration"][i],
+                    "power": sailing["power"][i],
+                    "energy": sailing["energy"][i],
+                    "fuel": sailing["fuel"][i],
+                    "distance": edge["length_m"],
                     "edge": edge,
-                    "upperbound": upperbound,
-                    "v": v,
-                    **emissions,
+                    "upperbound": sailing["upperbound"][i],
+                    "v": sailing["v"][i],
+                    # in grams
+                    "CO2": sailing["CO2"][i],
+                    "PM10": sailing["PM10"][i],
+                    "NOX": sailing["NOX"][i],
                 }
             )
-            total_distance += distance
 
         # finished sailing
         # move to destination
@@ -396,20 +310,8 @@ class CanWork(
         if len(path) < 2:
             path_geometry = self.geometry
         else:
-            # extrect the geometry
-            path_df = dtv_backend.network.network_utilities.path2gdf(path, graph)
-
-            #
-            path_geometry = shapely.ops.linemerge(path_df["geometry"].values)
-            start_point = graph.nodes[path_df.iloc[0]["start_node"]]["geometry"]
-            end_point = graph.nodes[path_df.iloc[-1]["end_node"]]["geometry"]
-            first_path_point = shapely.geometry.Point(path_geometry.coords[0])
-            # reverse if needed
-            start_distance = start_point.distance(first_path_point)
-            end_distance = end_point.distance(first_path_point)
-            if start_distance > end_distance:
-                # invert geometry
-                path_geometry = shapely.geometry.LineString(path_geometry.coords[::-1])
+            # concatenate the oriented edge coordinates
+            path_geometry = edge_coordinates.path_geometry(path)
 
         with self.log_context(
             message="Sailing",
@@ -479,12 +381,7 @@ class Processor(dtv_backend.logbook.HasLog):
             return self.env.timeout(0)
 
         # tonne / (tonne / hour) -> s
-        load_time = (
-            cargo_to_move
-            * ureg.metric_ton
-            / (self.loading_rate * (ureg.metric_ton / ureg.hour))
-        )
-        load_time = load_time.to(ureg.second).magnitude
+        load_time = dtv_backend.units.load_time(cargo_to_move, self.loading_rate)
 
         # log cargo levels before/after
         with self.log_context(
@@ -0,0 +1,235 @@
+"""
+Distances and paths between a set of terminals (ports, berths, sea nodes).
+
+A `DistanceMatrix` runs one multi-source Dijkstra from all terminals on the compact
+graph (see `dtv_backend.compact_graph`) and keeps the shortest path trees as
+distance and predecessor arrays. Distance queries are a lookup, path and structure
+queries walk the predecessor array (linear in the length of the path).
+
+For directed networks the trees towards the terminals are computed on first use, so
+that both terminal to node and node to terminal queries are answered from the
+precomputation.
+"""
+
+import functools
+import logging
+
+import networkx as nx
+import numpy as np
+
+import dtv_backend.compact_graph
+import dtv_backend.fis
+
+logger = logging.getLogger(__name__)
+
+
+class DistanceMatrix:
+    """
+    Shortest path trees from (and towards) a set of terminals.
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        The network.
+    terminals : sequence
+        The node ids of the terminals, for example ports, berths and sea nodes.
+    weight : str or None, optional
+        The edge attribute to use as weight. The default is "length_m". Use None to
+        count the number of edges.
+    edge_mask : numpy.ndarray, optional
+        Boolean array over the edges of the compact graph, edges that are False are
+        not used (see `dtv_backend.fis.dimension_mask`).
+    """
+
+    def __init__(self, graph, terminals, weight="length_m", edge_mask=None):
+        """Compute the shortest path trees from all terminals."""
+        self.graph = graph
+        self.compact_graph = dtv_backend.compact_graph.get_compact_graph(graph)
+        self.terminals = list(dict.fromkeys(terminals))
+        self.terminal_index = {terminal: i for i, terminal in enumerate(self.terminals)}
+        self.weight = weight
+        self.edge_mask = edge_mask
+
+        distances, predecessors = self.compact_graph.shortest_path_tree(
+            self.terminals, weight=weight, edge_mask=edge_mask
+        )
+        self.distances = distances
+        self.predecessors = predecessors.astype(np.int32)
+        self._reverse = None
+        self._structure_edges = None
+        logger.info(
+            "Computed distance matrix for %s terminals (%.1fMB)",
+            len(self.terminals),
+            self.nbytes / 1000**2,
+        )
+
+    @property
+    def nbytes(self):
+        """the memory used by the trees in bytes"""
+        nbytes = self.distances.nbytes + self.predecessors.nbytes
+        if self._reverse is not None:
+            nbytes += sum(array.nbytes for array in self._reverse)
+        return nbytes
+
+    @property
+    def reverse_trees(self):
+        """distances and predecessors of the trees towards the terminals"""
+        if not self.compact_graph.directed:
+            return self.distances, self.predecessors
+        if self._reverse is None:
+            distances, predecessors = self.compact_graph.shortest_path_tree(
+                self.terminals,
+                weight=self.weight,
+                edge_mask=self.edge_mask,
+                reverse=True,
+            )
+            self._reverse = (distances, predecessors.astype(np.int32))
+        return self._reverse
+
+    def _tree(self, source, target):
+        """
+        Select the tree that answers a query from source to target.
+
+        Returns the distances, predecessors, index of the node to lookup and whether
+        the tree runs towards the terminal.
+        """
+        if source in self.terminal_index:
+            i = self.terminal_index[source]
+            node_idx = self.compact_graph.index(target)
+            return self.distances[i], self.predecessors[i], node_idx, False
+        if target in self.terminal_index:
+            i = self.terminal_index[target]
+            node_idx = self.compact_graph.index(source)
+            distances, predecessors = self.reverse_trees
+            return distances[i], predecessors[i], node_idx, True
+        raise KeyError(f"Neither {source} nor {target} is a terminal")
+
+    def distance(self, source, target):
+        """
+        Return the length of the shortest path from source to target. One of source
+        or target should be a terminal.
+
+        Returns
+        -------
+        float
+            The distance, inf if target can not be reached.
+        """
+        distances, _, node_idx, _ = self._tree(source, target)
+        return float(distances[node_idx])
+
+    def distances_from(self, source, targets):
+        """
+        Return the distances from a terminal to many targets.
+
+        Returns
+        -------
+        numpy.ndarray
+            The distances, inf for targets that can not be reached.
+        """
+        target_idx = [self.compact_graph.index(target) for target in targets]
+        return self.distances[self.terminal_index[source], target_idx]
+
+    def distances_to(self, sources, target):
+        """
+        Return the distances from many sources to a terminal.
+
+        Returns
+        -------
+        numpy.ndarray
+            The distances, inf for sources that can not reach the target.
+        """
+        distances, _ = self.reverse_trees
+        source_idx = [self.compact_graph.index(source) for source in sources]
+        return distances[self.terminal_index[target], source_idx]
+
+    def path(self, source, target):
+        """
+        Return the shortest path from source to target as a list of node ids. One of
+        source or target should be a terminal.
+
+        Raises
+        ------
+        networkx.NetworkXNoPath
+            If target can not be reached from source.
+        """
+        distances, predecessors, node_idx, reverse = self._tree(source, target)
+        if np.isinf(distances[node_idx]):
+            raise nx.NetworkXNoPath(f"No path between {source} and {target}.")
+        path_idx = self.compact_graph.path_from_tree(predecessors, node_idx)
+        if reverse:
+            path_idx = path_idx[::-1]
+        return self.compact_graph.nodes[path_idx].tolist()
+
+    @property
+    def structure_edges(self):
+        """boolean array over the compact graph edges, True for structures"""
+        if self._structure_edges is None:
+            compact_graph = self.compact_graph
+            sources = compact_graph.nodes[compact_graph.sources]
+            targets = compact_graph.nodes[compact_graph.targets]
+            self._structure_edges = np.array(
+                [
+                    dtv_backend.fis.extract_structure((source, target)) is not None
+                    for source, target in zip(sources, targets)
+                ],
+                dtype=bool,
+            )
+        return self._structure_edges
+
+    def has_structures(self, source, target):
+        """
+        Are there any structures (locks, bridges) on the shortest path from source to
+        target? See `dtv_backend.fis.has_structures`.
+        """
+        path = self.path(source, target)
+        return bool(np.any(self.structure_edges[self.compact_graph.edge_ids(path)]))
+
+
+@functools.lru_cache(maxsize=32)
+def get_distance_matrix(graph, terminals, weight="length_m"):
+    """
+    Return the distance matrix for a graph and a tuple of terminals. It is computed
+    on first use.
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        The network.
+    terminals : tuple
+        The node ids of the terminals.
+    weight : str or None, optional
+        The edge attribute to use as weight. The default is "length_m".
+
+    Returns
+    -------
+    DistanceMatrix
+        The distance matrix.
+    """
+    return DistanceMatrix(graph, terminals, weight=weight)
+
+
+@functools.lru_cache(maxsize=32)
+def get_berth_distance_matrix(graph, berth_keyword="Berth", weight="length_m"):
+    """
+    Return the distance matrix from and towards all berths of a graph. The berths
+    (nodes that start with berth_keyword) are looked up once per graph, see
+    `get_distance_matrix`.
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        The network.
+    berth_keyword : str, optional
+        The prefix of the berth nodes. The default is "Berth".
+    weight : str or None, optional
+        The edge attribute to use as weight. The default is "length_m".
+
+    Returns
+    -------
+    DistanceMatrix
+        The distance matrix.
+    """
+    berth_nodes = tuple(
+        n for n in graph.nodes if isinstance(n, str) and n.startswith(berth_keyword)
+    )
+    return get_distance_matrix(graph, berth_nodes, weight=weight)
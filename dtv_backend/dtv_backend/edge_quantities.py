@@ -0,0 +1,132 @@
+"""
+Edge indexed lookup of quantities (waterdepth, velocity) for a simulation.
+
+The quantities come from the bathymetry features in the configuration (see
+`dtv_backend.simulate.create_quantity_df`). The table is indexed once per simulation
+and shared by all ships, so a lookup per edge (or per path) does not scan the table.
+"""
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# similar to a channel
+default_waterdepth = 6
+default_velocity = 0
+
+
+class EdgeQuantities:
+    """
+    Lookup of waterdepth and velocity by edge.
+
+    Edges can be looked up in both directions. The velocity is given in the direction
+    of the quantity record (source to target) and is negated when sailing the edge
+    from target to source. If a table contains several records for an edge the first
+    one is used.
+
+    Parameters
+    ----------
+    quantity_df : pandas.DataFrame
+        Table with source, target, waterlevel, nap_p5, nap_p50 and velocity columns.
+    """
+
+    def __init__(self, quantity_df):
+        """Index the quantity table by edge."""
+        n = len(quantity_df)
+
+        def column(name):
+            if name not in quantity_df:
+                return np.full(n, np.nan)
+            return np.array(quantity_df[name], dtype="float64")
+
+        waterlevel = column("waterlevel")
+        # we need waterlevel and depth to compute the real waterdepth
+        waterdepth = waterlevel - column("nap_p50")
+        missing = np.isnan(waterlevel) | np.isnan(column("nap_p5"))
+        waterdepth[missing] = default_waterdepth
+        self.waterdepth = waterdepth
+
+        velocity = column("velocity")
+        velocity[np.isnan(velocity)] = default_velocity
+        self.velocity = velocity
+
+        # row and direction per (source, target), the first record wins
+        self.index = {}
+        sources = quantity_df["source"].tolist() if n else []
+        targets = quantity_df["target"].tolist() if n else []
+        for i, (source, target) in enumerate(zip(sources, targets)):
+            self.index.setdefault((source, target), (i, 1.0))
+            self.index.setdefault((target, source), (i, -1.0))
+        logger.debug("Indexed quantities for %s edges", n)
+
+    def __len__(self):
+        return len(self.waterdepth)
+
+    def get_waterdepth(self, e):
+        """
+        Get the waterdepth for edge e.
+
+        Parameters
+        ----------
+        e : tuple
+            edge as (source, target)
+
+        Returns
+        -------
+        waterdepth : float
+            waterdepth in m
+        """
+        row = self.index.get(tuple(e))
+        if row is None:
+            return default_waterdepth
+        return self.waterdepth[row[0]]
+
+    def get_velocity(self, e):
+        """
+        Get the velocity for edge e, negative when sailing against the flow.
+
+        Parameters
+        ----------
+        e : tuple
+            edge as (source, target)
+
+        Returns
+        -------
+        velocity : float
+            velocity in m/s
+        """
+        row = self.index.get(tuple(e))
+        if row is None:
+            return default_velocity
+        i, direction = row
+        return direction * self.velocity[i]
+
+    def path_quantities(self, path):
+        """
+        Get the waterdepth and velocity for all edges of a path.
+
+        Parameters
+        ----------
+        path : list
+            The path as a list of nodes.
+
+        Returns
+        -------
+        waterdepth : numpy.ndarray
+            waterdepth per edge in m
+        velocity : numpy.ndarray
+            velocity per edge in m/s, negative when sailing against the flow
+        """
+        rows = [self.index.get(e) for e in zip(path[:-1], path[1:])]
+        found = np.array([row is not None for row in rows], dtype=bool)
+        idx = np.array([row[0] if row else 0 for row in rows], dtype=int)
+        direction = np.array([row[1] if row else 0.0 for row in rows])
+
+        waterdepth = np.full(len(rows), float(default_waterdepth))
+        velocity = np.full(len(rows), float(default_velocity))
+        if found.any():
+            waterdepth[found] = self.waterdepth[idx[found]]
+            velocity[found] = direction[found] * self.velocity[idx[found]]
+        return waterdepth, velocity
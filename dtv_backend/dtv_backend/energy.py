@@ -0,0 +1,368 @@
+"""
+Sailing energy and emissions for a whole path.
+
+The opentnsim energy functions (power2v, resistance, power, emission factors and SFC)
+are scalar and depend only on the ship and the sailing conditions (waterdepth and
+current). Most edges of a trip (and all edges of a repeated trip) share their
+conditions, so the values are computed once per (ship, depth, current) and stored
+in a bounded cache that is shared by all ships. The duration, energy, fuel and
+emissions of the edges are then computed as arrays.
+"""
+
+import collections
+import logging
+import math
+import threading
+
+import numpy as np
+import opentnsim.strategy
+
+logger = logging.getLogger(__name__)
+
+# vessel attributes that determine the resistance, power and emissions
+vessel_attributes = [
+    "type",
+    "B",
+    "L",
+    "T",
+    "C_B",
+    "C_BB",
+    "c_stern",
+    "one_k2",
+    "bulbous_bow",
+    "karpov_correction",
+    "h_squat",
+    "safety_margin",
+    "P_installed",
+    "P_tot_given",
+    "P_hotel_perc",
+    "P_hotel",
+    "L_w",
+    "C_year",
+    "current_year",
+    "nu",
+    "rho",
+    "g",
+    "x",
+    "D_s",
+    "eta_o",
+    "eta_r",
+    "eta_t",
+    "eta_g",
+]
+
+# sail at least 0.1 m/s
+minimum_velocity = 0.1
+
+
+def vessel_key(vessel):
+    """
+    Return a hashable key of the hydrodynamic and engine parameters of a vessel.
+    Vessels with the same key have the same energy use in the same conditions.
+    """
+    return tuple(getattr(vessel, attribute, None) for attribute in vessel_attributes)
+
+
+def quantize(value, resolution=None):
+    """round value to a multiple of resolution (no rounding if resolution is None)"""
+    if resolution is None:
+        return float(value)
+    return float(np.round(value / resolution) * resolution)
+
+
+class MemoCache:
+    """
+    Least recently used cache with hit statistics.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        The maximum number of items to keep. The default is 10000.
+    """
+
+    def __init__(self, maxsize=10000):
+        """Create an empty cache."""
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached value for key or compute and store it.
+
+        Parameters
+        ----------
+        key : tuple
+            The key.
+        compute : callable
+            Function without arguments that returns the value.
+        """
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._items[key] = value
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return value
+
+    def clear(self):
+        """remove all items and reset the counters"""
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Return cache statistics.
+
+        Returns
+        -------
+        dict
+            hits, misses, hit_rate, size and maxsize.
+        """
+        n_requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / n_requests if n_requests else 0.0,
+            "size": len(self._items),
+            "maxsize": self.maxsize,
+        }
+
+
+# sailing conditions shared by all ships in this process
+condition_cache = MemoCache(maxsize=100000)
+# grounding speed upper bounds shared by all ships in this process
+upperbound_cache = MemoCache(maxsize=10000)
+
+
+def quantize_down(value, resolution):
+    """
+    Round value down to a multiple of resolution. Values that are a multiple up to
+    float error (0.29 / 0.01 = 28.999999999999996) are kept.
+    """
+    steps = math.floor(value / resolution + 1e-9)
+    return round(steps * resolution, 10)
+
+
+def get_upperbound(
+    vessel,
+    depth,
+    width=150,
+    margin=0,
+    depth_resolution=0.01,
+    width_resolution=1.0,
+    cache=None,
+):
+    """
+    Estimate the 'grounding speed' of a vessel as a useful upperbound for power2v,
+    see `opentnsim.strategy.get_upperbound_for_power2v`. The computation searches
+    over velocities, so it is cached per vessel parameters and quantized depth and
+    width. Depths are rounded down, which gives a (slightly) lower bound.
+
+    Parameters
+    ----------
+    vessel : opentnsim.energy.ConsumesEnergy
+        The vessel.
+    depth : float
+        waterdepth in m
+    width : float, optional
+        waterway width in m. The default is 150.
+    margin : float, optional
+        safety margin in m. The default is 0.
+    depth_resolution : float, optional
+        Round depths down to this resolution [m]. The default is 0.01.
+    width_resolution : float, optional
+        Round widths down to this resolution [m]. The default is 1.
+    cache : MemoCache, optional
+        The cache of upperbounds. The default is `upperbound_cache`.
+
+    Returns
+    -------
+    upperbound : float or None
+        The upperbound in m/s or None if no grounding speed could be found.
+    """
+    if cache is None:
+        cache = upperbound_cache
+    depth = quantize_down(depth, depth_resolution)
+    width = quantize_down(width, width_resolution)
+
+    def compute():
+        try:
+            upperbound, _, _ = opentnsim.strategy.get_upperbound_for_power2v(
+                vessel, width=width, depth=depth, margin=margin
+            )
+        except Exception as e:
+            # no solution for the grounding speed (for example too shallow), or
+            # another failure in opentnsim, sail without upperbound
+            logger.warning(
+                "Could not compute upperbound for depth %s and width %s: %s",
+                depth,
+                width,
+                e,
+            )
+            upperbound = None
+        return upperbound
+
+    key = (vessel_key(vessel), depth, width, margin)
+    return cache.get_or_compute(key, compute)
+
+
+def condition_edge(depth):
+    """
+    Return an edge with only the attributes that power2v reads (the waterdepth), so
+    that conditions computed for it do not depend on other edge data.
+    """
+    return {"Info": {"GeneralDepth": depth}}
+
+
+def compute_conditions(vessel, edge, depth, velocity):
+    """
+    Compute the sailing velocity, power, fuel use and emission factors of a vessel
+    for a waterdepth and current velocity. This calls the (scalar) opentnsim energy
+    functions and updates the state of the vessel.
+
+    Parameters
+    ----------
+    vessel : opentnsim.energy.ConsumesEnergy
+        The vessel.
+    edge : dict
+        An edge with these conditions, passed to power2v, see `condition_edge`.
+    depth : float
+        waterdepth in m
+    velocity : float
+        current velocity in m/s, positive when sailing with the flow
+
+    Returns
+    -------
+    dict
+        upperbound, v (over ground) [m/s], power [W], fuel [m3/Wh] and the
+        CO2, PM10 and NOX emission factors [g/Wh].
+    """
+    # estimate 'grounding speed' as a useful upperbound
+    upperbound = get_upperbound(vessel, depth=depth)
+    v = vessel.power2v(vessel, edge, upperbound, h_0=depth)
+
+    # true ship velocity - water velocity
+    v = v - velocity
+
+    # sail at least 0.1 m/s
+    # TODO: add some warning if we get below 0.1m/s
+    v = max(v, minimum_velocity)
+
+    # use computed power
+    power_given = vessel.P_given
+
+    vessel.calculate_total_resistance(v, h_0=depth)
+    vessel.calculate_total_power_required(v=v, h_0=depth)
+
+    vessel.calculate_emission_factors_total(v=v, h_0=depth)
+    vessel.calculate_SFC_final(v=v, h_0=depth)
+
+    return {
+        "upperbound": upperbound,
+        "v": v,
+        "power": power_given,
+        "fuel": vessel.final_SFC_diesel_ICE_vol,
+        "CO2": vessel.total_factor_CO2,
+        "PM10": vessel.total_factor_PM10,
+        "NOX": vessel.total_factor_NOX,
+    }
+
+
+def sail_path(
+    vessel,
+    distances,
+    depths,
+    velocities,
+    depth_resolution=None,
+    velocity_resolution=None,
+    cache=None,
+):
+    """
+    Compute velocity, duration, energy, fuel and emissions for all edges of a path.
+
+    Parameters
+    ----------
+    vessel : opentnsim.energy.ConsumesEnergy
+        The vessel.
+    distances : numpy.ndarray
+        edge lengths in m
+    depths : numpy.ndarray
+        waterdepth per edge in m
+    velocities : numpy.ndarray
+        current velocity per edge in m/s, positive when sailing with the flow
+    depth_resolution : float, optional
+        Round the depths to this resolution before the computation. The default is
+        None (no rounding), which gives exactly the scalar results.
+    velocity_resolution : float, optional
+        Round the current velocities to this resolution. The default is None.
+    cache : MemoCache, optional
+        The cache of sailing conditions. The default is `condition_cache`.
+
+    Returns
+    -------
+    dict
+        Arrays per edge: upperbound, v [m/s], duration [s], power [W], energy [Wh],
+        fuel [m3] and CO2, PM10, NOX [g].
+    """
+    if cache is None:
+        cache = condition_cache
+    key_vessel = vessel_key(vessel)
+    distances = np.asarray(distances, dtype="float64")
+
+    # compute each unique condition once
+    keys = {}
+    table = []
+    condition_idx = np.empty(len(distances), dtype=int)
+    for i, (depth, velocity) in enumerate(zip(depths, velocities)):
+        key = (
+            key_vessel,
+            quantize(depth, depth_resolution),
+            quantize(velocity, velocity_resolution),
+        )
+        if key not in keys:
+            keys[key] = len(table)
+            # the conditions only depend on the key, not on the edge data
+            table.append(
+                cache.get_or_compute(
+                    key,
+                    lambda: compute_conditions(
+                        vessel, condition_edge(key[1]), key[1], key[2]
+                    ),
+                )
+            )
+        condition_idx[i] = keys[key]
+
+    def column(name, dtype="float64"):
+        return np.array([row[name] for row in table], dtype=dtype)[condition_idx]
+
+    v = column("v")
+    power = column("power")
+    # duration in s
+    duration = distances / v
+    # energy used over edge W(s /  s/h -> s * h /s -> h) -> Wh
+    energy = power * (duration / 3600)
+    return {
+        "upperbound": column("upperbound", dtype=object),
+        "v": v,
+        "duration": duration,
+        "power": power,
+        "energy": energy,
+        # fuel in m3, emissions in g
+        "fuel": column("fuel") * energy,
+        "CO2": column("CO2") * energy,
+        "PM10": column("PM10") * energy,
+        "NOX": column("NOX") * energy,
+    }
@@ -2,9 +2,11 @@
 Utilities to work with the Fairway Information System (FIS) network.
 """
 import functools
+import hashlib
 import io
 import itertools
 import logging
+import os
 import pathlib
 import re
 import tempfile
@@ -18,8 +20,6 @@ import numpy as np
 import pandas as pd
 import pyproj
 import requests
-import requests_cache
-import scipy.interpolate
 import shapely
 import shapely.geometry
 import shapely.wkt
@@ -27,10 +27,23 @@ from pandas.api.types import CategoricalDtype
 
 
 import dtv_backend
+import dtv_backend.compact_graph
+import dtv_backend.distance_matrix
+import dtv_backend.network_cache
+import dtv_backend.route_cache
+import dtv_backend.spatial
 
 
-# cache all http requests for stability and performance
-requests_cache.install_cache("requests_cache")
+def install_requests_cache(cache_name="requests_cache"):
+    """
+    Cache all http requests (in a sqlite file) for stability and performance. This
+    patches requests globally, so it is done on first download and not on import.
+    """
+    import requests_cache
+
+    if not requests_cache.is_installed():
+        requests_cache.install_cache(cache_name)
+
 
 # add pairwise to itertools for python < 3.10
 if not hasattr(itertools, "pairwise"):
@@ -51,6 +64,10 @@ package_path = pathlib.Path(__file__).parent.parent
 # define the coorinate system
 geod = pyproj.Geod(ellps="WGS84")
 
+# Which implementation to use for shortest paths: "networkx" (dict of dicts) or
+# "compact" (CSR arrays, see dtv_backend.compact_graph)
+routing_backend = os.environ.get("DTV_ROUTING_BACKEND", "networkx")
+
 
 # The network version 0.1 contains the lat/lon distance in a length property.
 # But we need the "great circle" or projected distance.
@@ -81,20 +98,11 @@ def edge_length(edge):
 # now create the function can load the network
 
 
-# store the result so it will immediately give a result
-@functools.lru_cache(maxsize=100)
-def load_fis_network(url):
+def _read_fis_network(url, data_path):
     """
-    Load the topological fairway information system network.
-    
-    Parameters
-    ----------
-    maxsize : int
-        The maximum size of the cache.
+    Read the pickled topological network, from the local data_path if available,
+    otherwise from url.
     """
-    # TODO: check for local location
-    data_dir = "~/data/river/dtv/fis/0.3/network_digital_twin_v0.3.pickle"
-    data_path = pathlib.Path(data_dir).expanduser()
     if data_path.exists():
         filename = str(data_path)
         n_bytes = data_path.stat().st_size
@@ -102,6 +110,7 @@ def load_fis_network(url):
             G = pickle.load(file)
     else:
         # get the data from the url
+        install_requests_cache()
         resp = requests.get(url)
         # convert to file object
         stream = io.StringIO(resp.text)
@@ -143,10 +152,93 @@ def load_fis_network(url):
     return G
 
 
+# store the result so it will immediately give a result
+@functools.lru_cache(maxsize=100)
+def load_fis_network(url, use_cache=True):
+    """
+    Load the topological fairway information system network.
+
+    The geometrized network is stored in a binary cache (see
+    `dtv_backend.network_cache`), so that next processes can skip the unpickling
+    and the WKT parsing.
+
+    Parameters
+    ----------
+    url : str
+        The url of the pickled network.
+    use_cache : bool, optional
+        Read from and write to the binary network cache. The default is True.
+
+    Returns
+    -------
+    G : networkx.Graph
+        The network with shapely geometries for nodes and edges.
+    """
+    # TODO: check for local location
+    data_dir = "~/data/river/dtv/fis/0.3/network_digital_twin_v0.3.pickle"
+    data_path = pathlib.Path(data_dir).expanduser()
+
+    if not use_cache:
+        return _read_fis_network(url, data_path)
+
+    key = dtv_backend.network_cache.cache_key(
+        url, path=data_path if data_path.exists() else None
+    )
+    cache = dtv_backend.network_cache.open_cache(key)
+    if cache is not None:
+        G = cache.to_graph()
+        logger.info(
+            "Loaded network from cache %s. Network has %s nodes and %s edges.",
+            cache.cache_path,
+            len(G.nodes),
+            len(G.edges),
+        )
+        _attach_compact_graph(G, cache.cache_path)
+        return G
+
+    G = _read_fis_network(url, data_path)
+    # identifies the network in the route cache
+    G.graph["network_key"] = key
+    cache_path = dtv_backend.network_cache.get_cache_dir() / key
+    try:
+        dtv_backend.network_cache.write_cache(
+            G,
+            cache_path,
+            source={"url": url, "key": key},
+        )
+    except OSError as e:
+        # a missing cache only costs performance
+        logger.warning("Could not write network cache: %s", e)
+        return G
+    _attach_compact_graph(G, cache_path)
+    return G
+
+
+def _attach_compact_graph(G, cache_path):
+    """
+    Use the memory-mapped routing arrays of the network cache for G, so that all
+    processes share them. They are written to the cache if they are missing.
+    """
+    try:
+        cache = dtv_backend.network_cache.NetworkCache(cache_path)
+        compact_graph = cache.compact_graph()
+        if compact_graph is None:
+            dtv_backend.network_cache.write_compact_graph(
+                dtv_backend.compact_graph.CompactGraph.from_networkx(G), cache_path
+            )
+            compact_graph = cache.compact_graph()
+    except (OSError, ValueError) as e:
+        # the compact graph is then built in this process
+        logger.warning("Could not use cached compact graph: %s", e)
+        return
+    dtv_backend.compact_graph.register_compact_graph(G, compact_graph)
+
+
 def find_closest_node(G, point):
     """
     Find the node on graph G that is closest to the given
-    shapely.geometry.Point point
+    shapely.geometry.Point point. Uses the spatial index of the graph, see
+    `dtv_backend.spatial.get_network_index`.
 
     Parameters
     ----------
@@ -163,17 +255,15 @@ def find_closest_node(G, point):
         The distance to the closest node.
 
     """
-    distance = np.full((len(G.nodes)), fill_value=np.nan)
-    for ii, n in enumerate(G.nodes):
-        distance[ii] = point.distance(G.nodes[n]["geometry"])
-    name_node = list(G.nodes)[np.argmin(distance)]
-    distance_node = np.min(distance)
+    index = dtv_backend.spatial.get_network_index(G)
+    name_node, distance_node = index.nearest_node(point)
     return name_node, distance_node
 
 
 def find_closest_edge(G, point):
     """
-    Find the edge on graph G that is closest to the given.
+    Find the edge on graph G that is closest to the given point (by Hausdorff
+    distance). Uses the spatial index of the graph.
 
     Parameters
     ----------
@@ -190,15 +280,8 @@ def find_closest_edge(G, point):
         The distance to the closest edge.
 
     """
-
-    distance = np.full((len(G.edges)), fill_value=np.nan)
-    for ii, e in enumerate(G.edges):
-        # start_node = G.nodes[G.edges[e]['StartJunctionId']]
-        # end_node = G.nodes[G.edges[e]['EndJunctionId']]
-        # distance[ii] = point.distance()
-        distance[ii] = point.hausdorff_distance(shapely.wkt.loads(G.edges[e]["Wkt"]))
-    name_edge = list(G.edges)[np.argmin(distance)]
-    distance_edge = np.min(distance)
+    index = dtv_backend.spatial.get_network_index(G)
+    name_edge, distance_edge = index.nearest_edge(point)
     return name_edge, distance_edge
 
 
@@ -230,6 +313,8 @@ def determine_max_draught_on_path(
         The maximum draught on the route in meters.
 
     """
+    import scipy.interpolate
+
     # TODO: the file "depth.csv" is missing... this should be loaded as discharge_df
 
     # if cache.get((origin.geometry, destination.geometry, lobith_discharge)):
@@ -274,10 +359,10 @@ def determine_max_draught_on_path(
     # merge back together
     depth_df = pd.merge(depth_df, depth_locations_df, left_index=True, right_index=True)
 
-    # lookup closest locations
-    location_edge = {}
-    for name, row in depth_df.iterrows():
-        location_edge[name] = find_closest_edge(graph, row.geometry)[0]
+    # lookup closest locations (all at once)
+    index = dtv_backend.spatial.get_network_index(graph)
+    closest_edges, _ = index.nearest_edges(depth_df.geometry.values)
+    location_edge = dict(zip(depth_df.index, closest_edges))
     # merge closest edges with the table
     edges_df = pd.DataFrame(location_edge).T.rename(
         columns={0: "edge_from", 1: "edge_to"}
@@ -347,12 +432,62 @@ def determine_max_layers(height):
     return max_layers
 
 
+# edge attributes with the limiting dimensions of a fairway section
+dimension_attributes = {
+    "width": "GeneralWidth",
+    "height": "GeneralHeight",
+    "depth": "GeneralDepth",
+    "length": "GeneralLength",
+}
+
+
+@functools.lru_cache(maxsize=256)
+def dimension_mask(graph, width, height, depth, length):
+    """
+    Determine which edges of graph can be passed by a ship with the given dimensions.
+
+    The limiting dimensions are read from the arrays of the compact graph (see
+    `dtv_backend.compact_graph.get_compact_graph`), which are built once per network.
+    Edges without a known limit (missing or NaN) can be passed.
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        The network.
+    width : float
+        The width of the ship in meters.
+    height : float
+        The height of the ship in meters.
+    depth : float
+        The draught of the ship in meters.
+    length : float
+        The length of the ship in meters.
+
+    Returns
+    -------
+    mask : numpy.ndarray
+        Boolean array with a value per edge of the compact graph.
+    """
+    compact_graph = dtv_backend.compact_graph.get_compact_graph(graph)
+    dimensions = {"width": width, "height": height, "depth": depth, "length": length}
+    mask = np.ones(compact_graph.n_edges, dtype=bool)
+    for dimension, value in dimensions.items():
+        # unknown ship dimensions do not constrain the route
+        if value is None or np.isnan(value):
+            continue
+        limit = compact_graph.edge_attributes[dimension_attributes[dimension]]
+        mask &= np.isnan(limit) | (limit >= value)
+    mask.flags.writeable = False
+    return mask
+
+
 def shorted_path_by_dimensions(
-    graph, source, destination, width, height, depth, length
+    graph, source, destination, width, height, depth, length, weight="length_m"
 ):
     """
-    Create a new constrained graph, based on dimensions, of the same type as 
-    graph and find the shortest path.
+    Find the shortest path for a ship with given dimensions. Edges where one of the
+    dimensions exceeds the limit of the fairway (GeneralWidth, GeneralHeight,
+    GeneralDepth, GeneralLength) are left out, see `dimension_mask`.
     
     Parameters
     ----------
@@ -370,6 +505,8 @@ def shorted_path_by_dimensions(
         The minimum depth in meters.
     length : float
         The minimum length in meters.
+    weight : str, optional
+        The edge attribute to use as weight. The default is "length_m".
 
     Returns
     -------
@@ -377,52 +514,30 @@ def shorted_path_by_dimensions(
         The shortest path as a list of nodes.
 
     """
-    nodes = []
-    edges = []
-    for start_node, end_node, edge in graph.edges(data=True):
-        # GeneralWidth can be missing or None or it should be bigger than width
-        width_ok = (
-            "GeneralWidth" not in edge
-            or np.isnan(edge["GeneralWidth"])
-            or edge["GeneralWidth"] >= width
-        )
-        height_ok = (
-            "GeneralHeight" not in edge
-            or np.isnan(edge["GeneralHeight"])
-            or edge["GeneralHeight"] >= height
-        )
-        depth_ok = (
-            "GeneralDepth" not in edge
-            or edge["GeneralDepth"] >= depth
-            or np.isnan(edge["GeneralDepth"])
-        )
-        length_ok = (
-            "GeneralLength" not in edge
-            or edge["GeneralLength"] >= length
-            or np.isnan(edge["GeneralLength"])
+    dimensions = {
+        "width": width,
+        "height": height,
+        "depth": depth,
+        "length": length,
+    }
+
+    def compute():
+        compact_graph = dtv_backend.compact_graph.get_compact_graph(graph)
+        mask = dimension_mask(graph, **dimensions)
+        return compact_graph.shortest_path(
+            source, destination, weight=weight, edge_mask=mask
         )
-        if all([width_ok, height_ok, depth_ok, length_ok]):
-            edges.append((start_node, end_node))
-            nodes.append(start_node)
-            nodes.append(end_node)
-
-    constrained_graph = graph.__class__()
-
-    for node in nodes:
-        constrained_graph.add_node(node)
-    for edge in edges:
-        constrained_graph.add_edge(edge[0], edge[1])
-
-    path = shorted_path(
-        graph=constrained_graph,
-        source=source,
-        destination=destination,
-        weight="length_m",
+
+    key = dtv_backend.route_cache.route_key(
+        graph, source, destination, weight=weight, constraints=dimensions
     )
+    path = dtv_backend.route_cache.route_cache.get_or_compute(key, compute)
     return path
 
 
-def shorted_path(graph, source, destination, weight="length_m"):
+def shorted_path(
+    graph, source, destination, weight="length_m", backend=None, use_cache=True
+):
     """
     Compute shortest path on a graph.
     
@@ -436,16 +551,76 @@ def shorted_path(graph, source, destination, weight="length_m"):
         The destination node.
     weight : str, optional
         The edge attribute to use as weight. The default is "length_m".
+    backend : str, optional
+        The routing backend, "networkx" or "compact" (see
+        `dtv_backend.compact_graph`). The default is `routing_backend`.
+    use_cache : bool, optional
+        Lookup and store the path in the shared route cache (see
+        `dtv_backend.route_cache`). The default is True.
         
     Returns
     -------
     path : list
         The shortest path as a list of nodes.
     """
-    path = nx.dijkstra_path(graph, source, destination, weight=weight)
+    if backend is None:
+        backend = routing_backend
+
+    def compute():
+        if backend == "compact" and not callable(weight):
+            compact_graph = dtv_backend.compact_graph.get_compact_graph(graph)
+            if weight is None or weight in compact_graph.edge_attributes:
+                return compact_graph.shortest_path(source, destination, weight=weight)
+        return nx.dijkstra_path(graph, source, destination, weight=weight)
+
+    # weight functions can not be part of the key
+    if not use_cache or callable(weight):
+        return compute()
+    key = dtv_backend.route_cache.route_key(graph, source, destination, weight=weight)
+    path = dtv_backend.route_cache.route_cache.get_or_compute(key, compute)
     return path
 
 
+def nodes_within_distance(graph, sources, radius, weight="length_m", backend=None):
+    """
+    Find all nodes that can be reached within radius from any of the sources.
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        The graph to search.
+    sources : list
+        The source nodes.
+    radius : float
+        The maximum distance.
+    weight : str, optional
+        The edge attribute to use as distance. The default is "length_m".
+    backend : str, optional
+        The routing backend, "networkx" or "compact". The default is
+        `routing_backend`.
+
+    Returns
+    -------
+    nodes : set
+        The nodes within radius, including the sources.
+    """
+    if backend is None:
+        backend = routing_backend
+    if backend == "compact" and not callable(weight):
+        compact_graph = dtv_backend.compact_graph.get_compact_graph(graph)
+        if weight is None or weight in compact_graph.edge_attributes:
+            return set(
+                compact_graph.nodes_within_distance(sources, radius, weight=weight)
+            )
+    nodes = set()
+    for source in sources:
+        ego_graph = nx.generators.ego_graph(
+            graph, source, radius=radius, distance=weight
+        )
+        nodes.update(ego_graph.nodes)
+    return nodes
+
+
 def compute_path_length(graph, path, key="length_m"):
     """
     Auxiliary function to compute distance of a path.
@@ -529,9 +704,7 @@ def make_route_gdf(waypoints, network):
     assert len(waypoints) > 0, "there should be at least 1 waypoint"
     route = []
     for segment_i, (source, target) in enumerate(itertools.pairwise(waypoints)):
-        sub_route = nx.shortest_path(
-            network, source=source, target=target, weight="length_m"
-        )
+        sub_route = shorted_path(network, source, target, weight="length_m")
         # TODO: Do we need to add the final point?
         edges = itertools.chain(
             itertools.pairwise(sub_route), [(sub_route[-1], sub_route[-1])]
@@ -643,11 +816,74 @@ def get_route(waypoints, network):
     return route
 
 
+# bathymetry percentiles per edge
+bathy_columns = ["nap_p5", "nap_p50", "nap_p95", "lat_p5", "lat_p50", "lat_p95"]
+bathy_version = "0.3"
+
+
+def _undirected_edge_keys(source, target):
+    """return (lower, upper) node ids as strings, the same for both directions"""
+    source = np.asarray(source, dtype=str)
+    target = np.asarray(target, dtype=str)
+    swap = source > target
+    return np.where(swap, target, source), np.where(swap, source, target)
+
+
+def merge_bathymetry(edges_gdf, bathy_gdf):
+    """
+    Add the bathymetry columns to the edges, matching edges in both directions.
+
+    Parameters
+    ----------
+    edges_gdf : geopandas.GeoDataFrame
+        The edges, with source and target columns.
+    bathy_gdf : pandas.DataFrame
+        The bathymetry per edge, with start-id, end-id and the `bathy_columns`. If
+        an edge occurs more than once, the last record is used.
+
+    Returns
+    -------
+    edges_gdf : geopandas.GeoDataFrame
+        The edges (in the same order) with bathymetry columns, nan for edges
+        without bathymetry.
+    """
+    lower, upper = _undirected_edge_keys(bathy_gdf["start-id"], bathy_gdf["end-id"])
+    bathy_df = pd.DataFrame(
+        {"_lower": lower, "_upper": upper, **{c: bathy_gdf[c] for c in bathy_columns}}
+    ).drop_duplicates(["_lower", "_upper"], keep="last")
+
+    lower, upper = _undirected_edge_keys(edges_gdf["source"], edges_gdf["target"])
+    keys = pd.DataFrame({"_lower": lower, "_upper": upper})
+    values = keys.merge(bathy_df, on=["_lower", "_upper"], how="left")
+    edges_gdf = edges_gdf.copy()
+    for column in bathy_columns:
+        edges_gdf[column] = values[column].to_numpy()
+    return edges_gdf
+
+
+def _edges_gdf_path(graph, bathy_path):
+    """
+    The stored edges of a network loaded with `load_fis_network`, None for other
+    graphs.
+    """
+    key = graph.graph.get("network_key")
+    cache_path = dtv_backend.network_cache.get_cache_dir() / str(key)
+    if key is None or not (cache_path / "manifest.json").exists():
+        return None
+    stat = bathy_path.stat()
+    bathy_key = f"{bathy_path.name}:{stat.st_size}:{stat.st_mtime_ns}"
+    bathy_key = hashlib.sha1(bathy_key.encode()).hexdigest()[:16]
+    return cache_path / f"edges_with_bathy-{bathy_key}.parquet"
+
+
 @functools.lru_cache(maxsize=100)
 def get_edges_gdf(graph):
     """
     Convert graph to edge list of geodataframes, also add bathymetry info. Transform 
     to utm for spatial matching purposes.
+
+    The result is stored as Parquet in the network cache (see
+    `dtv_backend.network_cache`) for networks loaded with `load_fis_network`.
     
     Parameters
     ----------
@@ -660,36 +896,30 @@ def get_edges_gdf(graph):
         The edges as a geopandas dataframe with bathymetry info.
 
     """
-    edges_df = nx.to_pandas_edgelist(graph)
-    edges_gdf = gpd.GeoDataFrame(edges_df, geometry="geometry", crs=4326)
-
     src_path = dtv_backend.get_src_path()
+    bathy_path = src_path / "data" / f"edges_{bathy_version}_with_bathy.geojson"
 
-    version = "0.3"
-
-    bathy_gdf = gpd.read_file(src_path / "data" / f"edges_{version}_with_bathy.geojson")
-    bathy_graph = nx.from_pandas_edgelist(
-        bathy_gdf, source="start-id", target="end-id", edge_attr=True
-    )
+    path = _edges_gdf_path(graph, bathy_path)
+    if path is not None and path.exists():
+        try:
+            return gpd.read_parquet(path)
+        except (ImportError, OSError, ValueError) as e:
+            logger.warning("Could not read edges %s: %s", path, e)
 
-    # lookup corresponding values for each row
-    def get_bathy(row):
-        edge = bathy_graph.edges[row["source"], row["target"]]
-        result = pd.Series(
-            {
-                "nap_p5": edge["nap_p5"],
-                "nap_p50": edge["nap_p50"],
-                "nap_p95": edge["nap_p95"],
-                "lat_p5": edge["lat_p5"],
-                "lat_p50": edge["lat_p50"],
-                "lat_p95": edge["lat_p95"],
-            }
-        )
-        return result
-
-    bathy_columns = edges_gdf.apply(get_bathy, axis=1)
-    # add bathymetry columns
-    edges_gdf = pd.merge(edges_gdf, bathy_columns, left_index=True, right_index=True)
+    edges_df = nx.to_pandas_edgelist(graph)
+    edges_gdf = gpd.GeoDataFrame(edges_df, geometry="geometry", crs=4326)
+    bathy_gdf = gpd.read_file(bathy_path)
+    edges_gdf = merge_bathymetry(edges_gdf, bathy_gdf)
+
+    if path is not None:
+        try:
+            tmp_path = path.with_suffix(f".{os.getpid()}.parquet")
+            edges_gdf.to_parquet(tmp_path)
+            tmp_path.replace(path)
+        except (ImportError, OSError, ValueError, TypeError) as e:
+            # a missing file only costs performance
+            logger.warning("Could not store edges %s: %s", path, e)
+            tmp_path.unlink(missing_ok=True)
     return edges_gdf
 
 
@@ -710,7 +940,7 @@ def has_structures(route, graph):
         True if there are structures on the route, False otherwise.
     """
     has_structures = False
-    for e in pairwise(route):
+    for e in itertools.pairwise(route):
         edge = graph.edges[e]
         structure = extract_structure(e)
         if structure is not None:
@@ -719,10 +949,28 @@ def has_structures(route, graph):
     return has_structures
 
 
+# nodes that connect the network to sea
+sea_nodes = [
+    # rotterdam
+    "8866305",
+    # roompot
+    "8864380",
+    # IJmuiden
+    "8864991",
+    # Den Helder
+    "8867031",
+    # Eemshaven
+    "8863991",
+]
+
+
 def route_to_sea(source, graph):
     """
     Determine if source node has a route to sea on the graph.
 
+    The routes (with the least number of edges) towards all sea nodes are computed
+    once per graph, see `dtv_backend.distance_matrix`.
+
     Parameters
     ----------
     source : str
@@ -735,72 +983,145 @@ def route_to_sea(source, graph):
     route_to_sea : bool
         True if there is a route to sea, False otherwise.
     """
-    sea_nodes = [
-        # rotterdam
-        "8866305",
-        # roompot
-        "8864380",
-        # IJmuiden
-        "8864991",
-        # Den Helder
-        "8867031",
-        # Eemshaven
-        "8863991",
-    ]
+    terminals = tuple(n for n in sea_nodes if n in graph)
+    distance_matrix = dtv_backend.distance_matrix.get_distance_matrix(
+        graph, terminals, weight=None
+    )
     route_to_sea = False
-    for target in sea_nodes:
-        route = nx.shortest_paths.shortest_path(graph, source=source, target=target)
-        if not has_structures(route, graph):
+    for target in terminals:
+        if np.isinf(distance_matrix.distance(source, target)):
+            continue
+        if not distance_matrix.has_structures(source, target):
             route_to_sea = True
             break
     return route_to_sea
 
 
+# CEMT classes ordered from small to large
+cemt_classes = ["0", "I", "II", "III", "IVa", "IVb", "Va", "Vb", "VIa", "VIb"]
+default_ordered_cemt_classes = {
+    cemt_class: rank for rank, cemt_class in enumerate(cemt_classes)
+}
+
+
+@functools.lru_cache(maxsize=100)
+def _cemt_class_layers(graph, ordered_items):
+    """cached implementation of cemt_class_layers, ordered_items is a tuple of items"""
+    ordered_cemt_classes = dict(ordered_items)
+    compact_graph = dtv_backend.compact_graph.get_compact_graph(graph)
+    # rank of the CEMT class of each edge, -1 if the class is unknown
+    category_rank = np.array(
+        [
+            ordered_cemt_classes.get(category, -1)
+            for category in compact_graph.categories["Code"]
+        ]
+        + [-1],
+        dtype=int,
+    )
+    # missing codes (-1) point to the last element
+    edge_rank = category_rank[compact_graph.edge_attributes["Code"]]
+    unknown = edge_rank < 0
+
+    layers = {}
+    for ship_cemt_classe, ship_rank in ordered_cemt_classes.items():
+        mask = unknown | (edge_rank >= ship_rank)
+        mask.flags.writeable = False
+        layers[ship_cemt_classe] = mask
+    return layers
+
+
+def cemt_class_layers(graph, ordered_cemt_classes=None):
+    """
+    Create a routing layer per CEMT class. A layer is a boolean mask over the edges of
+    the compact graph (see `dtv_backend.compact_graph`). Edges with a CEMT class
+    (Code) smaller than the class of the ship are left out. Edges with an unknown
+    class can be used by all ships. The layers are built once per network.
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        The network. Edges should have a CEMT class in 'Code'.
+    ordered_cemt_classes : dict, optional
+        Mapping of CEMT class to rank, from small to large. The default is
+        `default_ordered_cemt_classes`.
+
+    Returns
+    -------
+    layers : dict
+        Mapping of CEMT class to edge mask.
+    """
+    if ordered_cemt_classes is None:
+        ordered_cemt_classes = default_ordered_cemt_classes
+    ordered_items = tuple(sorted(ordered_cemt_classes.items(), key=lambda x: x[1]))
+    return _cemt_class_layers(graph, ordered_items)
+
+
 def path_restricted_to_cemt_class(
-    graph, origin, destination, ship_cemt_classe, ordered_cemt_classes
+    graph,
+    origin,
+    destination,
+    ship_cemt_classe,
+    ordered_cemt_classes=None,
+    weight="length_m",
 ):
     """find a path restricted to allowed cemt classes
 
     Parameters
     ----------
     graph : networkx.Graph
-        graph in which to find a path. graph edges should have information 'cemt'.
+        graph in which to find a path. graph edges should have information 'Code'.
     origin : str
         origin node id
     destination : str
         destination node id
     ship_cemt_classe : str
         cemt class of the ship.
+    ordered_cemt_classes : dict, optional
+        Mapping of CEMT class to rank, from small to large. The default is
+        `default_ordered_cemt_classes`.
+    weight : str, optional
+        The edge attribute to use as weight. The default is "length_m".
     """
-    # define order of cemt classes
+    layers = cemt_class_layers(graph, ordered_cemt_classes)
+    if ship_cemt_classe not in layers:
+        # ships of unknown classes are not restricted
+        return shorted_path(graph, origin, destination, weight=weight)
+
+    def compute():
+        compact_graph = dtv_backend.compact_graph.get_compact_graph(graph)
+        return compact_graph.shortest_path(
+            origin, destination, weight=weight, edge_mask=layers[ship_cemt_classe]
+        )
 
-    # create function to compute weights for this ship
-    compute_weight = functools.partial(
-        __compute_weight,
-        ship_cemt_classe=ship_cemt_classe,
-        ordered_cemt_classes=ordered_cemt_classes,
+    constraints = {
+        "cemt": ship_cemt_classe,
+        "ordered_cemt_classes": ordered_cemt_classes,
+    }
+    key = dtv_backend.route_cache.route_key(
+        graph, origin, destination, weight=weight, constraints=constraints
     )
-
-    # find the path
-    path = nx.dijkstra_path(graph, origin, destination, weight=compute_weight)
+    path = dtv_backend.route_cache.route_cache.get_or_compute(key, compute)
     return path
 
 
 def path_restricted_to_rws_class(
-    graph, origin, destination, ship_rws_classe, ordered_cemt_classes
+    graph, origin, destination, ship_rws_classe, ordered_cemt_classes=None
 ):
     """find a path restricted to allowed cemt classes
 
     Parameters
     ----------
     graph : networkx.Graph
-        graph in which to find a path. graph edges should have information 'cemt'.
+        graph in which to find a path. graph edges should have information 'Code'.
     origin : str
         origin node id
     destination : str
         destination node id
-    ship_cemt_classe : str
-        cemt class of the ship.
+    ship_rws_classe : str
+        RWS class of the ship (M0 - M12).
+    ordered_cemt_classes : dict, optional
+        Mapping of CEMT class to rank, from small to large. The default is
+        `default_ordered_cemt_classes`.
     """
     ship_cemt_classe = __scheepstype_rws_to_cemt(ship_rws_classe)
     return path_restricted_to_cemt_class(
@@ -812,23 +1133,33 @@ def path_restricted_to_rws_class(
     )
 
 
-def __compute_weight(
-    origin, target, dictionary_edge, ship_cemt_classe, ordered_cemt_classes
+def path_restricted_to_ship_class(
+    graph, origin, destination, ship_class, ordered_cemt_classes=None
 ):
-    # order classes from smallest to largest
-
-    if (
-        not dictionary_edge["Code"] in ordered_cemt_classes
-        or not ship_cemt_classe in ordered_cemt_classes
-    ):
-        return dictionary_edge["length_m"]
-    elif (
-        ordered_cemt_classes[dictionary_edge["Code"]]
-        < ordered_cemt_classes[ship_cemt_classe]
-    ):
-        return np.nan
-    else:
-        return dictionary_edge["length_m"]
+    """find a path for a ship given its CEMT class (for example Va) or RWS class
+    (for example M8)
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        graph in which to find a path. graph edges should have information 'Code'.
+    origin : str
+        origin node id
+    destination : str
+        destination node id
+    ship_class : str
+        CEMT or RWS class of the ship.
+    ordered_cemt_classes : dict, optional
+        Mapping of CEMT class to rank, from small to large. The default is
+        `default_ordered_cemt_classes`.
+    """
+    if ship_class in rws_klasse_to_shiplength and re.match(r"^M\d+$", ship_class):
+        return path_restricted_to_rws_class(
+            graph, origin, destination, ship_class, ordered_cemt_classes
+        )
+    return path_restricted_to_cemt_class(
+        graph, origin, destination, ship_class, ordered_cemt_classes
+    )
 
 
 def __scheepstype_rws_to_cemt(rws_classe):
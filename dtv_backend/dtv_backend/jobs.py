@@ -0,0 +1,439 @@
+"""
+Asynchronous simulation jobs.
+
+Simulations take minutes, so the server should not run them in the request thread.
+A `JobManager` runs jobs on a pool of worker processes. Each worker loads the FIS
+network once when it starts (see `init_worker`). Clients get a job id back and can
+poll the status, the progress (simulated time relative to the simulation horizon)
+and the result, or cancel the job.
+
+The queue is local to the server process, no external broker is needed. Job state
+(progress and cancellation) is shared with the workers through a
+`multiprocessing.Manager`. Only the workers write the progress and only the server
+writes the cancellation flags, so a cancel is never overwritten by a progress
+report. Finished jobs (and their results) are kept for a limited time, see
+`JobManager`.
+
+The routing arrays of the network are memory-mapped from the network cache, so
+workers share them. With the "fork" start method (set DTV_MP_CONTEXT=fork) the
+network is loaded once in the parent process and the workers share all of it (the
+networkx graph and the geometries) copy-on-write, see `preload_network`.
+"""
+
+import concurrent.futures
+import datetime
+import gc
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+
+import dtv_backend.compact_graph
+import dtv_backend.fis
+import dtv_backend.postprocessing
+import dtv_backend.results
+import dtv_backend.simulate
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """Raised in a worker when a running job is cancelled."""
+
+
+def default_mp_context():
+    """return the multiprocessing start method, DTV_MP_CONTEXT or spawn"""
+    return os.environ.get("DTV_MP_CONTEXT", "spawn")
+
+
+def preload_network(network_url):
+    """
+    Load the network and its compact graph in this process before forking workers.
+
+    The loaded objects are moved out of the garbage collector (`gc.freeze`), so that
+    the collector in the forked workers does not write to (and thereby copy) the
+    pages of the network.
+    """
+    graph = dtv_backend.fis.load_fis_network(network_url)
+    dtv_backend.compact_graph.get_compact_graph(graph)
+    gc.collect()
+    gc.freeze()
+    logger.info("Preloaded network, %s objects frozen", gc.get_freeze_count())
+
+
+def init_worker(network_url=None):
+    """Load the network once in a new worker process."""
+    if network_url is not None:
+        logger.info("Loading network in worker %s", os.getpid())
+        dtv_backend.fis.load_fis_network(network_url)
+
+
+class Progress:
+    """
+    Progress reporter, passed to the job function in the worker.
+
+    Parameters
+    ----------
+    job_id : str
+        The id of the job.
+    state : dict
+        Shared dictionary with the state of all jobs (a `multiprocessing.Manager`
+        dict).
+    cancel_flags : dict, optional
+        Shared dictionary with the ids of cancelled jobs, written by the server
+        only.
+    """
+
+    def __init__(self, job_id, state, cancel_flags=None):
+        """Create a reporter for job_id."""
+        self.job_id = job_id
+        self.state = state
+        self.cancel_flags = cancel_flags if cancel_flags is not None else {}
+
+    def update(self, **info):
+        """update the shared state of the job"""
+        job_state = dict(self.state.get(self.job_id, {}))
+        job_state.update(info)
+        self.state[self.job_id] = job_state
+
+    @property
+    def cancelled(self):
+        """has the job been cancelled?"""
+        return bool(self.cancel_flags.get(self.job_id))
+
+    def __call__(self, now, start, until):
+        """
+        Report the simulated time, see `dtv_backend.simulate.run_env`.
+
+        Raises
+        ------
+        JobCancelled
+            If the job was cancelled.
+        """
+        fraction = (now - start) / (until - start) if until > start else 1.0
+        self.update(now=now, until=until, progress=min(max(fraction, 0.0), 1.0))
+        if self.cancelled:
+            raise JobCancelled(f"Job {self.job_id} was cancelled")
+
+
+def run_simulation(config, kernel="v3", progress=None):
+    """
+    Run a simulation and convert the result to the server response.
+
+    Parameters
+    ----------
+    config : dict
+        The simulation configuration, as posted to the simulate routes.
+    kernel : str, optional
+        The simulation kernel: "v1" (`simulate.run`), "v2" or "v3". The default is
+        "v3".
+    progress : callable, optional
+        Progress reporter, see `dtv_backend.simulate.run_env`.
+
+    Returns
+    -------
+    dict
+        The response, see `dtv_backend.postprocessing.result_to_response`, and the
+        id of the stored result (None if it could not be stored), see
+        `dtv_backend.results`.
+    """
+    run_functions = {
+        "v1": dtv_backend.simulate.run,
+        "v2": dtv_backend.simulate.v2_run,
+        "v3": dtv_backend.simulate.v3_run,
+    }
+    if kernel not in run_functions:
+        raise ValueError(f"Unknown kernel {kernel}, expected one of {run_functions}")
+    result = run_functions[kernel](config, progress=progress)
+    with_energy = kernel == "v3"
+    frames = dtv_backend.postprocessing.result_frames(result, with_energy=with_energy)
+    response = dtv_backend.postprocessing.result_to_response(
+        result, with_energy=with_energy, frames=frames
+    )
+    response["result_id"] = dtv_backend.results.store_result(
+        result, with_energy=with_energy, frames=frames
+    )
+    return response
+
+
+def _run_job(job_id, state, cancel_flags, function, args, kwargs):
+    """run a job function in a worker and keep its state up to date"""
+    progress = Progress(job_id, state, cancel_flags)
+    if progress.cancelled:
+        raise JobCancelled(f"Job {job_id} was cancelled")
+    progress.update(
+        status="running", started=datetime.datetime.now().isoformat(), pid=os.getpid()
+    )
+    return function(*args, progress=progress, **kwargs)
+
+
+class Job:
+    """
+    A submitted job, as seen by the server process.
+
+    Parameters
+    ----------
+    job_id : str
+        The id of the job.
+    future : concurrent.futures.Future
+        The future of the job in the process pool.
+    description : str, optional
+        A description of the job.
+    """
+
+    def __init__(self, job_id, future, description=None):
+        """Create a job."""
+        self.job_id = job_id
+        self.future = future
+        self.description = description
+        self.submitted = datetime.datetime.now()
+        self.finished = None
+        future.add_done_callback(self._set_finished)
+
+    def _set_finished(self, future):
+        """remember when the job finished, for the retention of finished jobs"""
+        self.finished = datetime.datetime.now()
+
+
+class JobManager:
+    """
+    Run jobs on a pool of worker processes.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        The number of worker processes. The default is the DTV_JOB_WORKERS
+        environment variable or the number of cpus.
+    network_url : str, optional
+        The network to load in each worker. The default is
+        `dtv_backend.simulate.network_url`. Use None to skip loading.
+    mp_context : str, optional
+        The multiprocessing start method. The default is the DTV_MP_CONTEXT
+        environment variable or "spawn", which is safe to use from a threaded
+        server. With "fork" the network is preloaded and shared with the workers.
+    max_finished_jobs : int, optional
+        The number of finished jobs (with their results) to keep, older finished
+        jobs are removed. The default is the DTV_JOB_RETENTION environment variable
+        or 100.
+    finished_ttl : float, optional
+        The number of seconds to keep finished jobs. The default is the
+        DTV_JOB_TTL environment variable or 3600.
+    """
+
+    def __init__(
+        self,
+        max_workers=None,
+        network_url=dtv_backend.simulate.network_url,
+        mp_context=None,
+        max_finished_jobs=None,
+        finished_ttl=None,
+    ):
+        """Start the manager, workers are started on first use."""
+        if max_workers is None:
+            max_workers = int(os.environ.get("DTV_JOB_WORKERS", os.cpu_count() or 1))
+        if max_finished_jobs is None:
+            max_finished_jobs = int(os.environ.get("DTV_JOB_RETENTION", 100))
+        if finished_ttl is None:
+            finished_ttl = float(os.environ.get("DTV_JOB_TTL", 3600))
+        self.max_finished_jobs = max_finished_jobs
+        self.finished_ttl = finished_ttl
+        if mp_context is None:
+            mp_context = default_mp_context()
+        if mp_context == "fork" and network_url is not None:
+            preload_network(network_url)
+        context = multiprocessing.get_context(mp_context)
+        self._manager = context.Manager()
+        self.state = self._manager.dict()
+        # job_id -> True, kept apart from the state that the workers rewrite
+        self.cancel_flags = self._manager.dict()
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=context,
+            initializer=init_worker,
+            initargs=(network_url,),
+        )
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args, description=None, **kwargs):
+        """
+        Submit a job. The function should accept a progress keyword argument (see
+        `Progress`) and return a picklable result.
+
+        Returns
+        -------
+        str
+            The job id.
+        """
+        self.evict_finished()
+        job_id = uuid.uuid4().hex
+        self.state[job_id] = {"status": "queued"}
+        future = self.executor.submit(
+            _run_job, job_id, self.state, self.cancel_flags, function, args, kwargs
+        )
+        with self._lock:
+            self.jobs[job_id] = Job(job_id, future, description=description)
+        logger.info("Submitted job %s (%s)", job_id, description)
+        return job_id
+
+    def submit_simulation(self, config, kernel="v3"):
+        """submit a simulation, see `run_simulation`"""
+        return self.submit(
+            run_simulation, config, kernel=kernel, description=f"{kernel} simulation"
+        )
+
+    def _get(self, job_id):
+        """return the job or raise KeyError"""
+        with self._lock:
+            return self.jobs[job_id]
+
+    def status(self, job_id):
+        """
+        Return the status of a job.
+
+        Returns
+        -------
+        dict
+            job_id, status (queued, running, finished, failed or cancelled),
+            progress (0 - 1), simulated time (now, until), description and times.
+
+        Raises
+        ------
+        KeyError
+            If the job does not exist.
+        """
+        job = self._get(job_id)
+        state = dict(self.state.get(job_id, {}))
+        status = state.get("status", "queued")
+        error = None
+        if job.future.cancelled():
+            status = "cancelled"
+        elif job.future.done():
+            exception = job.future.exception()
+            if exception is None:
+                status = "finished"
+                state["progress"] = 1.0
+            elif isinstance(exception, JobCancelled):
+                status = "cancelled"
+            else:
+                status = "failed"
+                error = repr(exception)
+        state.update(
+            {
+                "job_id": job_id,
+                "status": status,
+                "description": job.description,
+                "submitted": job.submitted.isoformat(),
+            }
+        )
+        if error is not None:
+            state["error"] = error
+        return state
+
+    def list(self):
+        """return the status of all jobs"""
+        self.evict_finished()
+        with self._lock:
+            job_ids = list(self.jobs)
+        return [self.status(job_id) for job_id in job_ids]
+
+    def result(self, job_id, timeout=None):
+        """
+        Return the result of a job, waiting at most timeout seconds.
+
+        Raises
+        ------
+        KeyError
+            If the job does not exist.
+        concurrent.futures.TimeoutError
+            If the job did not finish in time.
+        concurrent.futures.CancelledError, JobCancelled
+            If the job was cancelled.
+        Exception
+            The exception raised by the job.
+        """
+        return self._get(job_id).future.result(timeout=timeout)
+
+    def cancel(self, job_id):
+        """
+        Cancel a job. Queued jobs are removed from the queue. Running jobs stop at
+        their next progress report.
+
+        Returns
+        -------
+        dict
+            The status of the job.
+        """
+        job = self._get(job_id)
+        if not job.future.cancel() and not job.future.done():
+            self.cancel_flags[job_id] = True
+        logger.info("Cancelled job %s", job_id)
+        return self.status(job_id)
+
+    def remove(self, job_id):
+        """forget a finished job and its result"""
+        job = self._get(job_id)
+        if not job.future.done():
+            raise ValueError(f"Job {job_id} is not finished")
+        with self._lock:
+            del self.jobs[job_id]
+        self.state.pop(job_id, None)
+        self.cancel_flags.pop(job_id, None)
+
+    def evict_finished(self):
+        """
+        Remove finished jobs that are older than `finished_ttl` seconds and the
+        oldest finished jobs beyond `max_finished_jobs`.
+
+        Returns
+        -------
+        list
+            The ids of the removed jobs.
+        """
+        now = datetime.datetime.now()
+        with self._lock:
+            finished = sorted(
+                (job for job in self.jobs.values() if job.finished is not None),
+                key=lambda job: job.finished,
+            )
+        n_expired = sum(
+            (now - job.finished).total_seconds() > self.finished_ttl
+            for job in finished
+        )
+        n_expired = max(n_expired, len(finished) - self.max_finished_jobs)
+        evicted = [job.job_id for job in finished[:n_expired]]
+        for job_id in evicted:
+            try:
+                self.remove(job_id)
+            except KeyError:
+                # removed by another thread
+                pass
+        if evicted:
+            logger.info("Removed %s finished jobs", len(evicted))
+        return evicted
+
+    def shutdown(self, wait=True):
+        """stop the workers and the manager"""
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+        self._manager.shutdown()
+
+
+_job_manager = None
+_job_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """
+    Return the job manager of this (server) process. It is created on first use.
+
+    Returns
+    -------
+    JobManager
+        The job manager.
+    """
+    global _job_manager
+    with _job_manager_lock:
+        if _job_manager is None:
+            _job_manager = JobManager()
+        return _job_manager
@@ -1,11 +1,20 @@
 """
 Logging functionality for DTV backend.
+
+Activities are logged to a `Logbook`, an append-only columnar store. Timestamps,
+activity ids and values are stored in typed arrays that grow in chunks. Messages,
+descriptions and states are stored as codes into a table of unique strings and actors
+as codes into a table of actors, so a log entry does not hold its own copies. The
+logbook converts to a pandas DataFrame (or an Arrow table) with array operations.
 """
 
 from contextlib import ContextDecorator
 import datetime
 import itertools
 
+import numpy as np
+import pandas as pd
+import shapely
 import simpy
 
 from opentnsim import core
@@ -22,7 +31,7 @@ class LogDecorator(ContextDecorator):
     ----------
     env : simpy.Environment
         The simulation environment.
-    logbook : list
+    logbook : Logbook or list
         The logbook to which entries will be appended.
     message : str
         The message to log.
@@ -69,6 +78,18 @@ class LogDecorator(ContextDecorator):
             Additional metadata to include in the log entry.
 
         """
+        if isinstance(self.logbook, Logbook):
+            self.logbook.record(
+                message=message,
+                timestamp=timestamp,
+                value=value,
+                geometry=geometry,
+                # activity 0 is a valid id
+                activity_id=activity_id,
+                activity_state=activity_state,
+                **kwargs
+            )
+            return
         entry = {
             "Message": message,
             "Timestamp": datetime.datetime.utcfromtimestamp(timestamp),
@@ -126,6 +147,328 @@ class LogDecorator(ContextDecorator):
         return kwargs
 
 
+class Logbook:
+    """
+    Append-only, columnar logbook.
+
+    Entries are stored in typed arrays (timestamp, activity id, state, message,
+    description, actor, value) that grow in chunks, plus a reference to the geometry
+    and the remaining metadata (for example the energy profile of a trip). Strings
+    and actors are interned, an entry stores their codes (-1 if missing).
+
+    Parameters
+    ----------
+    chunk_size : int, optional
+        The number of entries per chunk. The default is 4096.
+    """
+
+    # column name: dtype
+    dtypes = {
+        "timestamp": "float64",
+        "activity_id": "int64",
+        "state": "int32",
+        "message": "int32",
+        "description": "int32",
+        "actor": "int32",
+        "value": "float64",
+        "geometry": object,
+        "meta": object,
+    }
+    # columns with codes into the string table
+    string_columns = ["state", "message", "description"]
+
+    def __init__(self, chunk_size=4096):
+        """Create an empty logbook."""
+        self.chunk_size = chunk_size
+        self.strings = []
+        self._string_codes = {}
+        self.actors = []
+        self._actor_codes = {}
+        # values that are not numbers, by entry
+        self._other_values = {}
+        self._chunks = {name: [] for name in self.dtypes}
+        self._n = 0
+        self._new_chunk()
+
+    def __len__(self):
+        return self._n
+
+    def _new_chunk(self):
+        """start a new chunk of all columns"""
+        for name, dtype in self.dtypes.items():
+            if dtype is object:
+                chunk = np.empty(self.chunk_size, dtype=object)
+            else:
+                chunk = np.full(self.chunk_size, -1, dtype=dtype)
+            self._chunks[name].append(chunk)
+
+    def _string_code(self, value):
+        """return the code of a string (interned on first use), -1 for None"""
+        if value is None:
+            return -1
+        code = self._string_codes.get(value)
+        if code is None:
+            code = self._string_codes[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+
+    def _actor_code(self, actor, actor_id):
+        """return the code of an actor (interned on first use), -1 for None"""
+        if actor is None:
+            return -1
+        key = id(actor)
+        code = self._actor_codes.get(key)
+        if code is None:
+            code = self._actor_codes[key] = len(self.actors)
+            # the actor is kept, so that its id is not reused
+            self.actors.append((actor, actor_id))
+        return code
+
+    def record(
+        self,
+        message=None,
+        timestamp=None,
+        value=None,
+        geometry=None,
+        activity_id=None,
+        activity_state=None,
+        **meta,
+    ):
+        """
+        Add an entry to the logbook.
+
+        Parameters
+        ----------
+        message : str
+            The log message.
+        timestamp : float
+            The timestamp (seconds since 1970, UTC).
+        value : float, optional
+            The value associated with the entry.
+        geometry : shapely.Geometry, optional
+            The geometry associated with the entry.
+        activity_id : int, optional
+            The activity id, a new id if None.
+        activity_state : str, optional
+            The state of the activity, for example START or STOP. Taken from
+            meta["state"] if it is not given.
+        **meta : dict
+            Metadata, actor, actor_id and description are stored as columns.
+        """
+        state = meta.pop("state", None)
+        if activity_state is not None:
+            state = activity_state
+        actor = meta.pop("actor", None)
+        actor_id = meta.pop("actor_id", None)
+        description = meta.pop("description", None)
+
+        i, j = divmod(self._n, self.chunk_size)
+        if i == len(self._chunks["timestamp"]):
+            self._new_chunk()
+        chunks = self._chunks
+        chunks["timestamp"][i][j] = np.nan if timestamp is None else timestamp
+        chunks["activity_id"][i][j] = (
+            next(COUNT) if activity_id is None else activity_id
+        )
+        chunks["state"][i][j] = self._string_code(state)
+        chunks["message"][i][j] = self._string_code(message)
+        chunks["description"][i][j] = self._string_code(description)
+        chunks["actor"][i][j] = self._actor_code(actor, actor_id)
+        if value is None:
+            chunks["value"][i][j] = np.nan
+        elif isinstance(value, (int, float, np.number)):
+            chunks["value"][i][j] = value
+        else:
+            chunks["value"][i][j] = np.nan
+            self._other_values[self._n] = value
+        chunks["geometry"][i][j] = geometry
+        chunks["meta"][i][j] = meta or None
+        self._n += 1
+
+    def append(self, entry):
+        """
+        Add an entry in the dictionary format of `LogDecorator.log_entry` (Message,
+        Timestamp, Value, geometry, ActivityID, ActivityState and Meta).
+        """
+        timestamp = entry.get("Timestamp")
+        if isinstance(timestamp, datetime.datetime):
+            # naive timestamps are in UTC
+            timestamp = timestamp.replace(tzinfo=datetime.timezone.utc).timestamp()
+        self.record(
+            message=entry.get("Message"),
+            timestamp=timestamp,
+            value=entry.get("Value"),
+            geometry=entry.get("geometry"),
+            activity_id=entry.get("ActivityID"),
+            activity_state=entry.get("ActivityState"),
+            **dict(entry.get("Meta") or {}),
+        )
+
+    def column(self, name, start=0):
+        """
+        Return a column as one array.
+
+        Parameters
+        ----------
+        name : str
+            The column, see `dtypes`.
+        start : int, optional
+            The first entry. The default is 0. Only the chunks from start on are
+            read, so a growing logbook can be read incrementally.
+
+        Returns
+        -------
+        numpy.ndarray
+            The values of the entries from start on.
+        """
+        chunks = self._chunks[name]
+        first, offset = divmod(start, self.chunk_size)
+        n_full, n_last = divmod(self._n, self.chunk_size)
+        arrays = chunks[first:n_full]
+        if n_last and first <= n_full:
+            arrays = [*arrays, chunks[n_full][:n_last]]
+        if not arrays:
+            return np.empty(0, dtype=self.dtypes[name])
+        arrays[0] = arrays[0][offset:]
+        return np.concatenate(arrays)
+
+    def _decode(self, codes, table):
+        """map codes to the values of table, -1 becomes None"""
+        values = np.empty(len(table) + 1, dtype=object)
+        # assign one by one, numpy would unpack sequence-like values
+        for i, value in enumerate(table):
+            values[i] = value
+        # code -1 selects the last item, None
+        return values[codes]
+
+    def values(self, start=0):
+        """return the values of the entries (numbers and other values) as objects"""
+        values = self.column("value", start=start).astype(object)
+        values[pd.isna(values)] = None
+        for i, value in self._other_values.items():
+            if i >= start:
+                values[i - start] = value
+        return values
+
+    def to_frame(self, meta=True, start=0):
+        """
+        Convert the logbook to a DataFrame.
+
+        Parameters
+        ----------
+        meta : bool, optional
+            Add the Meta column with a metadata dictionary per entry (including actor,
+            actor_id, description and state), as logged by `LogDecorator`. This is
+            the only part that is built per entry. The default is True. The extra
+            metadata of the entries (for example energy_profile or destination) is
+            always available, as logged, in the meta column (None without extra
+            metadata).
+        start : int, optional
+            Convert the entries from start on, the index of the DataFrame is the
+            entry number. The default is 0.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Message, Timestamp, Value, geometry, ActivityID, ActivityState, actor_name,
+            actor_type, actor_id, description, state, meta and (optionally) Meta.
+        """
+
+        def column(name):
+            return self.column(name, start=start)
+
+        actor_codes = column("actor")
+        actors = [actor for actor, _ in self.actors]
+        states = self._decode(column("state"), self.strings)
+        df = pd.DataFrame(
+            {
+                "Message": self._decode(column("message"), self.strings),
+                "Timestamp": pd.to_datetime(column("timestamp"), unit="s"),
+                "Value": self.values(start=start),
+                "geometry": column("geometry"),
+                "ActivityID": column("activity_id"),
+                "ActivityState": states,
+                "actor_name": self._decode(
+                    actor_codes, [getattr(actor, "name", None) for actor in actors]
+                ),
+                "actor_type": self._decode(
+                    actor_codes, [type(actor).__name__ for actor in actors]
+                ),
+                "actor_id": self._decode(
+                    actor_codes, [actor_id for _, actor_id in self.actors]
+                ),
+                "description": self._decode(column("description"), self.strings),
+                "state": states,
+                "meta": column("meta"),
+            },
+            index=pd.RangeIndex(start, start + len(actor_codes)),
+        )
+        if meta:
+            df["Meta"] = self._meta(
+                self._decode(actor_codes, actors),
+                df["actor_id"],
+                df["description"],
+                states,
+                df["meta"],
+            )
+        return df
+
+    def _meta(self, actors, actor_ids, descriptions, states, extras):
+        """rebuild the metadata dictionaries of the entries"""
+        records = []
+        for actor, actor_id, description, state, extra in zip(
+            actors, actor_ids, descriptions, states, extras
+        ):
+            record = {"state": state}
+            if actor is not None:
+                record.update(actor=actor, actor_id=actor_id)
+            if description is not None:
+                record["description"] = description
+            if extra:
+                record.update(extra)
+            records.append(record)
+        return records
+
+    def to_arrow(self):
+        """
+        Convert the logbook (without Meta) to an Arrow table. Geometries are stored as
+        WKB. This requires pyarrow.
+
+        Returns
+        -------
+        pyarrow.Table
+            The logbook table.
+        """
+        import pyarrow
+
+        # the extra metadata holds python objects, it is not stored
+        df = self.to_frame(meta=False).drop(columns=["meta"])
+        geometry = df["geometry"].to_numpy()
+        is_geometry = shapely.is_geometry(geometry)
+        wkb = np.empty(len(geometry), dtype=object)
+        wkb[is_geometry] = shapely.to_wkb(geometry[is_geometry])
+        df["geometry"] = wkb
+        df["Value"] = self.column("value")
+        return pyarrow.Table.from_pandas(df, preserve_index=False)
+
+    def __iter__(self):
+        """iterate over the entries as dictionaries (see `LogDecorator.log_entry`)"""
+        columns = [
+            "Message",
+            "Timestamp",
+            "Value",
+            "geometry",
+            "ActivityID",
+            "ActivityState",
+            "Meta",
+        ]
+        df = self.to_frame()
+        for values in zip(*(df[column] for column in columns)):
+            entry = dict(zip(columns, values))
+            entry["Timestamp"] = entry["Timestamp"].to_pydatetime()
+            yield entry
+
+
 class HasLog(core.Identifiable, core.SimpyObject):
     """
     Class that provides a log function for building a logbook. Extends OpenTNSim's
@@ -141,7 +484,7 @@ class HasLog(core.Identifiable, core.SimpyObject):
             self.logbook = self.env.logbook
         else:
             # share logbook with environment
-            self.logbook = []
+            self.logbook = Logbook()
             self.env.logbook = self.logbook
 
 
@@ -17,6 +17,9 @@ import shapely.wkt
 import shapely.geometry
 import pyproj
 
+import dtv_backend.fis
+import dtv_backend.spatial
+
 
 #%%
 def find_closest_node(G, point):
@@ -134,75 +137,26 @@ def determine_max_draught_on_path(
 def shorted_path_by_dimensions(
     graph, source, destination, width, height, depth, length
 ):
-    """create a new constrained graph, based on dimensions, of the same type as graph and find the shortest path"""
-    nodes = []
-    edges = []
-    for start_node, end_node, edge in graph.edges(data=True):
-        # GeneralWidth can be missing or None or it should be bigger than width
-        width_ok = (
-            "GeneralWidth" not in edge
-            or np.isnan(edge["GeneralWidth"])
-            or edge["GeneralWidth"] >= width
-        )
-        height_ok = (
-            "GeneralHeight" not in edge
-            or np.isnan(edge["GeneralHeight"])
-            or edge["GeneralHeight"] >= height
-        )
-        depth_ok = (
-            "GeneralDepth" not in edge
-            or edge["GeneralDepth"] >= depth
-            or np.isnan(edge["GeneralDepth"])
-        )
-        length_ok = (
-            "GeneralLength" not in edge
-            or edge["GeneralLength"] >= length
-            or np.isnan(edge["GeneralLength"])
-        )
-        if all([width_ok, height_ok, depth_ok, length_ok]):
-            edges.append((start_node, end_node))
-            nodes.append(start_node)
-            nodes.append(end_node)
-
-    constrained_graph = graph.__class__()
-
-    for node in nodes:
-        constrained_graph.add_node(node)
-    for edge in edges:
-        constrained_graph.add_edge(edge[0], edge[1])
-
-    path = nx.dijkstra_path(constrained_graph, source, destination, weight="length_m")
-    return path
+    """find the shortest path for a ship with given dimensions, see dtv_backend.fis.shorted_path_by_dimensions"""
+    return dtv_backend.fis.shorted_path_by_dimensions(
+        graph, source, destination, width, height, depth, length
+    )
 
 
 def path2gdf(path, graph):
     """export a path to a geodataframe"""
+    # edge coordinates are oriented once per network
+    edge_coordinates = dtv_backend.spatial.get_edge_coordinates(graph)
     edges = []
     for a, b in zip(path[:-1], path[1:]):
-        edge = graph.edges[a, b]
         # make sure geometries always start and end with node geometry
-        start_point = graph.nodes[a]["geometry"]
-        edge_geom = shapely.wkt.loads(edge["Wkt"])
-        end_point = graph.nodes[b]["geometry"]
-
-        first_edge_point = shapely.geometry.Point(edge_geom.coords[0])
-        start_distance = start_point.distance(first_edge_point)
-        end_distance = end_point.distance(first_edge_point)
-
-        # correct order
-        if start_distance < end_distance:
-            geometry = shapely.geometry.LineString(
-                [*start_point.coords, *edge_geom.coords, *end_point.coords]
-            )
-        # inverted
-        else:
-            # invert edge coordinates
-            geometry = shapely.geometry.LineString(
-                [*start_point.coords, *edge_geom.coords[::-1], *end_point.coords]
-            )
-        edge["geometry"] = geometry
-        edge["start_node"] = a
-        edge["end_node"] = b
+        geometry = shapely.geometry.LineString(edge_coordinates.edge_coordinates(a, b))
+        edge = {
+            **graph.edges[a, b],
+            "geometry": geometry,
+            "start_node": a,
+            "end_node": b,
+        }
         edges.append(edge)
     gdf = gpd.GeoDataFrame(edges)
     return gdf
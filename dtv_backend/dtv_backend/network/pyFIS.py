@@ -25,8 +25,6 @@ logger.setLevel(logging.DEBUG)
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
 
-# monkey patch requests with a cache
-requests_cache.install_cache('fis_cache')
 
 
 
@@ -34,6 +32,9 @@ class pyFIS:
     count = 500  # Number of reponses per page. This is also the default maximum
 
     def __init__(self, url='https://www.vaarweginformatie.nl/wfswms/dataservice/1.3'):
+        # monkey patch requests with a cache
+        if not requests_cache.is_installed():
+            requests_cache.install_cache('fis_cache')
         self.baseurl = url
 
         response_geogeneration = self._parse_request('geogeneration')
@@ -0,0 +1,395 @@
+"""
+Binary, pre-geometrized on-disk cache of the Fairway Information System (FIS) network.
+
+Loading the pickled FIS network and converting all node coordinates and edge WKT into
+shapely geometries takes most of the startup time of a worker. This module stores the
+result of that work in a versioned cache directory:
+
+- ``manifest.json``: format version, source and table sizes
+- ``nodes.pickle``, ``edges.pickle``: columnar attribute tables (pandas)
+- ``node_coordinates.npy``: node X, Y as float64 array (n_nodes, 2)
+- ``edge_wkb.npy``, ``edge_wkb_offsets.npy``: concatenated WKB edge geometries
+- ``edge_length.npy``: precomputed great circle edge lengths [m]
+- ``compact/``: the routing arrays (see `dtv_backend.compact_graph.CompactGraph.save`)
+
+The arrays are memory-mapped on read, so a cache is cheap to open. The networkx graph
+can be rebuilt from it without parsing any WKT. The routing arrays are used directly
+from the memory map, so all processes that open the same cache (server and batch
+workers) share one copy of them.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import pickle
+import shutil
+import tempfile
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+import shapely
+
+import dtv_backend.compact_graph
+
+logger = logging.getLogger(__name__)
+
+# increase when the layout of the cache changes
+CACHE_VERSION = 2
+
+# geometry and length are stored as arrays, not in the attribute tables
+array_attributes = ["geometry", "length"]
+
+
+def get_cache_dir():
+    """
+    Return the directory where network caches are stored. Can be configured with
+    the DTV_CACHE_DIR environment variable.
+
+    Returns
+    -------
+    pathlib.Path
+        The cache directory.
+    """
+    cache_dir = os.environ.get("DTV_CACHE_DIR", "~/.cache/dtv_backend")
+    return pathlib.Path(cache_dir).expanduser() / "network"
+
+
+def cache_key(url, path=None):
+    """
+    Compute the cache key for a network source.
+
+    Parameters
+    ----------
+    url : str
+        The url of the network.
+    path : pathlib.Path, optional
+        A local copy of the network. If given, its size and modification time are
+        part of the key, so that a new local file invalidates the cache.
+
+    Returns
+    -------
+    str
+        The cache key.
+    """
+    source = {"url": url, "version": CACHE_VERSION}
+    if path is not None:
+        stat = pathlib.Path(path).stat()
+        source.update(
+            {"path": str(path), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+        )
+    source_str = json.dumps(source, sort_keys=True)
+    return hashlib.sha256(source_str.encode()).hexdigest()[:16]
+
+
+def _attribute_table(items, index_columns):
+    """
+    Convert a list of (index values, attribute dict) to a columnar table. Also return
+    which attributes were missing, so that they can be left out again on rebuild.
+
+    Integer and boolean attributes that are missing for some items are stored as
+    nullable columns (Int64, boolean), so that they are not converted to float or
+    object and come back with their original type.
+    """
+    rows = []
+    for index_values, attributes in items:
+        row = dict(zip(index_columns, index_values))
+        row.update({k: v for k, v in attributes.items() if k not in array_attributes})
+        rows.append(row)
+    table = pd.DataFrame(rows)
+    missing = {}
+    for column in table.columns:
+        if column in index_columns:
+            continue
+        present = np.array([column in attributes for _, attributes in items])
+        if not present.all():
+            missing[column] = ~present
+            dtype = _nullable_dtype(
+                [attributes[column] for _, attributes in items if column in attributes]
+            )
+            if dtype is not None:
+                table[column] = pd.array(
+                    [attributes.get(column) for _, attributes in items], dtype=dtype
+                )
+    return table, missing
+
+
+def _nullable_dtype(values):
+    """return the nullable dtype for integer or boolean values, otherwise None"""
+    if all(isinstance(value, (bool, np.bool_)) for value in values):
+        return "boolean"
+    if all(
+        isinstance(value, (int, np.integer)) and not isinstance(value, bool)
+        for value in values
+    ):
+        return "Int64"
+    return None
+
+
+def write_cache(graph, cache_path, source=None):
+    """
+    Write a geometrized FIS network to a cache directory.
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        The network, with shapely geometries on nodes and edges and edge lengths.
+    cache_path : pathlib.Path
+        The directory to write to. It is replaced atomically.
+    source : dict, optional
+        Information about the source of the network, stored in the manifest.
+    """
+    cache_path = pathlib.Path(cache_path)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+
+    multigraph = graph.is_multigraph()
+    edge_columns = ["source", "target", "key"] if multigraph else ["source", "target"]
+    edge_iter = (
+        graph.edges(keys=True, data=True) if multigraph else graph.edges(data=True)
+    )
+
+    node_items = [((n,), attributes) for n, attributes in graph.nodes(data=True)]
+    edge_items = [(e[:-1], e[-1]) for e in edge_iter]
+    nodes, nodes_missing = _attribute_table(node_items, ["n_id"])
+    edges, edges_missing = _attribute_table(edge_items, edge_columns)
+
+    node_coordinates = np.array(
+        [[attributes["X"], attributes["Y"]] for _, attributes in node_items],
+        dtype="float64",
+    ).reshape(-1, 2)
+    edge_wkb = shapely.to_wkb(
+        np.array([attributes["geometry"] for _, attributes in edge_items], dtype=object)
+    )
+    edge_wkb_offsets = np.zeros(len(edge_wkb) + 1, dtype="int64")
+    edge_wkb_offsets[1:] = np.cumsum([len(blob) for blob in edge_wkb])
+    edge_wkb_buffer = np.frombuffer(b"".join(edge_wkb), dtype="uint8")
+    edge_length = np.array(
+        [attributes["length"] for _, attributes in edge_items], dtype="float64"
+    )
+
+    manifest = {
+        "version": CACHE_VERSION,
+        "source": source or {},
+        "graph_type": type(graph).__name__,
+        "n_nodes": len(node_items),
+        "n_edges": len(edge_items),
+    }
+
+    # write to a temporary directory first, so readers never see a partial cache
+    tmp_path = pathlib.Path(tempfile.mkdtemp(dir=cache_path.parent))
+    try:
+        with open(tmp_path / "nodes.pickle", "wb") as f:
+            pickle.dump(
+                {"table": nodes, "missing": nodes_missing, "graph": graph.graph},
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        with open(tmp_path / "edges.pickle", "wb") as f:
+            pickle.dump(
+                {"table": edges, "missing": edges_missing},
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        np.save(tmp_path / "node_coordinates.npy", node_coordinates)
+        np.save(tmp_path / "edge_wkb.npy", edge_wkb_buffer)
+        np.save(tmp_path / "edge_wkb_offsets.npy", edge_wkb_offsets)
+        np.save(tmp_path / "edge_length.npy", edge_length)
+        # the manifest is written last, it marks the cache as complete
+        with open(tmp_path / "manifest.json", "w") as f:
+            json.dump(manifest, f)
+        if cache_path.exists():
+            shutil.rmtree(cache_path)
+        tmp_path.rename(cache_path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    logger.info("Wrote network cache to %s", cache_path)
+
+
+def write_compact_graph(compact_graph, cache_path):
+    """
+    Add the routing arrays of a compact graph to a cache directory.
+
+    Parameters
+    ----------
+    compact_graph : dtv_backend.compact_graph.CompactGraph
+        The compact graph of the cached network.
+    cache_path : pathlib.Path
+        The cache directory, as written by `write_cache`.
+    """
+    cache_path = pathlib.Path(cache_path)
+    compact_path = cache_path / "compact"
+    tmp_path = pathlib.Path(tempfile.mkdtemp(dir=cache_path))
+    try:
+        compact_graph.save(tmp_path)
+        if compact_path.exists():
+            shutil.rmtree(compact_path)
+        tmp_path.rename(compact_path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    logger.info("Wrote compact graph to %s", compact_path)
+
+
+class NetworkCache:
+    """
+    Read access to a network cache directory. Tables and arrays are loaded on first
+    access. Arrays are memory-mapped.
+
+    Parameters
+    ----------
+    cache_path : pathlib.Path
+        The cache directory, as written by `write_cache`.
+    mmap_mode : str, optional
+        The numpy memory map mode. The default is "r" (read only).
+    """
+
+    def __init__(self, cache_path, mmap_mode="r"):
+        """Open the cache and validate the manifest."""
+        self.cache_path = pathlib.Path(cache_path)
+        self.mmap_mode = mmap_mode
+        with open(self.cache_path / "manifest.json") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != CACHE_VERSION:
+            raise ValueError(
+                f"Network cache version {self.manifest.get('version')} is not supported, expected {CACHE_VERSION}"
+            )
+        self._tables = {}
+        self._arrays = {}
+
+    def _table(self, name):
+        if name not in self._tables:
+            with open(self.cache_path / f"{name}.pickle", "rb") as f:
+                self._tables[name] = pickle.load(f)
+        return self._tables[name]
+
+    def _array(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = np.load(
+                self.cache_path / f"{name}.npy", mmap_mode=self.mmap_mode
+            )
+        return self._arrays[name]
+
+    @property
+    def nodes(self):
+        """the node attribute table, the node id is in column n_id"""
+        return self._table("nodes")["table"]
+
+    @property
+    def edges(self):
+        """the edge attribute table, with source and target columns"""
+        return self._table("edges")["table"]
+
+    @property
+    def node_coordinates(self):
+        """node coordinates (X, Y) as an array of shape (n_nodes, 2)"""
+        return self._array("node_coordinates")
+
+    @property
+    def edge_length(self):
+        """great circle length of the edges [m]"""
+        return self._array("edge_length")
+
+    def compact_graph(self):
+        """
+        Return the memory-mapped compact graph of the network, or None if the cache
+        has no routing arrays.
+        """
+        compact_path = self.cache_path / "compact"
+        if not (compact_path / "compact_graph.json").exists():
+            return None
+        return dtv_backend.compact_graph.CompactGraph.load(
+            compact_path, mmap_mode=self.mmap_mode
+        )
+
+    def node_geometries(self):
+        """return the node geometries as an array of shapely points"""
+        return shapely.points(np.asarray(self.node_coordinates))
+
+    def edge_geometries(self):
+        """return the edge geometries as an array of shapely geometries"""
+        buffer = self._array("edge_wkb")
+        offsets = self._array("edge_wkb_offsets")
+        blobs = np.array(
+            [
+                buffer[start:end].tobytes()
+                for start, end in zip(offsets[:-1], offsets[1:])
+            ],
+            dtype=object,
+        )
+        return shapely.from_wkb(blobs)
+
+    @staticmethod
+    def _records(table, missing, drop):
+        """convert a table back to attribute dictionaries, leaving out missing keys"""
+        records = table.drop(columns=drop).to_dict("records")
+        for column, is_missing in missing.items():
+            for i in np.flatnonzero(is_missing):
+                del records[i][column]
+        return records
+
+    def to_graph(self):
+        """
+        Rebuild the networkx graph with geometries and lengths.
+
+        Returns
+        -------
+        networkx.Graph
+            The network, of the same type as the cached graph.
+        """
+        graph_class = getattr(nx, self.manifest["graph_type"])
+        node_info = self._table("nodes")
+        edge_info = self._table("edges")
+        graph = graph_class(**node_info["graph"])
+
+        node_records = self._records(node_info["table"], node_info["missing"], ["n_id"])
+        for record, geometry in zip(node_records, self.node_geometries()):
+            record["geometry"] = geometry
+        graph.add_nodes_from(zip(node_info["table"]["n_id"], node_records))
+
+        edges = edge_info["table"]
+        edge_columns = (
+            ["source", "target", "key"]
+            if graph.is_multigraph()
+            else ["source", "target"]
+        )
+        edge_records = self._records(edges, edge_info["missing"], edge_columns)
+        for record, geometry, length in zip(
+            edge_records, self.edge_geometries(), self.edge_length
+        ):
+            record["geometry"] = geometry
+            record["length"] = float(length)
+        index_values = zip(*[edges[column] for column in edge_columns])
+        graph.add_edges_from(
+            (*index, record) for index, record in zip(index_values, edge_records)
+        )
+        return graph
+
+
+def open_cache(key, cache_dir=None):
+    """
+    Open the network cache for key, if it exists and is valid.
+
+    Parameters
+    ----------
+    key : str
+        The cache key, see `cache_key`.
+    cache_dir : pathlib.Path, optional
+        The cache directory. The default is `get_cache_dir()`.
+
+    Returns
+    -------
+    NetworkCache or None
+        The opened cache or None if it is not available.
+    """
+    cache_dir = pathlib.Path(cache_dir) if cache_dir else get_cache_dir()
+    cache_path = cache_dir / key
+    if not (cache_path / "manifest.json").exists():
+        return None
+    try:
+        return NetworkCache(cache_path)
+    except ValueError as e:
+        logger.warning("Ignoring network cache %s: %s", cache_path, e)
+        return None
@@ -1,15 +1,108 @@
 """Routines for postprocessing the results of OpenCLSim/OpenTNSim"""
+import datetime
+import itertools
 import json
 
 import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
+import shapely.geometry
 import shapely.wkt
 import random
 
-import plotly.graph_objs as go
-from plotly.offline import init_notebook_mode, iplot
-import plotly.express as px
+# plotly is imported by the chart functions, it is slow to import
+
+
+def logbook_to_df(logbook):
+    """
+    Convert a logbook to a log data frame. A columnar logbook is converted without
+    the Meta dictionaries, see `log_meta`.
+
+    Parameters
+    ----------
+    logbook : dtv_backend.logbook.Logbook or list
+        The logbook, a columnar logbook or a list of log entries.
+
+    Returns
+    -------
+    log_df : pd.DataFrame
+        Log data frame.
+    """
+    if hasattr(logbook, "to_frame"):
+        return logbook.to_frame(meta=False)
+    return pd.DataFrame(logbook)
+
+
+def log_meta(log_df):
+    """
+    Return the metadata per log entry that is not in the columns (for example the
+    energy_profile of sailing). This is the meta column of a columnar logbook
+    (None for entries without metadata) or Meta.
+    """
+    if "meta" in log_df:
+        return log_df["meta"]
+    return log_df["Meta"]
+
+
+def _log_columns(log_df):
+    """
+    Return the actor name, actor type, state and description per log entry. The
+    columnar logbook provides these as columns, otherwise they are read from Meta.
+    """
+    columns = ["actor_name", "actor_type", "state", "description"]
+    if all(column in log_df for column in columns):
+        return log_df[columns]
+    meta = log_df["Meta"]
+    return pd.DataFrame(
+        {
+            "actor_name": meta.map(lambda x: x["actor"].name),
+            "actor_type": meta.map(lambda x: type(x["actor"]).__name__),
+            "state": meta.map(lambda x: x["state"]),
+            "description": meta.map(lambda x: x.get("description")),
+        },
+        index=log_df.index,
+    )
+
+
+def activity_intervals(log_df):
+    """
+    Pair the START and STOP entries of the log by activity id.
+
+    Parameters
+    ----------
+    log_df : pd.DataFrame
+        Log data frame as produced by logbook to dataframe conversion.
+
+    Returns
+    -------
+    intervals : pd.DataFrame
+        One row per started activity, ordered by activity id, with Start, Stop (NaT
+        if the activity did not stop), Name, Description, Actor, Actor type and
+        Geometry (of the start).
+    """
+    columns = _log_columns(log_df)
+    state = columns["state"]
+    starts = log_df[state == "START"].drop_duplicates("ActivityID")
+    stops = log_df[state == "STOP"].drop_duplicates("ActivityID")
+    stop_times = pd.Series(
+        stops["Timestamp"].to_numpy(), index=stops["ActivityID"].to_numpy()
+    )
+    start_columns = columns.loc[starts.index]
+    intervals = pd.DataFrame(
+        {
+            "ActivityID": starts["ActivityID"].to_numpy(),
+            "Start": starts["Timestamp"].to_numpy(),
+            "Stop": stop_times.reindex(starts["ActivityID"].to_numpy()).to_numpy(),
+            "Name": starts["Message"].to_numpy(),
+            "Description": start_columns["description"].to_numpy(),
+            "Actor": start_columns["actor_name"].to_numpy(),
+            "Actor type": start_columns["actor_type"].to_numpy(),
+            "Geometry": starts["geometry"].to_numpy(),
+        }
+    )
+    intervals = intervals.sort_values("ActivityID", kind="stable")
+    return intervals.reset_index(drop=True)
 
 
 def log2gantt(log_df):
@@ -26,19 +119,9 @@ def log2gantt(log_df):
     fig : plotly.graph_objs._figure.Figure
         Gantt chart figure.
     """
-    log_df["actor_name"] = log_df["Meta"].apply(lambda x: x["actor"].name)
-    log_df["state"] = log_df["Meta"].apply(lambda x: x["state"])
-    gantt_df = pd.DataFrame(
-        log_df.pivot(index="ActivityID", columns="state")[
-            [
-                ("Timestamp", "START"),
-                ("Timestamp", "STOP"),
-                ("Message", "START"),
-                ("actor_name", "START"),
-            ]
-        ].values,
-        columns=["Start", "Stop", "Name", "Actor"],
-    )
+    import plotly.express as px
+
+    gantt_df = activity_intervals(log_df)[["Start", "Stop", "Name", "Actor"]]
     # TODO: check why operator cycle ends with NaN
     gantt_df = gantt_df.dropna()
     # add proper gantt chart headers
@@ -51,6 +134,183 @@ def log2gantt(log_df):
     return fig
 
 
+def json_default(value):
+    """serialize numpy scalars, dates and times"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _format_times(times):
+    """format datetimes as strings, None if missing"""
+    strings = pd.Series(times).dt.strftime("%Y-%m-%d %H:%M:%S").to_numpy(dtype=object)
+    strings[pd.isna(strings)] = None
+    return strings
+
+
+def _epoch_seconds(times):
+    """convert datetimes to integer seconds since 1970, None if missing"""
+    times = pd.Series(times)
+    seconds = times.to_numpy(dtype="datetime64[s]").astype(np.int64).astype(object)
+    seconds[times.isna().to_numpy()] = None
+    return seconds
+
+
+def _log_properties(intervals):
+    """the feature properties of the activities, as in the log response"""
+    return pd.DataFrame(
+        {
+            "Start": _format_times(intervals["Start"]),
+            "Stop": _format_times(intervals["Stop"]),
+            "Name": intervals["Name"].to_numpy(),
+            "Description": intervals["Description"].to_numpy(),
+            "Actor": intervals["Actor"].to_numpy(),
+            "Actor type": intervals["Actor type"].to_numpy(),
+            "Start Timestamp": _epoch_seconds(intervals["Start"]),
+            "Stop Timestamp": _epoch_seconds(intervals["Stop"]),
+        }
+    )
+
+
+def _as_geometries(geometries):
+    """convert to an array of shapely geometries, GeoJSON dicts are converted"""
+    geometries = pd.Series(geometries).to_numpy(dtype=object).copy()
+    is_geometry = shapely.is_geometry(geometries)
+    for i in np.flatnonzero(~is_geometry):
+        if isinstance(geometries[i], dict):
+            geometries[i] = shapely.geometry.shape(geometries[i])
+        else:
+            geometries[i] = None
+    return geometries
+
+
+def _properties_records(properties):
+    """convert a properties table to dicts, missing values become None"""
+    properties = properties.astype(object)
+    properties = properties.where(properties.notna(), None)
+    return properties.to_dict("records")
+
+
+def geojson_features(properties, geometries):
+    """
+    Build a GeoJSON feature collection from a properties table and geometries.
+
+    Parameters
+    ----------
+    properties : pd.DataFrame
+        The properties of the features.
+    geometries : sequence
+        A shapely geometry (or GeoJSON dict or None) per feature.
+
+    Returns
+    -------
+    dict
+        The feature collection, feature ids are the row numbers.
+    """
+    geometries = _as_geometries(geometries)
+    features = [
+        {
+            "id": str(i),
+            "type": "Feature",
+            "properties": record,
+            "geometry": None if geometry is None else geometry.__geo_interface__,
+        }
+        for i, (record, geometry) in enumerate(
+            zip(_properties_records(properties), geometries)
+        )
+    ]
+    return {"type": "FeatureCollection", "features": features}
+
+
+def iter_feature_json(properties, geometries, first_id=0, members=None):
+    """
+    Write GeoJSON features as JSON text, one feature at a time. The geometries are
+    written by GEOS, see `geojson_features` for the parameters.
+
+    Parameters
+    ----------
+    first_id : int, optional
+        The id of the first feature, the ids are numbered from there.
+    members : dict, optional
+        Extra members of each feature.
+
+    Yields
+    ------
+    str
+        The JSON text of a feature.
+    """
+    geometries = _as_geometries(geometries)
+    is_geometry = shapely.is_geometry(geometries)
+    geometry_json = np.full(len(geometries), "null", dtype=object)
+    geometry_json[is_geometry] = shapely.to_geojson(geometries[is_geometry])
+
+    prefix = '{"id": "%d", '
+    if members:
+        # the braces of the members are part of the feature
+        prefix += json.dumps(members, default=json_default)[1:-1] + ", "
+    template = prefix + '"type": "Feature", "properties": %s, "geometry": %s}'
+    for i, record in enumerate(_properties_records(properties)):
+        properties_json = json.dumps(record, default=json_default)
+        yield template % (first_id + i, properties_json, geometry_json[i])
+
+
+def iter_geojson(properties, geometries, chunk_size=1000):
+    """
+    Write a GeoJSON feature collection as JSON text, in parts. The geometries are
+    written by GEOS, see `geojson_features` for the parameters.
+
+    Yields
+    ------
+    str
+        Parts of the JSON text.
+    """
+    features = iter_feature_json(properties, geometries)
+    yield '{"type": "FeatureCollection", "features": ['
+    separator = ""
+    while True:
+        chunk = list(itertools.islice(features, chunk_size))
+        if not chunk:
+            break
+        yield separator + ",".join(chunk)
+        separator = ","
+    yield "]}"
+
+
+def _log_features(log_df):
+    """the properties and geometries of the log response"""
+    intervals = activity_intervals(log_df)
+    # drop missings
+    # TODO: fix the cause of these missings
+    intervals = intervals[~intervals["Name"].isna()].reset_index(drop=True)
+    return _log_properties(intervals), intervals["Geometry"]
+
+
+def log_to_gdf(log_df):
+    """
+    Convert a log dataframe to a table of activities, as in the log response but
+    with Start and Stop as datetimes.
+
+    Parameters
+    ----------
+    log_df : pd.DataFrame
+        Log data frame as produced by logbook to dataframe conversion.
+
+    Returns
+    -------
+    gpd.GeoDataFrame
+        Start, Stop, Name, Description, Actor, Actor type and geometry per activity.
+    """
+    intervals = activity_intervals(log_df)
+    # TODO: fix the cause of these missings
+    intervals = intervals[~intervals["Name"].isna()].reset_index(drop=True)
+    geometry = _as_geometries(intervals["Geometry"])
+    return gpd.GeoDataFrame(
+        intervals.drop(columns=["ActivityID", "Geometry"]), geometry=geometry
+    )
+
+
 def log2json(log_df):
     """
     Convert a log dataframe to a pivoted geojson.
@@ -65,59 +325,19 @@ def log2json(log_df):
     json_obj : dict
         GeoJSON representation of the log data.
     """
-    log_df["actor_name"] = log_df["Meta"].apply(lambda x: x["actor"].name)
-    log_df["actor_type"] = log_df["Meta"].apply(lambda x: type(x["actor"]).__name__)
-    log_df["state"] = log_df["Meta"].apply(lambda x: x["state"])
-    log_df["description"] = log_df["Meta"].apply(lambda x: x["description"])
-
-    # rename to these columns
-    columns = [
-        "Start",
-        "Stop",
-        "Name",
-        "Description",
-        "Actor",
-        "Actor type",
-        "Geometry",
-    ]
-    pivot_df = pd.DataFrame(
-        # the pivot creates a multi-index, pick to create a single index
-        log_df.pivot(index="ActivityID", columns="state")[
-            [
-                ("Timestamp", "START"),
-                ("Timestamp", "STOP"),
-                ("Message", "START"),
-                ("description", "START"),
-                ("actor_name", "START"),
-                ("actor_type", "START"),
-                ("geometry", "START"),
-            ]
-        ].values,
-        columns=columns,
-    )
-
-    pivot_df["Start Timestamp"] = pivot_df["Start"].values.astype(np.int64) // 10**9
-    pivot_df["Stop Timestamp"] = pivot_df["Stop"].values.astype(np.int64) // 10**9
-
-    export_columns = [*columns, "Start Timestamp", "Stop Timestamp"]
-    pivot_df["Start"] = pivot_df["Start"].dt.strftime("%Y-%m-%d %H:%M:%S")
-    pivot_df["Stop"] = pivot_df["Stop"].dt.strftime("%Y-%m-%d %H:%M:%S")
+    return geojson_features(*_log_features(log_df))
 
-    # make geometry consistent
-    geometry = pivot_df["Geometry"].apply(
-        lambda x: shapely.geometry.shape(x)
-        if (hasattr(x, "geom_type") or isinstance(x, dict))
-        else None
-    )
-    pivot_df["Geometry"] = geometry
-    pivot_df = gpd.GeoDataFrame(pivot_df[export_columns], geometry="Geometry")
 
-    # drop missings
-    # TODO: fix the cause of these missings
-    pivot_df = pivot_df[~pivot_df["Name"].isna()]
+def iter_log_geojson(log_df):
+    """
+    Convert a log dataframe to pivoted geojson text, see `log2json`.
 
-    json_str = pivot_df.to_json()
-    return json.loads(json_str)
+    Yields
+    ------
+    str
+        Parts of the JSON text.
+    """
+    return iter_geojson(*_log_features(log_df))
 
 
 #%% Visualization of vessel planning
@@ -209,6 +429,9 @@ def vessel_planning(
     fig : plotly.graph_objs._figure.Figure or dict
         Plotly figure object or dictionary for static plots.
     """
+    import plotly.graph_objs as go
+    from plotly.offline import init_notebook_mode, iplot
+
 
     if activities is None:
         activities = []
@@ -304,29 +527,31 @@ def energy_gdf_from_log_df(log_df):
     energy_gdf : gpd.GeoDataFrame
         Energy log as a GeoDataFrame.
     """
-    # append all energy logs together
-
-    def row2energy_df(row):
-        """create an energy dataframe for a sailing message"""
-        energy_df_i = pd.DataFrame(row["Meta"]["energy_profile"])
-        return energy_df_i
-
     # lookup all stop messages
     sailing_stop_idx = np.logical_and(
         log_df["Message"] == "Sailing",
-        log_df["Meta"].apply(lambda x: x["state"]) == "STOP",
+        _log_columns(log_df)["state"] == "STOP",
     )
 
-    stop_messages = log_df[sailing_stop_idx]
-    # from each stop message get the energy_profile
-    energy_df = pd.concat(
-        stop_messages.apply(row2energy_df, axis=1).values
-    ).reset_index(drop=True)
+    # from each stop message get the energy_profile, append them all together
+    profiles = log_meta(log_df)[sailing_stop_idx]
+    energy_df = pd.DataFrame(
+        [row for profile in profiles for row in profile["energy_profile"]]
+    )
     energy_gdf = gpd.GeoDataFrame(energy_df)
 
     return energy_gdf
 
 
+def _energy_properties(energy_gdf):
+    """the feature properties of the energy log"""
+    # drop this column. Too big and unserializable due to extra geometry
+    properties = pd.DataFrame(energy_gdf.drop(columns=["edge", "geometry"]))
+    # Time as string in json
+    properties["t"] = _format_times(properties["t"])
+    return properties
+
+
 def energy_gdf_to_json(energy_gdf):
     """
     Convert the energy log to json.
@@ -342,10 +567,224 @@ def energy_gdf_to_json(energy_gdf):
         Energy log as a JSON object.
     
     """
-    # drop this column. Too big and unserializable due to extra geometry
-    energy_gdf = energy_gdf.drop(columns=["edge"])
-    # Time as string in json
-    energy_gdf["t"] = energy_gdf["t"].dt.strftime("%Y-%m-%d %H:%M:%S")
-    energy_json_str = energy_gdf.to_json()
-    energy_json = json.loads(energy_json_str)
-    return energy_json
+    return geojson_features(_energy_properties(energy_gdf), energy_gdf["geometry"])
+
+
+def _env_times(env):
+    """the start and end time of the simulation"""
+    return {
+        "epoch": env.epoch.timestamp(),
+        "epoch_iso": env.epoch.isoformat(),
+        "now": env.now,
+        "now_iso": datetime.datetime.fromtimestamp(env.now).isoformat(),
+    }
+
+
+def result_frames(result, with_energy=False):
+    """
+    Convert the logbook of a simulation run to the log data frame and the energy
+    log, once, so that they can be shared by the response and the stored result.
+
+    Parameters
+    ----------
+    result : dict
+        Result of `dtv_backend.simulate.run`, `v2_run` or `v3_run`.
+    with_energy : bool, optional
+        Extract the energy log (only available for the v3 kernel). The default is
+        False.
+
+    Returns
+    -------
+    log_df : pd.DataFrame
+        Log data frame.
+    energy_gdf : gpd.GeoDataFrame or None
+        Energy log, None without energy.
+    """
+    log_df = logbook_to_df(result["operator"].logbook)
+    energy_gdf = energy_gdf_from_log_df(log_df) if with_energy else None
+    return log_df, energy_gdf
+
+
+def result_to_response(result, with_energy=False, frames=None):
+    """
+    Convert the result of a simulation run to the response of the server.
+
+    Parameters
+    ----------
+    result : dict
+        Result of `dtv_backend.simulate.run`, `v2_run` or `v3_run`.
+    with_energy : bool, optional
+        Add the energy log (only available for the v3 kernel). The default is False.
+    frames : tuple, optional
+        The log data frame and energy log of the result, see `result_frames`.
+
+    Returns
+    -------
+    response : dict
+        The log, the energy log (optional), the config and the environment times.
+    """
+    log_df, energy_gdf = frames or result_frames(result, with_energy=with_energy)
+    log_json = log2json(log_df)
+    response = {"log": log_json}
+    if with_energy:
+        response["energy_log"] = energy_gdf_to_json(energy_gdf)
+    response.update({"config": result["config"], "env": _env_times(result["env"])})
+    return response
+
+
+def iter_response_json(result, with_energy=False, extra=None, frames=None):
+    """
+    Convert the result of a simulation run to the JSON text of the server response,
+    in parts, see `result_to_response`. The log tables are computed before the
+    first part is returned (or passed as frames, see `result_frames`). Items of the
+    extra dict are added to the response.
+
+    Yields
+    ------
+    str
+        Parts of the JSON text.
+    """
+    log_df, energy_gdf = frames or result_frames(result, with_energy=with_energy)
+    parts = [iter_log_geojson(log_df)]
+    keys = ["log"]
+    if with_energy:
+        parts.append(
+            iter_geojson(_energy_properties(energy_gdf), energy_gdf["geometry"])
+        )
+        keys.append("energy_log")
+    config_json = json.dumps(result["config"], default=json_default)
+    env_json = json.dumps(_env_times(result["env"]))
+    extra_json = "".join(
+        f", {json.dumps(key)}: {json.dumps(value, default=json_default)}"
+        for key, value in (extra or {}).items()
+    )
+
+    def generate():
+        yield "{"
+        for key, part in zip(keys, parts):
+            yield f"{json.dumps(key)}: "
+            yield from part
+            yield ", "
+        yield f'"config": {config_json}, "env": {env_json}{extra_json}}}'
+
+    return generate()
+
+
+class LogStream:
+    """
+    Convert the entries of a growing logbook to GeoJSON features as soon as the
+    activities are finished. Activities that started but did not finish yet are kept
+    until their STOP entry is logged.
+
+    Parameters
+    ----------
+    logbook : dtv_backend.logbook.Logbook
+        The logbook of the simulation.
+    with_energy : bool, optional
+        Also convert the energy profiles of the finished trips. The default is False.
+    """
+
+    def __init__(self, logbook, with_energy=False):
+        """Start at the first entry of the logbook."""
+        self.logbook = logbook
+        self.with_energy = with_energy
+        # the number of entries that were read
+        self.offset = 0
+        # START entries of activities that did not finish
+        self.pending = None
+        self.n_features = {"log": 0, "energy_log": 0}
+
+    def _iter_features(self, collection, properties, geometries):
+        """write features of a collection, numbered per collection"""
+        features = iter_feature_json(
+            properties,
+            geometries,
+            first_id=self.n_features[collection],
+            members={"collection": collection},
+        )
+        self.n_features[collection] += len(properties)
+        return features
+
+    def features(self, final=False):
+        """
+        Return the features of the activities that finished since the last call.
+
+        Parameters
+        ----------
+        final : bool, optional
+            The simulation has finished, also return the activities that did not
+            finish (without stop time). The default is False.
+
+        Yields
+        ------
+        str
+            The JSON text of a feature. Features have a collection member, "log" for
+            activities and "energy_log" for the energy profile of trips.
+        """
+        new_df = self.logbook.to_frame(meta=False, start=self.offset)
+        self.offset += len(new_df)
+        log_df = new_df if self.pending is None else pd.concat([self.pending, new_df])
+
+        intervals = activity_intervals(log_df)
+        finished = intervals["Stop"].notna().to_numpy()
+        if not final:
+            unfinished_ids = intervals["ActivityID"][~finished]
+            self.pending = log_df[
+                (log_df["state"] == "START") & log_df["ActivityID"].isin(unfinished_ids)
+            ]
+            intervals = intervals[finished]
+        # TODO: fix the cause of these missings
+        intervals = intervals[~intervals["Name"].isna()].reset_index(drop=True)
+        yield from self._iter_features(
+            "log", _log_properties(intervals), intervals["Geometry"]
+        )
+
+        is_trip = (new_df["Message"] == "Sailing") & (new_df["state"] == "STOP")
+        if self.with_energy and is_trip.any():
+            energy_gdf = energy_gdf_from_log_df(new_df[is_trip])
+            yield from self._iter_features(
+                "energy_log", _energy_properties(energy_gdf), energy_gdf["geometry"]
+            )
+
+
+def iter_ndjson(results, with_energy=False, finish=None):
+    """
+    Convert a simulation that runs in steps to newline-delimited JSON. Each line is
+    a GeoJSON feature (see `LogStream.features`), written as soon as the activity
+    finished. The last line is a summary with the environment times and the number
+    of features.
+
+    Parameters
+    ----------
+    results : iterable
+        The result of the simulation after each step, see
+        `dtv_backend.simulate.v3_iter`.
+    with_energy : bool, optional
+        Add the energy profiles of the trips. The default is False.
+    finish : callable, optional
+        Called with the final result, returns a dict that is added to the summary.
+
+    Yields
+    ------
+    str
+        Lines of JSON text.
+    """
+    stream = None
+    result = None
+    for result in results:
+        if stream is None:
+            stream = LogStream(result["operator"].logbook, with_energy=with_energy)
+        for feature in stream.features():
+            yield feature + "\n"
+    if stream is None:
+        return
+    for feature in stream.features(final=True):
+        yield feature + "\n"
+    summary = {
+        "type": "Summary",
+        "env": _env_times(result["env"]),
+        "n_features": stream.n_features,
+    }
+    if finish is not None:
+        summary.update(finish(result))
+    yield json.dumps(summary, default=json_default) + "\n"
@@ -0,0 +1,474 @@
+"""
+Simulation results stored as Parquet tables, by result id.
+
+The GeoJSON responses of the simulate routes are large and the chart routes used to
+receive them back and parse them again. A stored result is a directory with one
+(Geo)Parquet table per output, geometries are stored as WKB:
+
+- ``log.parquet``: the activities (see `dtv_backend.postprocessing.log_to_gdf`)
+- ``energy_log.parquet``: the energy profile of all trips
+- ``quantities_<name>.parquet``: the quantities per edge from the configuration
+  (bathymetry, waterlevels, velocities)
+- ``config.json``: the rest of the configuration
+- ``env.json``: the simulated period
+
+The chart routes read the tables by result id. A `ResultStore` keeps the tables
+that were stored or read recently in memory (least recently used, within a byte
+budget), so repeated chart requests do not read or parse anything. Writing and
+reading the Parquet files requires pyarrow. Without it results are only kept in
+memory. Results on disk are removed when they are older than a time to live or when
+the results directory exceeds its disk budget, oldest first.
+"""
+
+import collections
+import json
+import logging
+import os
+import pathlib
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+import geopandas as gpd
+import shapely
+
+import dtv_backend.postprocessing
+
+logger = logging.getLogger(__name__)
+
+# result ids are uuid4 hex strings, they are used as directory name
+result_id_pattern = re.compile(r"^[0-9a-f]{32}$")
+
+
+class ResultNotFound(KeyError):
+    """Raised when a result (or a table of a result) does not exist."""
+
+
+def get_results_dir():
+    """
+    Return the directory where results are stored. Can be configured with the
+    DTV_RESULTS_DIR environment variable.
+
+    Returns
+    -------
+    pathlib.Path
+        The results directory.
+    """
+    results_dir = os.environ.get("DTV_RESULTS_DIR", "~/.cache/dtv_backend/results")
+    return pathlib.Path(results_dir).expanduser()
+
+
+def result_path(result_id, results_dir=None):
+    """
+    Return the directory of a result.
+
+    Raises
+    ------
+    ResultNotFound
+        If result_id is not a valid result id.
+    """
+    if not isinstance(result_id, str) or not result_id_pattern.match(result_id):
+        raise ResultNotFound(f"Invalid result id {result_id}")
+    results_dir = pathlib.Path(results_dir) if results_dir else get_results_dir()
+    return results_dir / result_id
+
+
+def result_tables(result, with_energy=False, frames=None):
+    """
+    Convert the result of a simulation run to tables.
+
+    Parameters
+    ----------
+    result : dict
+        Result of `dtv_backend.simulate.run`, `v2_run` or `v3_run`.
+    with_energy : bool, optional
+        Add the energy log (only available for the v3 kernel). The default is False.
+    frames : tuple, optional
+        The log data frame and energy log of the result, see
+        `dtv_backend.postprocessing.result_frames`.
+
+    Returns
+    -------
+    dict
+        GeoDataFrame per table name.
+    """
+    log_df, energy_gdf = frames or dtv_backend.postprocessing.result_frames(
+        result, with_energy=with_energy
+    )
+    tables = {"log": dtv_backend.postprocessing.log_to_gdf(log_df)}
+    if with_energy:
+        # the edge attributes are not needed and do not fit in a table
+        tables["energy_log"] = energy_gdf.drop(columns=["edge"])
+    for name, quantity in result["config"].get("quantities", {}).items():
+        tables[f"quantities_{name}"] = gpd.GeoDataFrame.from_features(
+            quantity["features"]
+        )
+    return tables
+
+
+def table_nbytes(table):
+    """approximate memory used by a table, including the geometry coordinates"""
+    nbytes = int(table.memory_usage(deep=True).sum())
+    if isinstance(table, gpd.GeoDataFrame) and table.geometry.name in table:
+        geometries = table.geometry.to_numpy()
+        nbytes += int(shapely.get_num_coordinates(geometries).sum()) * 16
+    return nbytes
+
+
+def write_tables(path, tables, config, env_times):
+    """
+    Write the tables, config and simulated period of a result to a directory.
+
+    Parameters
+    ----------
+    path : pathlib.Path
+        The result directory, it is replaced atomically.
+    tables : dict
+        GeoDataFrame per table name.
+    config : dict
+        The configuration (without quantities).
+    env_times : dict
+        The simulated period (epoch, now).
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # write to a temporary directory first, so readers never see a partial result
+    tmp_path = pathlib.Path(tempfile.mkdtemp(dir=path.parent))
+    try:
+        for name, table in tables.items():
+            table.to_parquet(tmp_path / f"{name}.parquet", index=False)
+        with open(tmp_path / "config.json", "w") as f:
+            json.dump(config, f, default=dtv_backend.postprocessing.json_default)
+        with open(tmp_path / "env.json", "w") as f:
+            json.dump(env_times, f)
+        if path.exists():
+            shutil.rmtree(path)
+        tmp_path.rename(path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    logger.info("Stored result %s", path)
+
+
+class ResultStore:
+    """
+    Results on disk with an in-memory cache of the tables.
+
+    Parameters
+    ----------
+    results_dir : pathlib.Path, optional
+        The results directory. The default is `get_results_dir()`.
+    max_bytes : int, optional
+        The memory budget of the cached tables. The default is the
+        DTV_RESULT_CACHE_MB environment variable or 256MB.
+    max_disk_bytes : int, optional
+        The disk budget of the results directory. The default is the
+        DTV_RESULTS_MAX_MB environment variable or 2000MB.
+    ttl : float, optional
+        The number of seconds to keep results on disk. The default is the
+        DTV_RESULTS_TTL environment variable or 7 days.
+    """
+
+    def __init__(self, results_dir=None, max_bytes=None, max_disk_bytes=None, ttl=None):
+        """Create a store, nothing is read until it is used."""
+        self.results_dir = (
+            pathlib.Path(results_dir) if results_dir else get_results_dir()
+        )
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("DTV_RESULT_CACHE_MB", 256)) * 1000**2
+        if max_disk_bytes is None:
+            max_disk_bytes = int(os.environ.get("DTV_RESULTS_MAX_MB", 2000)) * 1000**2
+        if ttl is None:
+            ttl = float(os.environ.get("DTV_RESULTS_TTL", 7 * 24 * 3600))
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        # (result_id, name) -> (value, nbytes)
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cache(self, key, value, nbytes):
+        """keep a value in memory, evict the least recently used values"""
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= self._items.pop(key)[1]
+            if nbytes > self.max_bytes:
+                # it would evict everything else
+                return
+            self._items[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_nbytes) = self._items.popitem(last=False)
+                self.nbytes -= evicted_nbytes
+
+    def _cached(self, key):
+        """return a cached value or None"""
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key][0]
+            self.misses += 1
+        return None
+
+    def put(self, tables, config=None, env_times=None):
+        """
+        Store the tables of a result.
+
+        Parameters
+        ----------
+        tables : dict
+            GeoDataFrame per table name, see `result_tables`.
+        config : dict, optional
+            The configuration (without quantities).
+        env_times : dict, optional
+            The simulated period (epoch, now).
+
+        Returns
+        -------
+        str
+            The result id. If the result could not be written (for example if
+            pyarrow is not installed) it is only available from memory.
+        """
+        result_id = uuid.uuid4().hex
+        config = config or {}
+        try:
+            write_tables(
+                result_path(result_id, results_dir=self.results_dir),
+                tables,
+                config,
+                env_times or {},
+            )
+        except (ImportError, OSError) as e:
+            logger.warning(
+                "Could not write result %s, keeping it in memory: %s", result_id, e
+            )
+        else:
+            self.cleanup(keep=result_id)
+        for name, table in tables.items():
+            self._cache((result_id, name), table, table_nbytes(table))
+        self._cache((result_id, "config.json"), config, 0)
+        return result_id
+
+    def table(self, result_id, name):
+        """
+        Return a table of a result. The table is shared, do not modify it.
+
+        Raises
+        ------
+        ResultNotFound
+            If the result or the table does not exist.
+        """
+        key = (result_id, name)
+        table = self._cached(key)
+        if table is None:
+            table = read_table(result_id, name, results_dir=self.results_dir)
+            self._cache(key, table, table_nbytes(table))
+        return table
+
+    def config(self, result_id):
+        """
+        Return the configuration (without quantities) of a result.
+
+        Raises
+        ------
+        ResultNotFound
+            If the result does not exist.
+        """
+        key = (result_id, "config.json")
+        config = self._cached(key)
+        if config is None:
+            config = read_config(result_id, results_dir=self.results_dir)
+            self._cache(key, config, 0)
+        return config
+
+    def cleanup(self, keep=None):
+        """
+        Remove results from disk that are older than `ttl` and the oldest results
+        while the results directory exceeds `max_disk_bytes`. Results that are in
+        memory stay available from memory.
+
+        Parameters
+        ----------
+        keep : str, optional
+            A result id that is not removed (the result that was just stored).
+
+        Returns
+        -------
+        list
+            The ids of the removed results.
+        """
+        results = []
+        if self.results_dir.exists():
+            for path in self.results_dir.iterdir():
+                if not result_id_pattern.match(path.name) or path.name == keep:
+                    continue
+                try:
+                    files = [f.stat() for f in path.iterdir()]
+                    mtime = path.stat().st_mtime
+                except OSError:
+                    # removed by another process
+                    continue
+                results.append((mtime, sum(f.st_size for f in files), path))
+        results.sort()
+        nbytes = sum(size for _, size, _ in results)
+        if keep is not None:
+            nbytes += sum(
+                f.stat().st_size
+                for f in result_path(keep, results_dir=self.results_dir).iterdir()
+            )
+        removed = []
+        now = time.time()
+        for mtime, size, path in results:
+            if now - mtime <= self.ttl and nbytes <= self.max_disk_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            nbytes -= size
+            removed.append(path.name)
+        if removed:
+            logger.info("Removed %s results from %s", len(removed), self.results_dir)
+        return removed
+
+    def clear(self):
+        """remove all tables from memory and reset the counters"""
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Return cache statistics.
+
+        Returns
+        -------
+        dict
+            hits, misses, size (number of tables), nbytes and max_bytes.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._items),
+            "nbytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+_result_store = None
+_result_store_lock = threading.Lock()
+
+
+def get_result_store():
+    """
+    Return the result store of this process. It is created on first use.
+
+    Returns
+    -------
+    ResultStore
+        The result store.
+    """
+    global _result_store
+    with _result_store_lock:
+        if _result_store is None:
+            _result_store = ResultStore()
+        return _result_store
+
+
+def store_result(result, with_energy=False, frames=None):
+    """
+    Store the result of a simulation run, see `ResultStore.put`.
+
+    Parameters
+    ----------
+    result : dict
+        Result of `dtv_backend.simulate.run`, `v2_run` or `v3_run`.
+    with_energy : bool, optional
+        Store the energy log (only available for the v3 kernel). The default is
+        False.
+    frames : tuple, optional
+        The log data frame and energy log of the result, see
+        `dtv_backend.postprocessing.result_frames`.
+
+    Returns
+    -------
+    str
+        The result id.
+    """
+    tables = result_tables(result, with_energy=with_energy, frames=frames)
+    config = {
+        key: value for key, value in result["config"].items() if key != "quantities"
+    }
+    env = result["env"]
+    env_times = {"epoch": env.epoch.timestamp(), "now": env.now}
+    return get_result_store().put(tables, config=config, env_times=env_times)
+
+
+def store_response(response):
+    """
+    Store a simulation response (as returned by the simulate routes, with GeoJSON
+    log, energy_log and config), for clients that have a response but no result id.
+
+    Returns
+    -------
+    str
+        The result id.
+    """
+    tables = {}
+    for name in ("log", "energy_log"):
+        if response.get(name):
+            tables[name] = gpd.GeoDataFrame.from_features(response[name]["features"])
+    config = dict(response.get("config") or {})
+    for name, quantity in config.pop("quantities", {}).items():
+        tables[f"quantities_{name}"] = gpd.GeoDataFrame.from_features(
+            quantity["features"]
+        )
+    return get_result_store().put(tables, config=config, env_times=response.get("env"))
+
+
+def read_table(result_id, name, results_dir=None):
+    """
+    Read a table of a stored result.
+
+    Parameters
+    ----------
+    result_id : str
+        The result id.
+    name : str
+        The table, for example "log", "energy_log" or "quantities_bathymetry".
+
+    Returns
+    -------
+    gpd.GeoDataFrame
+        The table.
+
+    Raises
+    ------
+    ResultNotFound
+        If the result or the table does not exist.
+    """
+    path = result_path(result_id, results_dir=results_dir) / f"{name}.parquet"
+    if not path.exists():
+        raise ResultNotFound(f"Result {result_id} has no table {name}")
+    return gpd.read_parquet(path)
+
+
+def read_config(result_id, results_dir=None):
+    """
+    Read the configuration (without quantities) of a stored result.
+
+    Raises
+    ------
+    ResultNotFound
+        If the result does not exist.
+    """
+    path = result_path(result_id, results_dir=results_dir) / "config.json"
+    if not path.exists():
+        raise ResultNotFound(f"Result {result_id} not found")
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,236 @@
+"""
+Shared cache for shortest paths.
+
+Ships sail the same port to port routes over and over again. The routes are stored in
+a least recently used (LRU) cache. The key of a route contains the identity of the
+network, the source, the target, the weight and any constraints that were applied
+(dimensions, CEMT class, closures).
+
+The cache does not notice changes to a graph. Call `invalidate` after adding,
+removing or changing edges of a graph in place, its cached routes are then no longer
+used. Note that the routing arrays (`dtv_backend.compact_graph.get_compact_graph`)
+are also built once per graph object, so prefer to modify a copy of the network
+(`graph.copy()`), which gets its own routes and routing arrays.
+"""
+
+import collections
+import logging
+import os
+import threading
+import uuid
+import weakref
+
+logger = logging.getLogger(__name__)
+
+
+def network_key(graph):
+    """
+    Return a key that identifies the network. The key is stored in the graph
+    attributes (set by `dtv_backend.fis.load_fis_network`). Graphs without a key get
+    a unique one.
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        The network.
+
+    Returns
+    -------
+    str
+        The network key.
+    """
+    if "network_key" not in graph.graph:
+        graph.graph["network_key"] = uuid.uuid4().hex
+    return graph.graph["network_key"]
+
+
+# graph object -> token, a token is never reused (unlike the id of the graph)
+_graph_tokens = weakref.WeakKeyDictionary()
+_graph_tokens_lock = threading.Lock()
+
+
+def graph_token(graph):
+    """
+    Return a token that identifies a graph object. Copies of a graph share the
+    network key, but get their own token.
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        The network.
+
+    Returns
+    -------
+    str
+        The token.
+    """
+    with _graph_tokens_lock:
+        token = _graph_tokens.get(graph)
+        if token is None:
+            token = _graph_tokens[graph] = uuid.uuid4().hex
+        return token
+
+
+def invalidate(graph):
+    """
+    Stop using the cached routes of a graph that was modified in place. The routes
+    are evicted from the cache as it fills up.
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        The network.
+    """
+    with _graph_tokens_lock:
+        _graph_tokens[graph] = uuid.uuid4().hex
+
+
+def _freeze(value):
+    """convert a constraint value to something hashable"""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(v) for v in value)
+    return value
+
+
+def route_key(graph, source, target, weight="length_m", constraints=None):
+    """
+    Create the cache key for a route.
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        The network.
+    source : str
+        The source node.
+    target : str
+        The target node.
+    weight : str, optional
+        The edge attribute used as weight. The default is "length_m".
+    constraints : dict, optional
+        The constraints applied to the network, for example
+        `{"width": 11.4, "cemt": "Va", "closures": {("a", "b")}}`.
+
+    Returns
+    -------
+    tuple
+        The key.
+    """
+    # copies of a graph share the network key but may have been modified, so the
+    # graph object is part of the key as well
+    return (
+        network_key(graph),
+        graph_token(graph),
+        source,
+        target,
+        weight,
+        _freeze(constraints or {}),
+    )
+
+
+class RouteCache:
+    """
+    Least recently used cache for routes.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        The maximum number of routes to keep. The default is 10000.
+    max_nodes : int, optional
+        The maximum number of nodes summed over all routes. The default is no limit.
+    """
+
+    def __init__(self, maxsize=10000, max_nodes=None):
+        """Create an empty cache."""
+        self.maxsize = maxsize
+        self.max_nodes = max_nodes
+        self.hits = 0
+        self.misses = 0
+        self.n_nodes = 0
+        self._routes = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._routes)
+
+    def get(self, key):
+        """return the route for key (a new list) or None"""
+        with self._lock:
+            route = self._routes.get(key)
+            if route is None:
+                self.misses += 1
+                return None
+            self._routes.move_to_end(key)
+            self.hits += 1
+            return list(route)
+
+    def put(self, key, route):
+        """store a route and evict the least recently used routes if needed"""
+        route = tuple(route)
+        with self._lock:
+            if key in self._routes:
+                self.n_nodes -= len(self._routes.pop(key))
+            self._routes[key] = route
+            self.n_nodes += len(route)
+            while self._routes and (
+                len(self._routes) > self.maxsize
+                or (self.max_nodes is not None and self.n_nodes > self.max_nodes)
+            ):
+                _, evicted = self._routes.popitem(last=False)
+                self.n_nodes -= len(evicted)
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached route for key or compute and store it.
+
+        Parameters
+        ----------
+        key : tuple
+            The route key, see `route_key`.
+        compute : callable
+            Function without arguments that returns the route.
+
+        Returns
+        -------
+        list
+            The route.
+        """
+        route = self.get(key)
+        if route is None:
+            route = compute()
+            self.put(key, route)
+        return list(route)
+
+    def clear(self):
+        """remove all routes and reset the counters"""
+        with self._lock:
+            self._routes.clear()
+            self.n_nodes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Return cache statistics.
+
+        Returns
+        -------
+        dict
+            hits, misses, hit_rate, size, maxsize and n_nodes.
+        """
+        n_requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / n_requests if n_requests else 0.0,
+            "size": len(self._routes),
+            "maxsize": self.maxsize,
+            "n_nodes": self.n_nodes,
+        }
+
+
+# the cache shared by all routing functions in this process
+route_cache = RouteCache(maxsize=int(os.environ.get("DTV_ROUTE_CACHE_SIZE", 10000)))
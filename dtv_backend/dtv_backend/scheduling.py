@@ -1,7 +1,9 @@
 """This module implements scheduling functionality using the python timeboard module."""
 
+# the annotations refer to timeboard, which is imported on first use
+from __future__ import annotations
+
 import datetime
-import timeboard as tb
 
 from opentnsim import core
 
@@ -58,6 +60,8 @@ class HasTimeboard(dtv_backend.logbook.HasLog, core.SimpyObject):
 
     def _create_timeboard(self) -> tb.Timeboard:
         """Create a timeboard, a schedule for trips"""
+        # timeboard is slow to import, import it when the first ship is created
+        import timeboard as tb
 
         max_trip_duration = 30
         t_start = self.env.epoch.replace(second=0, hour=0, minute=0, microsecond=0)
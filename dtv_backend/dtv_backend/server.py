@@ -1,5 +1,6 @@
 """Server for the Digital Twin Fairways backend."""
 
+import functools
 import io
 import pathlib
 import logging
@@ -7,17 +8,17 @@ import json
 
 import flask
 import pandas as pd
-import datetime
 
-import dtv_backend.simulate
 import dtv_backend.postprocessing
-import dtv_backend.fis
-import dtv_backend.climate
 import dtv_backend.charts
-import geopandas as gpd
+import dtv_backend.results
+import dtv_backend.warmup
 
-import networkx as nx
-import plotly.utils
+# The simulation modules (dtv_backend.simulate and dtv_backend.jobs import
+# opentnsim) and the network modules (dtv_backend.fis, dtv_backend.climate) take
+# seconds to import. They are imported by the routes that use them, so that the
+# app (and the command line interface) start quickly. Use the warmup to load them
+# up front, see `dtv_backend.warmup`.
 
 from flask_cors import CORS
 
@@ -39,76 +40,164 @@ def home():
 @dtv.route("/simulate", methods=["POST"])
 def simulate():
     """Simulate command."""
+    import dtv_backend.simulate
+
     config = flask.request.json
     result = dtv_backend.simulate.run(config)
     # TODO: get logbook from result['env']?
-    log_df = pd.DataFrame(result["operator"].logbook)
-    log_json = dtv_backend.postprocessing.log2json(log_df)
-    env = result["env"]
-    result = {
-        "log": log_json,
-        "config": config,
-        "env": {
-            "epoch": env.epoch.timestamp(),
-            "epoch_iso": env.epoch.isoformat(),
-            "now": env.now,
-            "now_iso": datetime.datetime.fromtimestamp(env.now).isoformat(),
-        },
-    }
+    result = dtv_backend.postprocessing.result_to_response(result)
     return flask.jsonify(result)
 
 
 @dtv.route("/v2/simulate", methods=["POST"])
 def v2_simulate():
     """Use the v2 simulation kernel."""
+    import dtv_backend.simulate
+
     config = flask.request.json
     # update to new run method
     result = dtv_backend.simulate.v2_run(config)
-    log_df = pd.DataFrame(result["operator"].logbook)
-    log_json = dtv_backend.postprocessing.log2json(log_df)
-    env = result["env"]
-    result = {
-        "log": log_json,
-        "config": config,
-        "env": {
-            "epoch": env.epoch.timestamp(),
-            "epoch_iso": env.epoch.isoformat(),
-            "now": env.now,
-            "now_iso": datetime.datetime.fromtimestamp(env.now).isoformat(),
-        },
-    }
+    result = dtv_backend.postprocessing.result_to_response(result)
     return flask.jsonify(result)
 
 
 @dtv.route("/v3/simulate", methods=["POST"])
 def v3_simulate():
-    """generate response for a simulation with the opentnsim compatible kernel"""
+    """
+    generate response for a simulation with the opentnsim compatible kernel
+
+    With ?stream=ndjson the activities and energy profiles are streamed as
+    newline-delimited GeoJSON features while the simulation runs, see
+    `dtv_backend.postprocessing.iter_ndjson`.
+    """
+    import dtv_backend.simulate
+
     config = flask.request.json
+    if flask.request.args.get("stream") == "ndjson":
+        results = dtv_backend.simulate.v3_iter(config)
+
+        def finish(result):
+            # store the result, so that the charts can read it by id
+            return {"result_id": dtv_backend.results.store_result(result, True)}
+
+        lines = dtv_backend.postprocessing.iter_ndjson(
+            results, with_energy=True, finish=finish
+        )
+        return flask.Response(
+            flask.stream_with_context(lines), mimetype="application/x-ndjson"
+        )
     result = dtv_backend.simulate.v3_run(config)
+    # convert the logbook once, for the stored result and the response
+    frames = dtv_backend.postprocessing.result_frames(result, with_energy=True)
+    result_id = dtv_backend.results.store_result(
+        result, with_energy=True, frames=frames
+    )
+    # write the json directly to the response, without building the dictionaries
+    chunks = dtv_backend.postprocessing.iter_response_json(
+        result, with_energy=True, extra={"result_id": result_id}, frames=frames
+    )
+    return flask.Response(chunks, mimetype="application/json")
 
-    env = result["env"]
-    log_df = pd.DataFrame(result["operator"].logbook)
-    log_json = dtv_backend.postprocessing.log2json(log_df)
-    energy_gdf = dtv_backend.postprocessing.energy_gdf_from_log_df(log_df)
-    energy_json = dtv_backend.postprocessing.energy_gdf_to_json(energy_gdf)
-
-    response = {
-        "log": log_json,
-        "energy_log": energy_json,
-        "config": config,
-        "env": {
-            "epoch": env.epoch.timestamp(),
-            "epoch_iso": env.epoch.isoformat(),
-            "now": env.now,
-            "now_iso": datetime.datetime.fromtimestamp(env.now).isoformat(),
-        },
-    }
-    return response
+
+@dtv.errorhandler(dtv_backend.results.ResultNotFound)
+def result_not_found(e):
+    """charts and tables of results that are not stored"""
+    return {"error": str(e)}, 404
+
+
+@dtv.route("/results/<result_id>/<name>.parquet", methods=["GET"])
+def result_table(result_id, name):
+    """return a table (log, energy_log, quantities_<name>) of a stored result"""
+    path = dtv_backend.results.result_path(result_id) / f"{name}.parquet"
+    if not path.exists():
+        raise dtv_backend.results.ResultNotFound(f"Result {result_id} has no {name}")
+    return flask.send_file(path, mimetype="application/vnd.apache.parquet")
+
+
+@dtv.route("/results", methods=["POST"])
+def store_results():
+    """
+    Store a simulation response (log, energy_log and config) that has no result id
+    yet. The charts can then be requested by result id, instead of posting the
+    response to every chart route.
+    """
+    body = flask.request.json
+    result_id = dtv_backend.results.store_response(body)
+    return {"result_id": result_id}, 201
+
+
+@dtv.route("/jobs", methods=["POST"])
+def submit_job():
+    """
+    Submit a simulation job, the body is the same as for the simulate routes. The
+    kernel (v1, v2, v3) can be passed as query parameter, default v3.
+    """
+    import dtv_backend.jobs
+
+    config = flask.request.json
+    kernel = flask.request.args.get("kernel", "v3")
+    if kernel not in ("v1", "v2", "v3"):
+        flask.abort(400, f"Unknown kernel {kernel}")
+    job_manager = dtv_backend.jobs.get_job_manager()
+    job_id = job_manager.submit_simulation(config, kernel=kernel)
+    response = job_manager.status(job_id)
+    return response, 202
+
+
+@dtv.route("/jobs", methods=["GET"])
+def list_jobs():
+    """return the status of all jobs"""
+    import dtv_backend.jobs
+
+    return {"jobs": dtv_backend.jobs.get_job_manager().list()}
+
+
+@dtv.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """return the status and progress of a job"""
+    import dtv_backend.jobs
+
+    try:
+        return dtv_backend.jobs.get_job_manager().status(job_id)
+    except KeyError:
+        flask.abort(404, f"Job {job_id} not found")
+
+
+@dtv.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    """cancel a job"""
+    import dtv_backend.jobs
+
+    try:
+        return dtv_backend.jobs.get_job_manager().cancel(job_id)
+    except KeyError:
+        flask.abort(404, f"Job {job_id} not found")
+
+
+@dtv.route("/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    """return the result of a finished job (202 with the status if not finished)"""
+    import dtv_backend.jobs
+
+    job_manager = dtv_backend.jobs.get_job_manager()
+    try:
+        status = job_manager.status(job_id)
+    except KeyError:
+        flask.abort(404, f"Job {job_id} not found")
+    if status["status"] in ("queued", "running"):
+        return status, 202
+    if status["status"] == "cancelled":
+        return status, 410
+    if status["status"] == "failed":
+        return status, 500
+    return job_manager.result(job_id)
 
 
 @dtv.route("/find_route", methods=["POST"])
 def find_route():
     """return a the route that passes through the `{"waypoints": ["node", "node"]}`"""
+    import dtv_backend.fis
+
     body = flask.request.json
     waypoints = body["waypoints"]
     network = dtv_backend.fis.load_fis_network(url)
@@ -117,40 +206,42 @@ def find_route():
     return route
 
 
-@dtv.route("/ships", methods=["GET"])
-def ships():
-    """return a the list of ships"""
+@functools.lru_cache(maxsize=1)
+def get_ships():
+    """return the included ships of the ship database, read once"""
     ships = pd.read_json(
         dtv_backend.get_src_path() / "data" / "DTV_shiptypes_database.json"
     )
     ships = ships[ships.Included.astype("bool")]
-    result = ships.to_dict(orient="records")
-    return result
+    return ships.to_dict(orient="records")
+
+
+@dtv.route("/ships", methods=["GET"])
+def ships():
+    """return a the list of ships"""
+    return get_ships()
 
 
 @dtv.route("/waterlevels", methods=["POST"])
 def waterlevels():
     """compute waterlevels for a given climate"""
+    import dtv_backend.climate
+    import dtv_backend.fis
+
     body = flask.request.json
     climate = body["climate"]
     network = dtv_backend.fis.load_fis_network(url)
 
-    river_with_discharges_gdf = dtv_backend.climate.get_river_with_discharges_gdf()
-    river_interpolator_gdf = dtv_backend.climate.create_river_interpolator_gdf(
-        river_with_discharges_gdf
-    )
-
-    epsg_utm31n = 32631
+    climate_table = dtv_backend.climate.get_climate_table("waterlevel")
 
-    # compute in utm zone
+    # distances are computed (once) in utm zone, the edges stay in wgs84
     result = dtv_backend.climate.interpolated_values_for_climate(
         climate=climate,
         graph=network,
-        river_interpolator_gdf=river_interpolator_gdf,
-        epsg=epsg_utm31n,
+        river_interpolator_gdf=climate_table,
+        epsg=4326,
         value_column="waterlevel",
     )
-    result = result.to_crs(4326)
     response = result._to_geo()
     return response
 
@@ -158,12 +249,15 @@ def waterlevels():
 @dtv.route("/climate", methods=["POST"])
 def climate():
     """compute all climate related quantities"""
+    import dtv_backend.climate
+    import dtv_backend.fis
+
     body = flask.request.json
     climate = body["climate"]
     logger.info("Getting network")
     graph = dtv_backend.fis.load_fis_network(url)
-    logger.info("Getting interpolators")
-    interpolators = dtv_backend.climate.get_interpolators()
+    logger.info("Getting climate tables")
+    interpolators = dtv_backend.climate.get_climate_tables()
     logger.info("Getting edges")
     edges_gdf = dtv_backend.fis.get_edges_gdf(graph=graph)
     logger.info("Getting climate")
@@ -229,6 +323,8 @@ def route_profile():
 @dtv.route("/charts/gantt", methods=["POST"])
 def gantt():
     """create configuration for plotly gantt chart"""
+    import plotly.utils
+
     body = flask.request.json
     fig = dtv_backend.charts.gantt(body)
     resp = fig.to_plotly_json()
@@ -238,12 +334,52 @@ def gantt():
     return resp
 
 
-def create_app():
-    """Serve"""
+@dtv.route("/ready", methods=["GET"])
+def ready():
+    """
+    Readiness of the server: 200 when the warmup is finished (or disabled), 503
+    while it runs or if a step failed, see `dtv_backend.warmup`.
+    """
+    warmup = flask.current_app.extensions.get("dtv_warmup")
+    if warmup is None:
+        return {"ready": True, "finished": True, "steps": {}}
+    status = warmup.status()
+    return status, 200 if status["ready"] else 503
+
+
+def warmup_steps(names=None):
+    """
+    The warmup steps of the server: the network, climate and ship database, see
+    `dtv_backend.warmup.select_steps` for names.
+    """
+    steps = dtv_backend.warmup.network_steps(url)
+    steps["ships"] = get_ships
+    return dtv_backend.warmup.select_steps(steps, names)
+
+
+def create_app(warmup=None):
+    """
+    Serve
+
+    Parameters
+    ----------
+    warmup : str, optional
+        The warmup mode: off, background or blocking. The default is the DTV_WARMUP
+        environment variable or off, see `dtv_backend.warmup`.
+    """
     app = flask.Flask("Digital Twin Fairways")
     CORS(app)
     app.register_blueprint(dtv)
     # add routes
+
+    if warmup is None:
+        warmup = dtv_backend.warmup.get_warmup_mode()
+    if warmup != "off":
+        app.extensions["dtv_warmup"] = dtv_backend.warmup.Warmup(warmup_steps())
+        if warmup == "blocking":
+            app.extensions["dtv_warmup"].run()
+        else:
+            app.extensions["dtv_warmup"].start()
     return app
 
 
@@ -8,15 +8,11 @@ import numpy as np
 import simpy
 import shapely.geometry
 
-# timeboard registration
-from pint import UnitRegistry
-
 import dtv_backend.fis
 import dtv_backend.logbook
 import dtv_backend.scheduling
 import dtv_backend.berthing
-
-ureg = UnitRegistry()
+import dtv_backend.units
 
 
 class Operator(dtv_backend.logbook.HasLog):
@@ -143,12 +139,7 @@ class Port(dtv_backend.logbook.HasLog):
             return self.env.timeout(0)
 
         # tonne / (tonne / hour) -> s
-        load_time = (
-            cargo_to_move
-            * ureg.metric_ton
-            / (self.loading_rate * (ureg.metric_ton / ureg.hour))
-        )
-        load_time = load_time.to(ureg.second).magnitude
+        load_time = dtv_backend.units.load_time(cargo_to_move, self.loading_rate)
 
         # log cargo levels before/after
         with self.log_context(
@@ -15,14 +15,70 @@ import dtv_backend.fis
 
 # the simpy processes and objects
 import dtv_backend.compat
+import dtv_backend.edge_quantities
+import dtv_backend.energy
 import dtv_backend.simple
 import dtv_backend.network.network_utilities
+import dtv_backend.route_cache
 
 
 logger = logging.getLogger(__name__)
 
-
-def run(config):
+# the FIS network used by the simulations
+network_url = "https://zenodo.org/record/6673604/files/network_digital_twin_v0.3.pickle?download=1"
+
+# simulated time between progress reports [s]
+progress_step = datetime.timedelta(days=1).total_seconds()
+
+
+def run_env(env, until, progress=None):
+    """
+    Run the environment until a timestamp. If progress is given the simulation runs
+    in steps (see `progress_step`) and reports after each step.
+
+    Parameters
+    ----------
+    env : simpy.Environment
+        The environment to run.
+    until : float
+        The timestamp to run until.
+    progress : callable, optional
+        Called as progress(now, start, until) after each step. It can stop the
+        simulation by raising an exception (see `dtv_backend.jobs.JobCancelled`).
+    """
+    if progress is None:
+        env.run(until=until)
+        return
+    start = env.now
+    for now in iter_env(env, until):
+        progress(now, start, until)
+
+
+def iter_env(env, until, step=progress_step):
+    """
+    Run the environment until a timestamp in steps and yield the time after each
+    step.
+
+    Parameters
+    ----------
+    env : simpy.Environment
+        The environment to run.
+    until : float
+        The timestamp to run until.
+    step : float, optional
+        The simulated time per step [s]. The default is `progress_step`.
+
+    Yields
+    ------
+    float
+        The simulated time.
+    """
+    while env.now < until:
+        env.run(until=min(env.now + step, until))
+        yield env.now
+
+
+def run(config, progress=None):
     """Run a simulation using the simple kernel."""
     # always start at now
     now = datetime.datetime.now()
@@ -70,7 +126,7 @@ def run(config):
     logger.info("Running simulation 👩‍💻")
     # Run for n days
     n_days_in_future = now + datetime.timedelta(days=60)
-    env.run(until=n_days_in_future.timestamp())
+    run_env(env, n_days_in_future.timestamp(), progress=progress)
 
     return {
         "env": env,
@@ -81,7 +137,7 @@ def run(config):
     }
 
 
-def v2_run(config):
+def v2_run(config, progress=None):
     """Run a simulation using the v2 kernel."""
     # always start at now
     now = datetime.datetime.now()
@@ -127,7 +183,7 @@ def v2_run(config):
     logger.info("Running simulation 👩‍💻")
     # Run for n days
     n_days_in_future = now + datetime.timedelta(days=60)
-    env.run(until=n_days_in_future.timestamp())
+    run_env(env, n_days_in_future.timestamp(), progress=progress)
 
     return {
         "env": env,
@@ -138,19 +194,20 @@ def v2_run(config):
     }
 
 
-def v3_run(config):
-    """run a simulation using the opentnsim compatibility kernel"""
-    logger.info("Running simulation 👩‍💻")
-    # Run for n days
+def v3_create(config):
+    """
+    Create the environment, ports, ships and operator of a simulation with the
+    opentnsim compatibility kernel, see `v3_run`.
 
+    Returns
+    -------
+    dict
+        The env, operator, ships, config and ports, before the simulation runs.
+    """
     env = create_env(config)
     ports = create_ports(env, config)
     ships = create_ships(env, config)
     operator = create_operator(env, ships, ports, config)
-
-    n_days = 60
-    n_days_in_future = env.epoch + datetime.timedelta(days=n_days)
-    env.run(until=n_days_in_future.timestamp())
     result = {
         "env": env,
         "operator": operator,
@@ -161,6 +218,58 @@ def v3_run(config):
     return result
 
 
+def v3_until(env):
+    """return the end time of a v3 simulation"""
+    # Run for n days
+    n_days = 60
+    n_days_in_future = env.epoch + datetime.timedelta(days=n_days)
+    return n_days_in_future.timestamp()
+
+
+def _log_cache_stats():
+    """log the statistics of the route and energy caches"""
+    logger.info("Route cache: %s", dtv_backend.route_cache.route_cache.stats())
+    logger.info(
+        "Sailing condition cache: %s", dtv_backend.energy.condition_cache.stats()
+    )
+    logger.info("Upperbound cache: %s", dtv_backend.energy.upperbound_cache.stats())
+
+
+def v3_run(config, progress=None):
+    """run a simulation using the opentnsim compatibility kernel"""
+    logger.info("Running simulation 👩‍💻")
+    result = v3_create(config)
+    env = result["env"]
+    run_env(env, v3_until(env), progress=progress)
+    _log_cache_stats()
+    return result
+
+
+def v3_iter(config, step=progress_step):
+    """
+    Run a simulation using the opentnsim compatibility kernel in steps, so that the
+    log can be processed while the simulation runs.
+
+    Parameters
+    ----------
+    config : dict
+        The simulation configuration.
+    step : float, optional
+        The simulated time per step [s]. The default is `progress_step`.
+
+    Yields
+    ------
+    dict
+        The result (see `v3_run`) after each step, the last one is final.
+    """
+    logger.info("Running simulation in steps 👩‍💻")
+    result = v3_create(config)
+    env = result["env"]
+    for _ in iter_env(env, v3_until(env), step=step):
+        yield result
+    _log_cache_stats()
+
+
 def create_env(config):
     """Create an environment for the simulation based on the config."""
     # always start at now
@@ -170,8 +279,7 @@ def create_env(config):
     env.epoch = now
 
     # read the network from google for performance reasons
-    url = "https://zenodo.org/record/6673604/files/network_digital_twin_v0.3.pickle?download=1"
-    G = dtv_backend.fis.load_fis_network(url)
+    G = dtv_backend.fis.load_fis_network(network_url)
     env.FG = G
     return env
 
@@ -203,6 +311,8 @@ def create_ships(env, config):
     logger.info("Loading ships 🚢")
 
     quantity_df = create_quantity_df(config)
+    # index the quantities once, they are shared by all ships
+    edge_quantities = dtv_backend.edge_quantities.EdgeQuantities(quantity_df)
     ships = []
     for ship in config["fleet"]:
         print(ship)
@@ -234,6 +344,7 @@ def create_ships(env, config):
         # ship = dtv_backend.simple.Ship(env, **kwargs)
         ship = dtv_backend.compat.Ship(env=env, **kwargs)
         ship.quantity_df = quantity_df
+        ship.edge_quantities = edge_quantities
 
         print(ship.node)
         ships.append(ship)
@@ -0,0 +1,412 @@
+"""
+Spatial index for snapping locations onto the Fairway Information System (FIS) network.
+
+The index is built once per loaded network (see `get_network_index`) and answers
+nearest node / nearest edge queries without looping over the graph in python.
+Distances are computed in the coordinate system of the network (lon, lat), just like
+`shapely.geometry.Point.distance`, so results are identical to a brute force search.
+
+It also provides the edge coordinates oriented in the direction of sailing (see
+`get_edge_coordinates`), so that the geometry of a path can be assembled without
+parsing WKT.
+"""
+import functools
+import logging
+
+import numpy as np
+import scipy.spatial
+import shapely
+import shapely.geometry
+import shapely.wkt
+
+
+logger = logging.getLogger(__name__)
+
+
+def _node_geometry(node):
+    """return the point geometry of a FIS node"""
+    geometry = node.get("geometry")
+    if isinstance(geometry, shapely.geometry.base.BaseGeometry):
+        return geometry
+    return shapely.geometry.Point(node["X"], node["Y"])
+
+
+def _edge_geometry(edge):
+    """return the line geometry of a FIS edge"""
+    geometry = edge.get("geometry")
+    if isinstance(geometry, shapely.geometry.base.BaseGeometry):
+        return geometry
+    return shapely.wkt.loads(edge["Wkt"])
+
+
+def _as_points(points):
+    """convert a point or a sequence of points (or x, y pairs) to an array of points"""
+    if isinstance(points, shapely.geometry.base.BaseGeometry):
+        points = [points]
+    points = list(points)
+    points = [
+        point
+        if isinstance(point, shapely.geometry.base.BaseGeometry)
+        else shapely.geometry.Point(*point)
+        for point in points
+    ]
+    return np.array(points, dtype=object)
+
+
+class NetworkIndex:
+    """
+    Spatial index over the nodes and edges of a network.
+
+    Nodes are indexed with a STRtree (nearest and within-radius) and a KD-tree
+    (k-nearest). Edges are indexed with a STRtree. The closest edge is defined, as in
+    `dtv_backend.fis.find_closest_edge`, by the Hausdorff distance between the point
+    and the edge geometry. Ties are resolved in graph order.
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        The graph to index. Nodes should have a geometry (or X, Y), edges a geometry
+        (or Wkt).
+    """
+
+    def __init__(self, graph):
+        """Build the index for the nodes and edges of graph."""
+        self.nodes = list(graph.nodes)
+        self.edges = list(graph.edges)
+
+        self.node_geometries = np.array(
+            [_node_geometry(graph.nodes[n]) for n in self.nodes], dtype=object
+        )
+        self.edge_geometries = np.array(
+            [_edge_geometry(graph.edges[e]) for e in self.edges], dtype=object
+        )
+        self.node_coordinates = shapely.get_coordinates(self.node_geometries)
+
+        self.node_tree = shapely.STRtree(self.node_geometries)
+        self.edge_tree = shapely.STRtree(self.edge_geometries)
+        self.node_kdtree = scipy.spatial.cKDTree(self.node_coordinates)
+
+        logger.info(
+            "Built spatial index for %s nodes and %s edges",
+            len(self.nodes),
+            len(self.edges),
+        )
+
+    def nearest_nodes(self, points):
+        """
+        Find the closest node for each point.
+
+        Parameters
+        ----------
+        points : shapely.geometry.Point or sequence of points
+            The points (or (x, y) pairs) to snap.
+
+        Returns
+        -------
+        names : list
+            The name of the closest node per point.
+        distances : numpy.ndarray
+            The distance to the closest node per point.
+        """
+        points = _as_points(points)
+        (point_idx, node_idx), distances = self.node_tree.query_nearest(
+            points, all_matches=True, return_distance=True
+        )
+        # in case of ties, use the first node in graph order
+        order = np.lexsort((node_idx, point_idx))
+        point_idx, node_idx, distances = (
+            point_idx[order],
+            node_idx[order],
+            distances[order],
+        )
+        _, first = np.unique(point_idx, return_index=True)
+        names = [self.nodes[i] for i in node_idx[first]]
+        return names, distances[first]
+
+    def nearest_node(self, point):
+        """
+        Find the closest node for a single point.
+
+        Returns
+        -------
+        name : str
+            The name of the closest node.
+        distance : float
+            The distance to the closest node.
+        """
+        names, distances = self.nearest_nodes([point])
+        return names[0], distances[0]
+
+    def k_nearest_nodes(self, points, k=1):
+        """
+        Find the k closest nodes for each point.
+
+        Parameters
+        ----------
+        points : shapely.geometry.Point or sequence of points
+            The points (or (x, y) pairs) to snap.
+        k : int, optional
+            The number of nodes to return per point. The default is 1.
+
+        Returns
+        -------
+        names : list of lists
+            The names of the k closest nodes per point, closest first.
+        distances : numpy.ndarray
+            Array of shape (n_points, k) with the corresponding distances.
+        """
+        points = _as_points(points)
+        k = min(k, len(self.nodes))
+        distances, node_idx = self.node_kdtree.query(
+            shapely.get_coordinates(points), k=k
+        )
+        distances = np.asarray(distances).reshape(len(points), k)
+        node_idx = np.asarray(node_idx).reshape(len(points), k)
+        names = [[self.nodes[i] for i in row] for row in node_idx]
+        return names, distances
+
+    def nodes_within(self, point, radius):
+        """
+        Find all nodes within radius of point, closest first.
+
+        Returns
+        -------
+        names : list
+            The names of the nodes within radius.
+        distances : numpy.ndarray
+            The corresponding distances.
+        """
+        node_idx = self.node_tree.query(point, predicate="dwithin", distance=radius)
+        node_idx = np.sort(node_idx)
+        distances = shapely.distance(point, self.node_geometries[node_idx])
+        order = np.argsort(distances, kind="stable")
+        return [self.nodes[i] for i in node_idx[order]], distances[order]
+
+    def _k_nearest_edges(self, point, k=1):
+        """return edge indices and Hausdorff distances of the k closest edges"""
+        k = min(k, len(self.edges))
+        # The Hausdorff distance is at least the plain distance. So once we know a
+        # Hausdorff distance for an edge, all closer edges are within that distance.
+        nearest_idx = self.edge_tree.query_nearest(point)
+        radius = shapely.hausdorff_distance(point, self.edge_geometries[nearest_idx[0]])
+        while True:
+            # pad the search radius a bit for round off in the distance computation
+            edge_idx = np.sort(
+                self.edge_tree.query(
+                    point, predicate="dwithin", distance=radius * (1 + 1e-9)
+                )
+            )
+            distances = shapely.hausdorff_distance(point, self.edge_geometries[edge_idx])
+            n_found = np.sum(distances <= radius)
+            if n_found >= k or len(edge_idx) == len(self.edges):
+                break
+            radius = radius * 2 if radius > 0 else 1e-6
+        order = np.argsort(distances, kind="stable")[:k]
+        return edge_idx[order], distances[order]
+
+    def nearest_edges(self, points):
+        """
+        Find the closest edge (by Hausdorff distance) for each point.
+
+        Parameters
+        ----------
+        points : shapely.geometry.Point or sequence of points
+            The points (or (x, y) pairs) to snap.
+
+        Returns
+        -------
+        names : list
+            The closest edge per point.
+        distances : numpy.ndarray
+            The Hausdorff distance to the closest edge per point.
+        """
+        points = _as_points(points)
+        names = []
+        distances = np.full(len(points), fill_value=np.nan)
+        for i, point in enumerate(points):
+            edge_idx, edge_distances = self._k_nearest_edges(point, k=1)
+            names.append(self.edges[edge_idx[0]])
+            distances[i] = edge_distances[0]
+        return names, distances
+
+    def nearest_edge(self, point):
+        """
+        Find the closest edge (by Hausdorff distance) for a single point.
+
+        Returns
+        -------
+        name : tuple
+            The closest edge.
+        distance : float
+            The Hausdorff distance to the closest edge.
+        """
+        names, distances = self.nearest_edges([point])
+        return names[0], distances[0]
+
+    def k_nearest_edges(self, points, k=1):
+        """
+        Find the k closest edges (by Hausdorff distance) for each point.
+
+        Returns
+        -------
+        names : list of lists
+            The k closest edges per point, closest first.
+        distances : numpy.ndarray
+            Array of shape (n_points, k) with the corresponding distances.
+        """
+        points = _as_points(points)
+        k = min(k, len(self.edges))
+        names = []
+        distances = np.full((len(points), k), fill_value=np.nan)
+        for i, point in enumerate(points):
+            edge_idx, edge_distances = self._k_nearest_edges(point, k=k)
+            names.append([self.edges[j] for j in edge_idx])
+            distances[i] = edge_distances
+        return names, distances
+
+    def edges_within(self, point, radius):
+        """
+        Find all edges that pass within radius of point, closest first. Here the plain
+        (not the Hausdorff) distance is used.
+
+        Returns
+        -------
+        names : list
+            The edges within radius.
+        distances : numpy.ndarray
+            The corresponding distances.
+        """
+        edge_idx = self.edge_tree.query(point, predicate="dwithin", distance=radius)
+        edge_idx = np.sort(edge_idx)
+        distances = shapely.distance(point, self.edge_geometries[edge_idx])
+        order = np.argsort(distances, kind="stable")
+        return [self.edges[i] for i in edge_idx[order]], distances[order]
+
+
+@functools.lru_cache(maxsize=100)
+def get_network_index(graph):
+    """
+    Return the spatial index for graph. The index is built on first use and reused
+    for as long as the graph is loaded.
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        The graph to index.
+
+    Returns
+    -------
+    NetworkIndex
+        The spatial index of graph.
+    """
+    return NetworkIndex(graph)
+
+
+class EdgeCoordinates:
+    """
+    Edge coordinates oriented from source to target.
+
+    Edge geometries in the FIS network do not always run from the source to the target
+    node. The coordinates of each edge are oriented once, using the node closest to
+    the first point of the edge, and extended with the node coordinates, as in
+    `dtv_backend.network.network_utilities.path2gdf`. Reversed edges (sailing from
+    target to source) are a reversed view of the same array.
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        The network. Nodes should have a geometry (or X, Y), edges a geometry
+        (or Wkt).
+    """
+
+    def __init__(self, graph):
+        """Orient the coordinates of all edges of graph."""
+        self.graph = graph
+        edges = list(graph.edges)
+        self.geometries = {e: _edge_geometry(graph.edges[e]) for e in edges}
+        node_coordinates = {
+            n: shapely.get_coordinates(_node_geometry(graph.nodes[n]))[0]
+            for n in graph.nodes
+        }
+
+        # all edge coordinates in one array, split per edge
+        coordinates, edge_idx = shapely.get_coordinates(
+            np.array(list(self.geometries.values()), dtype=object), return_index=True
+        )
+        # empty geometries have no coordinates, they get an empty slice
+        splits = np.searchsorted(edge_idx, np.arange(1, len(edges)))
+        self.coordinates = {}
+        for e, edge_coordinates in zip(edges, np.split(coordinates, splits)):
+            start_point = node_coordinates[e[0]]
+            end_point = node_coordinates[e[1]]
+            if len(edge_coordinates):
+                start_distance = np.hypot(*(edge_coordinates[0] - start_point))
+                end_distance = np.hypot(*(edge_coordinates[0] - end_point))
+                if start_distance >= end_distance:
+                    # inverted
+                    edge_coordinates = edge_coordinates[::-1]
+            # make sure geometries always start and end with node geometry
+            oriented = np.vstack([start_point, edge_coordinates, end_point])
+            oriented.flags.writeable = False
+            self.coordinates[e] = oriented
+        logger.info("Oriented coordinates of %s edges", len(self.coordinates))
+
+    def edge_coordinates(self, source, target):
+        """
+        Return the coordinates of an edge, oriented from source to target.
+
+        Returns
+        -------
+        numpy.ndarray
+            Read only array of shape (n, 2).
+        """
+        if (source, target) in self.coordinates:
+            return self.coordinates[source, target]
+        if not self.graph.is_directed() and (target, source) in self.coordinates:
+            return self.coordinates[target, source][::-1]
+        raise KeyError(f"No edge between {source} and {target}")
+
+    def edge_geometry(self, source, target):
+        """return the (not oriented) geometry of an edge"""
+        if (source, target) in self.geometries:
+            return self.geometries[source, target]
+        return self.geometries[target, source]
+
+    def path_coordinates(self, path):
+        """
+        Return the coordinates of a path, the edge coordinates concatenated without
+        repeating the nodes.
+
+        Returns
+        -------
+        numpy.ndarray
+            Array of shape (n, 2).
+        """
+        parts = [
+            self.edge_coordinates(a, b)[(1 if i else 0) :]
+            for i, (a, b) in enumerate(zip(path[:-1], path[1:]))
+        ]
+        return np.concatenate(parts)
+
+    def path_geometry(self, path):
+        """return the sailed path as a LineString"""
+        return shapely.geometry.LineString(self.path_coordinates(path))
+
+
+@functools.lru_cache(maxsize=100)
+def get_edge_coordinates(graph):
+    """
+    Return the oriented edge coordinates of graph. They are computed on first use and
+    reused for as long as the graph is loaded.
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        The network.
+
+    Returns
+    -------
+    EdgeCoordinates
+        The oriented edge coordinates of graph.
+    """
+    return EdgeCoordinates(graph)
@@ -0,0 +1,80 @@
+"""
+Units of the simulation.
+
+Creating a pint `UnitRegistry` parses its unit definitions, which takes most of a
+second. The registry is created once, on first use, and shared by all modules.
+
+The simulation uses fixed units: cargo in metric tonnes, loading rates in tonnes per
+hour and times in seconds. Conversions in the simulation loop (for example the
+loading time of every load and unload) use precomputed factors instead of pint
+quantities. Set the DTV_VALIDATE_UNITS environment variable to 1 to check these
+conversions against pint (slow, for debugging).
+"""
+
+import functools
+import math
+import os
+
+# seconds per hour, (tonne / (tonne / hour)) -> s
+seconds_per_hour = 3600.0
+
+validate_units = os.environ.get("DTV_VALIDATE_UNITS", "0").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+
+@functools.lru_cache(maxsize=1)
+def get_unit_registry():
+    """
+    Return the unit registry of this process.
+
+    Returns
+    -------
+    pint.UnitRegistry
+        The unit registry.
+    """
+    import pint
+
+    return pint.UnitRegistry()
+
+
+def _checked_load_time(cargo, loading_rate):
+    """the loading time in seconds, computed with pint quantities"""
+    ureg = get_unit_registry()
+    load_time = cargo * ureg.metric_ton / (loading_rate * (ureg.metric_ton / ureg.hour))
+    return load_time.to(ureg.second).magnitude
+
+
+def load_time(cargo, loading_rate):
+    """
+    Return the time to load or unload cargo.
+
+    Parameters
+    ----------
+    cargo : float
+        The cargo to move [tonne].
+    loading_rate : float
+        The loading rate [tonne / hour].
+
+    Returns
+    -------
+    float
+        The loading time [s].
+
+    Raises
+    ------
+    ValueError
+        If `validate_units` is enabled and the result differs from the pint
+        conversion.
+    """
+    seconds = cargo / loading_rate * seconds_per_hour
+    if validate_units:
+        expected = _checked_load_time(cargo, loading_rate)
+        if not math.isclose(seconds, expected, rel_tol=1e-9):
+            raise ValueError(
+                f"Loading time {seconds}s of {cargo}t at {loading_rate}t/h "
+                f"differs from the unit conversion {expected}s"
+            )
+    return seconds
@@ -0,0 +1,212 @@
+"""
+Warmup of the server.
+
+Without a warmup the first /find_route, /climate or /v3/simulate request loads the
+network (from the network cache or the url), builds the routing arrays and the
+spatial index, the edges with bathymetry and the climate tables, and imports the
+simulation modules. The warmup runs
+these steps when the app is created, so that the first request is as fast as the
+next ones. The progress is reported by the /ready route of the server.
+
+The warmup is configured with the DTV_WARMUP environment variable (or the
+--warmup option of the command line interface):
+
+- ``off`` (default): nothing is loaded up front.
+- ``background``: the steps run in a background thread, the server starts
+  immediately and /ready reports when the steps are finished.
+- ``blocking``: the steps run before the app is returned.
+
+DTV_WARMUP_STEPS selects steps (comma separated), the default is all steps.
+"""
+
+import functools
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+warmup_modes = ["off", "background", "blocking"]
+
+
+def get_warmup_mode():
+    """return the warmup mode, DTV_WARMUP or off"""
+    mode = os.environ.get("DTV_WARMUP", "off")
+    if mode not in warmup_modes:
+        raise ValueError(f"Unknown warmup mode {mode}, expected one of {warmup_modes}")
+    return mode
+
+
+# the steps import the modules they warm up, see `dtv_backend.server`
+
+
+def _network(network_url):
+    """load the network (from the network cache if available)"""
+    import dtv_backend.fis
+
+    return dtv_backend.fis.load_fis_network(network_url)
+
+
+def _routing(network_url):
+    """build or load the routing arrays"""
+    import dtv_backend.compact_graph
+
+    dtv_backend.compact_graph.get_compact_graph(_network(network_url))
+
+
+def _spatial_index(network_url):
+    """build the spatial index of nodes and edges"""
+    import dtv_backend.spatial
+
+    dtv_backend.spatial.get_network_index(_network(network_url))
+
+
+def _edges(network_url):
+    """build or load the edges with bathymetry"""
+    import dtv_backend.fis
+
+    dtv_backend.fis.get_edges_gdf(_network(network_url))
+
+
+def _climate(network_url):
+    """build or load the climate tables and their nearest edge locations"""
+    import dtv_backend.climate
+    import dtv_backend.fis
+
+    edges_gdf = dtv_backend.fis.get_edges_gdf(_network(network_url))
+    for table in dtv_backend.climate.get_climate_tables().values():
+        table.edge_index(edges_gdf)
+
+
+def _simulation(network_url):
+    """import the simulation modules (opentnsim) and the unit registry if needed"""
+    import dtv_backend.simulate
+    import dtv_backend.units
+
+    if dtv_backend.units.validate_units:
+        dtv_backend.units.get_unit_registry()
+
+
+def network_steps(network_url=None):
+    """
+    Return the warmup steps for a network, in order.
+
+    Parameters
+    ----------
+    network_url : str, optional
+        The network. The default is `dtv_backend.simulate.network_url`.
+
+    Returns
+    -------
+    dict
+        step name: function without arguments.
+    """
+    if network_url is None:
+        import dtv_backend.simulate
+
+        network_url = dtv_backend.simulate.network_url
+    steps = {
+        "network": _network,
+        "routing": _routing,
+        "spatial_index": _spatial_index,
+        "edges": _edges,
+        "climate": _climate,
+        "simulation": _simulation,
+    }
+    return {
+        name: functools.partial(step, network_url) for name, step in steps.items()
+    }
+
+
+def select_steps(steps, names=None):
+    """
+    Select steps by name, the default is the DTV_WARMUP_STEPS environment variable
+    or all steps.
+    """
+    if names is None:
+        names = os.environ.get("DTV_WARMUP_STEPS")
+    if not names:
+        return steps
+    if isinstance(names, str):
+        names = [name.strip() for name in names.split(",") if name.strip()]
+    unknown = set(names) - set(steps)
+    if unknown:
+        raise ValueError(f"Unknown warmup steps {unknown}, expected one of {steps}")
+    return {name: step for name, step in steps.items() if name in names}
+
+
+class Warmup:
+    """
+    Run warmup steps and keep track of their status.
+
+    Parameters
+    ----------
+    steps : dict
+        step name: function without arguments. The steps run in order. A failing
+        step is logged and the next steps still run.
+    """
+
+    def __init__(self, steps):
+        """Create a warmup, nothing runs until `run` or `start`."""
+        self.steps = dict(steps)
+        self.state = {name: {"status": "pending"} for name in self.steps}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._finished = threading.Event()
+
+    def _update(self, name, **info):
+        """update the state of a step"""
+        with self._lock:
+            self.state[name] = {**self.state[name], **info}
+
+    def run(self):
+        """run all steps in this thread"""
+        tic = time.perf_counter()
+        for name, step in self.steps.items():
+            self._update(name, status="running")
+            step_tic = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                logger.exception("Warmup step %s failed", name)
+                self._update(name, status="failed", error=repr(e))
+            else:
+                self._update(name, status="done")
+            self._update(name, duration=time.perf_counter() - step_tic)
+        self._finished.set()
+        logger.info("Warmup finished in %.1fs", time.perf_counter() - tic)
+
+    def start(self):
+        """run all steps in a background thread"""
+        self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def wait(self, timeout=None):
+        """wait until all steps are finished, return True if they are"""
+        return self._finished.wait(timeout)
+
+    @property
+    def ready(self):
+        """are all steps finished without failures?"""
+        with self._lock:
+            ok = all(state["status"] == "done" for state in self.state.values())
+        return self._finished.is_set() and ok
+
+    def status(self):
+        """
+        Return the status of the warmup.
+
+        Returns
+        -------
+        dict
+            ready, finished and the status, duration and error per step.
+        """
+        with self._lock:
+            steps = {name: dict(state) for name, state in self.state.items()}
+        return {
+            "ready": self.ready,
+            "finished": self._finished.is_set(),
+            "steps": steps,
+        }
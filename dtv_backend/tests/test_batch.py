@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+import datetime
+
+import geojson
+import pytest
+
+import dtv_backend.batch
+
+
+@pytest.fixture
+def config():
+    with open("tests/user/2022-10-21-config.json") as f:
+        config = geojson.load(f)
+    return config
+
+
+def test_expand_grid():
+    runs = dtv_backend.batch.expand_grid(
+        {"discharge_lobith": [1000, 2000, 3000], "with_berth": [True, False]}
+    )
+    assert len(runs) == 6
+    assert runs[0] == {"discharge_lobith": 1000, "with_berth": True}
+    assert dtv_backend.batch.expand_grid([{"n_ships": 2}]) == [{"n_ships": 2}]
+
+
+def test_apply_parameters(config):
+    run_config = dtv_backend.batch.apply_parameters(
+        config,
+        {
+            "discharge_lobith": 1500,
+            "n_ships": 3,
+            "shift_start_time": "07:00",
+            "with_berth": True,
+        },
+    )
+    assert run_config["climate"]["discharge_lobith"] == 1500
+    assert len(run_config["fleet"]) == 3
+    names = [ship["properties"]["name"] for ship in run_config["fleet"]]
+    assert len(set(names)) == 3
+    assert run_config["fleet"][2]["properties"]["shift_start_time"] == datetime.time(7)
+    assert run_config["options"]["with_berth"]
+    # the base configuration is not changed
+    assert len(config["fleet"]) == 1
+    assert config["climate"]["discharge_lobith"] == 2000
+
+    with pytest.raises(ValueError):
+        dtv_backend.batch.apply_parameters(config, {"unknown": 1})
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+import datetime
+
+import networkx as nx
+import simpy
+
+import dtv_backend.berthing
+
+
+def test_find_berth_unreachable():
+    """without reachable berths the ship sails to the destination"""
+    graph = nx.DiGraph()
+    graph.add_edge("A", "B", length_m=10.0)
+    graph.add_edge("B", "C", length_m=10.0)
+    # a berth next to the route, a dead end
+    graph.add_edge("B", "Berth_1", length_m=1.0)
+
+    ship = object.__new__(dtv_backend.berthing.CanBerth)
+    ship.env = simpy.Environment(initial_time=datetime.datetime(2020, 1, 1).timestamp())
+    ship.graph = graph
+    ship.berth_keyword = "Berth"
+    ship.edge_distance = "length_m"
+
+    berth = ship.find_berth(
+        "A",
+        "C",
+        max_timestamp=datetime.datetime(2020, 1, 2),
+        max_distance=1000,
+        mean_speed=3,
+        include_dst=False,
+    )
+    assert berth == "C"
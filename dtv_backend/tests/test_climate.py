@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+import geopandas as gpd
+import numpy as np
+import pytest
+import scipy.interpolate
+import shapely.geometry
+
+import dtv_backend.climate
+
+
+@pytest.fixture
+def interpolator_gdf():
+    """waterlevels at three locations along two rivers"""
+    discharges = {"Lobith": [1000.0, 2000.0, 4000.0], "st Pieter": [100.0, 500.0]}
+    rows = []
+    for km, (station, waterlevels) in enumerate(
+        [
+            ("Lobith", [8.0, 10.0, 13.0]),
+            ("Lobith", [6.0, 7.0, 9.0]),
+            ("st Pieter", [40.0, 42.0]),
+        ]
+    ):
+        rows.append(
+            {
+                "river": "Maas" if station == "st Pieter" else "Waal",
+                "km_markering": km,
+                "km_markering_int": km,
+                "discharge_location": station,
+                "interpolate": scipy.interpolate.interp1d(
+                    discharges[station], waterlevels, fill_value="extrapolate"
+                ),
+                "geometry": shapely.geometry.Point(5 + km * 0.01, 52),
+            }
+        )
+    return gpd.GeoDataFrame(rows, geometry="geometry", crs=4326)
+
+
+@pytest.fixture
+def edges_gdf():
+    """edges near the locations and one far away"""
+    rows = []
+    for i, x in enumerate([5.0, 5.011, 5.019, 6.0]):
+        rows.append(
+            {
+                "source": f"{i}",
+                "target": f"{i + 1}",
+                "length_m": 100.0,
+                "geometry": shapely.geometry.LineString([(x, 52.0), (x, 52.001)]),
+                "nap_p5": 1.0,
+                "nap_p50": 2.0,
+                "nap_p95": 3.0,
+                "lat_p5": 1.0,
+                "lat_p50": 2.0,
+                "lat_p95": 3.0,
+            }
+        )
+    return gpd.GeoDataFrame(rows, geometry="geometry", crs=4326)
+
+
+@pytest.mark.parametrize(
+    "climate",
+    [
+        {"discharge_lobith": 1500, "discharge_st_pieter": 300},
+        {"discharge_lobith": 500, "discharge_st_pieter": 600},
+        {"discharge_lobith": 5000, "discharge_st_pieter": 100},
+    ],
+)
+def test_climate_table(interpolator_gdf, climate):
+    """the table gives the same values as the interpolators, also extrapolated"""
+    table = dtv_backend.climate.ClimateTable.from_interpolator_gdf(interpolator_gdf)
+    expected = dtv_backend.climate.value_for_climate(
+        interpolator_gdf, climate
+    ).sort_index()
+    np.testing.assert_allclose(table.evaluate(climate), expected["waterlevel"])
+
+
+def test_save_load(interpolator_gdf, tmp_path):
+    table = dtv_backend.climate.ClimateTable.from_interpolator_gdf(interpolator_gdf)
+    table.save(tmp_path / "waterlevel.npz")
+    loaded = dtv_backend.climate.ClimateTable.load(tmp_path / "waterlevel.npz")
+    climate = {"discharge_lobith": 3000, "discharge_st_pieter": 200}
+    np.testing.assert_allclose(loaded.evaluate(climate), table.evaluate(climate))
+    assert loaded.locations["river"].tolist() == ["Waal", "Waal", "Maas"]
+
+
+def test_variables_for_climate(interpolator_gdf, edges_gdf, tmp_path, monkeypatch):
+    """edges get the value of the nearest location within max_distance"""
+    monkeypatch.setenv("DTV_CACHE_DIR", str(tmp_path))
+    table = dtv_backend.climate.ClimateTable.from_interpolator_gdf(interpolator_gdf)
+    climate = {"discharge_lobith": 2000, "discharge_st_pieter": 500}
+    result = dtv_backend.climate.get_variables_for_climate(
+        climate, {"velocity": table, "waterlevel": table}, edges_gdf
+    )
+    # the far away edge keeps its bathymetry
+    assert result["waterlevel"].tolist()[:3] == [10.0, 7.0, 42.0]
+    assert np.isnan(result["waterlevel"].iloc[3])
+
+    # the edge mapping is computed once and stored
+    index, distance = table.edge_index(edges_gdf)
+    assert table.edge_index(edges_gdf)[0] is index
+    assert len(list((tmp_path / "climate").glob("edges-*.npz"))) == 1
+    expected = gpd.sjoin_nearest(
+        edges_gdf.to_crs(dtv_backend.climate.epsg_utm31n),
+        interpolator_gdf.drop(columns=["interpolate"]).to_crs(
+            dtv_backend.climate.epsg_utm31n
+        ),
+        how="left",
+        max_distance=1500,
+        distance_col="distance",
+    )
+    assert index.tolist() == [0, 1, 2, -1]
+    assert index[:3].tolist() == expected["index_right"].tolist()[:3]
+    np.testing.assert_allclose(distance, expected["distance"])
+
+    # a new table with the same locations reads the stored mapping
+    loaded = dtv_backend.climate.ClimateTable.from_interpolator_gdf(interpolator_gdf)
+    assert loaded.edge_index(edges_gdf)[0].tolist() == index.tolist()
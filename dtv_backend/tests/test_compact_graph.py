@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+import networkx as nx
+import numpy as np
+
+import pytest
+
+import dtv_backend.compact_graph
+import dtv_backend.fis
+
+
+@pytest.fixture
+def graph():
+    """a random directed network with metric edge lengths"""
+    graph = nx.gnm_random_graph(200, 800, seed=3, directed=True)
+    graph = nx.relabel_nodes(graph, {n: str(n) for n in graph.nodes})
+    rng = np.random.default_rng(3)
+    for e in graph.edges:
+        graph.edges[e]["length_m"] = float(rng.uniform(10, 1000))
+        graph.edges[e]["Code"] = rng.choice(["III", "Va", "VIb"])
+    return graph
+
+
+def test_shortest_path(graph):
+    """the compact graph should find paths as short as networkx"""
+    compact_graph = dtv_backend.compact_graph.CompactGraph.from_networkx(graph)
+    for source, target in [("0", "10"), ("5", "199"), ("42", "7")]:
+        expected = nx.dijkstra_path_length(graph, source, target, weight="length_m")
+        path = compact_graph.shortest_path(source, target)
+        assert path[0] == source and path[-1] == target
+        assert dtv_backend.fis.compute_path_length(graph, path) == pytest.approx(
+            expected
+        )
+        assert compact_graph.path_length(path) == pytest.approx(expected)
+
+
+def test_shorted_path_backend(graph):
+    expected = dtv_backend.fis.shorted_path(graph, "1", "2", backend="networkx")
+    observed = dtv_backend.fis.shorted_path(graph, "1", "2", backend="compact")
+    assert dtv_backend.fis.compute_path_length(graph, observed) == pytest.approx(
+        dtv_backend.fis.compute_path_length(graph, expected)
+    )
+
+
+def test_nodes_within_distance(graph):
+    expected = dtv_backend.fis.nodes_within_distance(
+        graph, ["0", "1"], radius=500, backend="networkx"
+    )
+    observed = dtv_backend.fis.nodes_within_distance(
+        graph, ["0", "1"], radius=500, backend="compact"
+    )
+    assert observed == expected
+
+    # weights that the compact graph does not have fall back to networkx
+    for e in graph.edges:
+        graph.edges[e]["depth"] = graph.edges[e]["length_m"]
+    for weight in ["depth", lambda u, v, data: data["length_m"]]:
+        observed = dtv_backend.fis.nodes_within_distance(
+            graph, ["0", "1"], radius=500, weight=weight, backend="compact"
+        )
+        assert observed == expected
+
+
+def test_no_path():
+    graph = nx.DiGraph()
+    graph.add_edge("a", "b", length_m=1.0)
+    compact_graph = dtv_backend.compact_graph.CompactGraph.from_networkx(graph)
+    with pytest.raises(nx.NetworkXNoPath):
+        compact_graph.shortest_path("b", "a")
+
+
+def test_shorted_path_by_dimensions():
+    """narrow sections are avoided and the path stays metric"""
+    graph = nx.DiGraph()
+    graph.add_edge("a", "b", length_m=1.0, GeneralWidth=5.0)
+    graph.add_edge("b", "d", length_m=1.0)
+    graph.add_edge("a", "c", length_m=10.0, GeneralWidth=np.nan)
+    graph.add_edge("c", "d", length_m=10.0, GeneralWidth=None)
+    graph.add_edge("a", "e", length_m=2.0, GeneralWidth=20.0)
+    graph.add_edge("e", "f", length_m=2.0)
+    graph.add_edge("f", "d", length_m=2.0)
+
+    path = dtv_backend.fis.shorted_path_by_dimensions(
+        graph, "a", "d", width=4, height=1, depth=1, length=1
+    )
+    assert path == ["a", "b", "d"]
+    path = dtv_backend.fis.shorted_path_by_dimensions(
+        graph, "a", "d", width=11.4, height=1, depth=1, length=1
+    )
+    # the route over e, f has more edges but is shorter than the route over c
+    assert path == ["a", "e", "f", "d"]
+
+
+def test_path_restricted_to_cemt_class(graph):
+    """ships should only use edges of at least their own CEMT class"""
+    ordered = dtv_backend.fis.default_ordered_cemt_classes
+    layers = dtv_backend.fis.cemt_class_layers(graph)
+    assert layers["VIb"].sum() < layers["Va"].sum() < layers["III"].sum()
+
+    path = dtv_backend.fis.path_restricted_to_cemt_class(graph, "42", "7", "Va")
+    for e in zip(path[:-1], path[1:]):
+        assert ordered[graph.edges[e]["Code"]] >= ordered["Va"]
+
+    # the restricted network is a subgraph, so the route is never shorter
+    allowed = [
+        e for e in graph.edges if ordered[graph.edges[e]["Code"]] >= ordered["Va"]
+    ]
+    expected = nx.dijkstra_path_length(
+        graph.edge_subgraph(allowed), "42", "7", weight="length_m"
+    )
+    assert dtv_backend.fis.compute_path_length(graph, path) == pytest.approx(expected)
+    # M8 is CEMT class Va
+    assert dtv_backend.fis.path_restricted_to_ship_class(graph, "42", "7", "M8") == path
+
+    # ships of unknown classes are not restricted
+    assert dtv_backend.fis.path_restricted_to_cemt_class(
+        graph, "0", "10", "unknown"
+    ) == dtv_backend.fis.shorted_path(graph, "0", "10")
+
+
+def test_save_load(graph, tmp_path):
+    """a loaded (memory-mapped) compact graph should give the same paths"""
+    compact_graph = dtv_backend.compact_graph.CompactGraph.from_networkx(graph)
+    compact_graph.save(tmp_path)
+    loaded = dtv_backend.compact_graph.CompactGraph.load(tmp_path)
+    assert isinstance(loaded.sources, np.memmap)
+    assert loaded.categories == compact_graph.categories
+    for source, target in [("0", "10"), ("5", "199"), ("42", "7")]:
+        assert loaded.shortest_path(source, target) == compact_graph.shortest_path(
+            source, target
+        )
+
+    dtv_backend.compact_graph.register_compact_graph(graph, loaded)
+    assert dtv_backend.compact_graph.get_compact_graph(graph) is loaded
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+import networkx as nx
+import numpy as np
+
+import pytest
+
+import dtv_backend.distance_matrix
+import dtv_backend.fis
+
+
+@pytest.fixture
+def graph():
+    """a random directed network with metric edge lengths and a lock"""
+    graph = nx.gnm_random_graph(100, 400, seed=5, directed=True)
+    graph = nx.relabel_nodes(graph, {n: str(n) for n in graph.nodes})
+    rng = np.random.default_rng(5)
+    for e in graph.edges:
+        graph.edges[e]["length_m"] = float(rng.uniform(10, 1000))
+    # a lock as the only connection of node 0
+    graph.remove_edges_from(list(graph.in_edges("0")) + list(graph.out_edges("0")))
+    graph.add_edge("0", "L1_A", length_m=10.0)
+    graph.add_edge("L1_A", "L1_B", length_m=10.0)
+    graph.add_edge("L1_B", "1", length_m=10.0)
+    return graph
+
+
+def test_distance_matrix(graph):
+    """distances and paths should match networkx, in both directions"""
+    terminals = ["1", "2", "3"]
+    distance_matrix = dtv_backend.distance_matrix.DistanceMatrix(graph, terminals)
+    for terminal in terminals:
+        for node in ["4", "50", "99"]:
+            for source, target in [(terminal, node), (node, terminal)]:
+                expected = nx.dijkstra_path_length(
+                    graph, source, target, weight="length_m"
+                )
+                assert distance_matrix.distance(source, target) == pytest.approx(
+                    expected
+                )
+                path = distance_matrix.path(source, target)
+                assert path[0] == source and path[-1] == target
+                assert dtv_backend.fis.compute_path_length(
+                    graph, path
+                ) == pytest.approx(expected)
+
+    with pytest.raises(KeyError):
+        distance_matrix.distance("4", "5")
+    # node 0 can not be reached
+    assert np.isinf(distance_matrix.distance("1", "0"))
+    with pytest.raises(nx.NetworkXNoPath):
+        distance_matrix.path("1", "0")
+
+
+def test_has_structures(graph):
+    distance_matrix = dtv_backend.distance_matrix.DistanceMatrix(graph, ["1", "2"])
+    assert distance_matrix.has_structures("0", "2")
+    assert not distance_matrix.has_structures("1", "2")
+    path = distance_matrix.path("0", "2")
+    assert dtv_backend.fis.has_structures(path, graph)
+
+
+def test_berth_distance_matrix(graph):
+    graph.add_edge("1", "Berth_1", length_m=5.0)
+    graph.add_edge("Berth_1", "1", length_m=5.0)
+    distance_matrix = dtv_backend.distance_matrix.get_berth_distance_matrix(graph)
+    assert list(distance_matrix.terminals) == ["Berth_1"]
+    # the berths are looked up once per graph
+    assert dtv_backend.distance_matrix.get_berth_distance_matrix(graph) is (
+        distance_matrix
+    )
+    assert distance_matrix.distance("1", "Berth_1") == pytest.approx(5.0)
@@ -6,11 +6,14 @@ import datetime
 import simpy
 import geojson
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 
 import pytest
 
 import dtv_backend.compat
+import dtv_backend.edge_quantities
+import dtv_backend.energy
 import dtv_backend.simulate
 
 
@@ -59,3 +62,114 @@ def test_energy(env, quantity_df):
     pd.testing.assert_series_equal(
         test_cases["observed"], test_cases["expected"], check_names=False
     )
+
+
+def test_edge_quantities(quantity_df):
+    """path lookups should equal edge lookups, velocities flip against the flow"""
+    edge_quantities = dtv_backend.edge_quantities.EdgeQuantities(quantity_df)
+    row = quantity_df.dropna(subset=["velocity"]).iloc[0]
+    path = ["18008360", row.source, row.target, row.source]
+    depths, velocities = edge_quantities.path_quantities(path)
+    for i, e in enumerate(zip(path[:-1], path[1:])):
+        assert depths[i] == edge_quantities.get_waterdepth(e)
+        assert velocities[i] == edge_quantities.get_velocity(e)
+    assert depths[0] == dtv_backend.edge_quantities.default_waterdepth
+    assert velocities[1] == row.velocity
+    assert velocities[2] == -row.velocity
+
+
+class FakeVessel:
+    """vessel with cheap energy functions that counts the power2v calls"""
+
+    type = "test"
+    P_tot_given = 1000.0
+
+    def __init__(self):
+        self.n_power2v = 0
+
+    def power2v(self, vessel, edge, upperbound, h_0):
+        assert edge == {"Info": {"GeneralDepth": h_0}}
+        self.n_power2v += 1
+        self.P_given = self.P_tot_given * h_0 / 10
+        return h_0 / 2
+
+    def calculate_total_resistance(self, v, h_0):
+        pass
+
+    def calculate_total_power_required(self, v, h_0):
+        pass
+
+    def calculate_emission_factors_total(self, v, h_0):
+        self.total_factor_CO2 = v * 2
+        self.total_factor_PM10 = v * 3
+        self.total_factor_NOX = v * 4
+
+    def calculate_SFC_final(self, v, h_0):
+        self.final_SFC_diesel_ICE_vol = h_0 / 100
+
+
+def test_sail_path(monkeypatch):
+    """conditions are computed once and give the scalar results per edge"""
+    monkeypatch.setattr(
+        dtv_backend.energy.opentnsim.strategy,
+        "get_upperbound_for_power2v",
+        lambda vessel, width, depth, margin: (depth, None, None),
+    )
+    vessel = FakeVessel()
+    cache = dtv_backend.energy.MemoCache()
+    depths = np.array([6.0, 4.0, 6.0, 6.0])
+    velocities = np.array([0.0, 0.5, 0.0, -0.5])
+    distances = np.array([100.0, 200.0, 300.0, 400.0])
+    result = dtv_backend.energy.sail_path(
+        vessel, distances, depths, velocities, cache=cache
+    )
+    assert vessel.n_power2v == 3
+    v = depths / 2 - velocities
+    np.testing.assert_allclose(result["v"], v)
+    np.testing.assert_allclose(result["duration"], distances / v)
+    energy = vessel.P_tot_given * depths / 10 * distances / v / 3600
+    np.testing.assert_allclose(result["energy"], energy)
+    np.testing.assert_allclose(result["CO2"], v * 2 * energy)
+    np.testing.assert_allclose(result["fuel"], depths / 100 * energy)
+
+    # a second trip is served from the cache
+    dtv_backend.energy.sail_path(vessel, distances, depths, velocities, cache=cache)
+    assert vessel.n_power2v == 3
+    assert cache.stats()["hits"] == 3
+
+
+def test_get_upperbound(monkeypatch):
+    """upperbounds are cached per quantized depth, failures give None"""
+    calls = []
+
+    def get_upperbound_for_power2v(vessel, width, depth, margin):
+        calls.append(depth)
+        if depth < 1:
+            raise ValueError("too shallow")
+        if depth > 20:
+            raise IndexError("no grounding speed found")
+        return depth, None, None
+
+    monkeypatch.setattr(
+        dtv_backend.energy.opentnsim.strategy,
+        "get_upperbound_for_power2v",
+        get_upperbound_for_power2v,
+    )
+    vessel = FakeVessel()
+    cache = dtv_backend.energy.MemoCache()
+    assert dtv_backend.energy.get_upperbound(vessel, 5.003, cache=cache) == 5.0
+    assert dtv_backend.energy.get_upperbound(vessel, 5.001, cache=cache) == 5.0
+    assert dtv_backend.energy.get_upperbound(vessel, 0.5, cache=cache) is None
+    assert dtv_backend.energy.get_upperbound(vessel, 0.5, cache=cache) is None
+    assert len(calls) == 2
+    assert cache.stats()["hits"] == 2
+    # any failure falls back to no upperbound
+    assert dtv_backend.energy.get_upperbound(vessel, 25, cache=cache) is None
+
+
+@pytest.mark.parametrize(
+    "depth, expected", [(0.29, 0.29), (2.3, 2.3), (1.15, 1.15), (5.003, 5.0)]
+)
+def test_quantize_depth(depth, expected):
+    """exact centimetres are kept, other depths are rounded down"""
+    assert dtv_backend.energy.quantize_down(depth, 0.01) == expected
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+import json
+import subprocess
+import sys
+
+import pytest
+
+# slow to import, only the routes and commands that need them import them
+heavy_modules = [
+    "opentnsim",
+    "matplotlib",
+    "plotly",
+    "pint",
+    "timeboard",
+    "scipy.interpolate",
+    "dtv_backend.simulate",
+]
+
+script = """
+import json, sys, time
+tic = time.perf_counter()
+import {module}
+duration = time.perf_counter() - tic
+try:
+    import requests_cache
+    installed = requests_cache.is_installed()
+except ImportError:
+    installed = False
+print(json.dumps({{
+    "duration": duration,
+    "modules": [name for name in {heavy_modules!r} if name in sys.modules],
+    "requests_cache": installed,
+}}))
+"""
+
+
+@pytest.mark.parametrize("module", ["dtv_backend.server", "dtv_backend.cli"])
+def test_lazy_imports(module):
+    """the server and command line interface start without the heavy modules"""
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            script.format(module=module, heavy_modules=heavy_modules),
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    result = json.loads(output.splitlines()[-1])
+    print(f"import {module}: {result['duration']:.2f}s")
+    assert result["modules"] == []
+    assert not result["requests_cache"]
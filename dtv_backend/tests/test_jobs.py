@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+import time
+
+import pytest
+
+import dtv_backend.jobs
+
+
+def count_job(n, progress=None, delay=0.0):
+    """a job that reports progress n times"""
+    for i in range(n):
+        time.sleep(delay)
+        progress(i + 1, 0, n)
+    return {"n": n}
+
+
+@pytest.fixture(scope="module")
+def job_manager():
+    job_manager = dtv_backend.jobs.JobManager(max_workers=1, network_url=None)
+    yield job_manager
+    job_manager.shutdown()
+
+
+def test_job_result(job_manager):
+    job_id = job_manager.submit(count_job, 3)
+    assert job_manager.result(job_id, timeout=60) == {"n": 3}
+    status = job_manager.status(job_id)
+    assert status["status"] == "finished"
+    assert status["progress"] == 1.0
+    assert status["now"] == 3
+
+
+def test_job_cancel(job_manager):
+    job_id = job_manager.submit(count_job, 1000, delay=0.01)
+    # wait until the job runs
+    for _ in range(600):
+        if job_manager.status(job_id)["status"] == "running":
+            break
+        time.sleep(0.1)
+    job_manager.cancel(job_id)
+    with pytest.raises(dtv_backend.jobs.JobCancelled):
+        job_manager.result(job_id, timeout=60)
+    assert job_manager.status(job_id)["status"] == "cancelled"
+
+    with pytest.raises(KeyError):
+        job_manager.status("unknown")
+
+
+def test_job_cancel_while_reporting(job_manager):
+    """a cancel is not lost when the job reports progress at the same time"""
+    job_id = job_manager.submit(count_job, 10**4, delay=0.01)
+    for _ in range(600):
+        if job_manager.status(job_id).get("now"):
+            break
+        time.sleep(0.1)
+    stale_state = dict(job_manager.state[job_id])
+    job_manager.cancel(job_id)
+    # a progress report that read the state before the cancel writes it back
+    job_manager.state[job_id] = stale_state
+    with pytest.raises(dtv_backend.jobs.JobCancelled):
+        job_manager.result(job_id, timeout=60)
+    assert job_manager.status(job_id)["now"] < 10**4
+
+
+def test_evict_finished(job_manager, monkeypatch):
+    monkeypatch.setattr(job_manager, "max_finished_jobs", 2)
+    job_ids = [job_manager.submit(count_job, 1) for _ in range(3)]
+    for job_id in job_ids:
+        job_manager.result(job_id, timeout=60)
+    # the done callbacks run in the executor thread
+    for _ in range(100):
+        if all(job_manager.jobs[job_id].finished for job_id in job_ids):
+            break
+        time.sleep(0.01)
+    statuses = job_manager.list()
+    assert [status["job_id"] for status in statuses] == job_ids[1:]
+    with pytest.raises(KeyError):
+        job_manager.status(job_ids[0])
+    assert job_ids[0] not in job_manager.state
+
+    # finished jobs also expire
+    monkeypatch.setattr(job_manager, "finished_ttl", 0)
+    assert job_manager.evict_finished() == job_ids[1:]
+    assert job_manager.list() == []
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+import datetime
+import json
+
+import numpy as np
+import pandas as pd
+import shapely.geometry
+import simpy
+
+import pytest
+
+import dtv_backend.logbook
+import dtv_backend.postprocessing
+
+
+class Actor:
+    def __init__(self, name):
+        self.name = name
+        self.id = name
+
+
+@pytest.fixture
+def env():
+    t_start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    env = simpy.Environment(initial_time=t_start.timestamp())
+    return env
+
+
+def test_logbook(env):
+    """log activities and convert to a data frame"""
+    logbook = dtv_backend.logbook.Logbook(chunk_size=3)
+    actor = Actor("ship")
+    point = shapely.geometry.Point(4, 52)
+    for i in range(4):
+        with dtv_backend.logbook.LogDecorator(
+            env,
+            logbook,
+            "Sailing",
+            actor=actor,
+            actor_id=actor.id,
+            description="Sailing (ship)",
+            value=i,
+            energy_profile=[i],
+        ) as log:
+            log.geometry = point
+            env.run(env.now + 60)
+    # 8 entries in 3 chunks, one actor and one message
+    assert len(logbook) == 8
+    assert len(logbook.actors) == 1
+    assert logbook.strings.count("Sailing") == 1
+
+    df = logbook.to_frame()
+    assert list(df["state"][:2]) == ["START", "STOP"]
+    assert (df["actor_name"] == "ship").all()
+    assert (df["actor_type"] == "Actor").all()
+    assert df["Timestamp"].iloc[-1] == pd.Timestamp("2020-01-01 00:04:00")
+    assert list(df["Value"][::2]) == [0, 1, 2, 3]
+    assert df["geometry"].iloc[1] is point
+    assert df["ActivityID"].nunique() == 4
+    meta = df["Meta"].iloc[-1]
+    assert meta["actor"] is actor
+    assert meta["state"] == "STOP"
+    assert meta["energy_profile"] == [3]
+    # the extra metadata is available without building Meta
+    df = dtv_backend.postprocessing.logbook_to_df(logbook)
+    assert "Meta" not in df
+    assert df["meta"].iloc[-1]["energy_profile"] == [3]
+    assert "actor" not in df["meta"].iloc[-1]
+
+    # the entries in the format of a list logbook
+    entries = list(logbook)
+    assert entries[0]["Timestamp"] == datetime.datetime(2020, 1, 1)
+    assert pd.DataFrame(entries).shape[0] == 8
+
+
+def test_logbook_append():
+    """entries in the list format can be added"""
+    logbook = dtv_backend.logbook.Logbook()
+    logbook.append(
+        {
+            "Message": "Load",
+            "Timestamp": datetime.datetime(2020, 1, 1),
+            "Value": "full",
+            "geometry": None,
+            "ActivityID": 1,
+            "ActivityState": None,
+            "Meta": {"state": "START", "description": "Loading"},
+        }
+    )
+    df = logbook.to_frame()
+    assert df["Value"].iloc[0] == "full"
+    assert df["state"].iloc[0] == "START"
+    assert df["description"].iloc[0] == "Loading"
+    assert df["actor_name"].iloc[0] is None
+    assert np.isnan(logbook.column("value")[0])
+
+
+def test_log2json(env):
+    """activities are paired by activity id, also when written as text"""
+    logbook = dtv_backend.logbook.Logbook()
+    actor = Actor("ship")
+
+    def process():
+        with dtv_backend.logbook.LogDecorator(env, logbook, "Cycle", actor=actor):
+            for i in range(2):
+                with dtv_backend.logbook.LogDecorator(
+                    env,
+                    logbook,
+                    "Sailing",
+                    actor=actor,
+                    description="Sailing (ship)",
+                    geometry=shapely.geometry.LineString([(0, i), (1, i)]),
+                ):
+                    yield env.timeout(3600)
+
+    env.process(process())
+    env.run(until=env.now + 3600 * 1.5)
+    log_df = logbook.to_frame()
+
+    log_json = dtv_backend.postprocessing.log2json(log_df)
+    features = log_json["features"]
+    assert [feature["properties"]["Name"] for feature in features] == [
+        "Cycle",
+        "Sailing",
+        "Sailing",
+    ]
+    # the cycle and the second trip did not finish
+    assert features[0]["properties"]["Stop"] is None
+    assert features[1]["properties"]["Stop"] == "2020-01-01 01:00:00"
+    assert features[1]["properties"]["Stop Timestamp"] == 1577840400
+    assert features[2]["geometry"]["type"] == "LineString"
+
+    text = "".join(dtv_backend.postprocessing.iter_log_geojson(log_df))
+    assert json.loads(text) == json.loads(json.dumps(log_json))
+
+
+def test_log_stream(env):
+    """finished activities are written as soon as they are logged"""
+    logbook = dtv_backend.logbook.Logbook(chunk_size=4)
+    actor = Actor("ship")
+
+    def process():
+        with dtv_backend.logbook.LogDecorator(env, logbook, "Cycle", actor=actor):
+            for i in range(3):
+                with dtv_backend.logbook.LogDecorator(
+                    env, logbook, "Sailing", actor=actor, energy_profile=[]
+                ):
+                    yield env.timeout(3600)
+
+    env.process(process())
+    stream = dtv_backend.postprocessing.LogStream(logbook)
+    lines = []
+    for _ in range(4):
+        env.run(until=env.now + 3600)
+        lines.append([json.loads(line) for line in stream.features()])
+    # one trip per hour (events at the end of a step run in the next step), the
+    # cycle stops after the last trip
+    assert [len(features) for features in lines] == [0, 1, 1, 2]
+    assert lines[3][0]["properties"]["Name"] == "Cycle"
+    assert lines[3][1]["id"] == "3"
+    assert all(feature["collection"] == "log" for feature in lines[1])
+    assert list(stream.features(final=True)) == []
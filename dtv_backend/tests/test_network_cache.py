@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+import geopandas as gpd
+import networkx as nx
+import numpy as np
+import shapely.geometry
+
+import pytest
+
+import dtv_backend.fis
+import dtv_backend.network_cache
+
+
+@pytest.fixture
+def graph():
+    """a small geometrized network, like the result of load_fis_network"""
+    graph = nx.DiGraph(name="test")
+    coordinates = {"a": (4.0, 51.0), "b": (4.1, 51.1), "c": (4.2, 51.0)}
+    for n, (x, y) in coordinates.items():
+        graph.add_node(n, X=x, Y=y, n=n, geometry=shapely.geometry.Point(x, y))
+    for i, (source, target) in enumerate([("a", "b"), ("b", "c"), ("c", "a")]):
+        geometry = shapely.geometry.LineString(
+            [coordinates[source], coordinates[target]]
+        )
+        edge = {
+            "Wkt": geometry.wkt,
+            "geometry": geometry,
+            "length": 1000.0 * (i + 1),
+            "length_m": 1000.0 * (i + 1),
+            "Code": "Va",
+        }
+        # attribute that is only available on some edges
+        if i == 1:
+            edge["GeneralWidth"] = 12.0
+            edge["NumberOfLocks"] = 5
+            edge["IsTidal"] = True
+        graph.add_edge(source, target, **edge)
+    return graph
+
+
+def test_roundtrip(graph, tmp_path):
+    """a network read from the cache should equal the original"""
+    cache_path = tmp_path / "network"
+    dtv_backend.network_cache.write_cache(graph, cache_path, source={"url": "test"})
+    cache = dtv_backend.network_cache.NetworkCache(cache_path)
+
+    assert isinstance(cache.node_coordinates, np.memmap)
+    restored = cache.to_graph()
+
+    assert type(restored) is type(graph)
+    assert restored.graph == graph.graph
+    assert list(restored.nodes) == list(graph.nodes)
+    assert list(restored.edges) == list(graph.edges)
+    for n in graph.nodes:
+        assert restored.nodes[n] == graph.nodes[n]
+    for e in graph.edges:
+        assert set(restored.edges[e]) == set(graph.edges[e])
+        for key, value in graph.edges[e].items():
+            assert restored.edges[e][key] == value
+    assert "GeneralWidth" not in restored.edges["a", "b"]
+    # partially missing integers and booleans keep their type
+    assert type(restored.edges["b", "c"]["NumberOfLocks"]) is int
+    assert restored.edges["b", "c"]["IsTidal"] is True
+    assert "NumberOfLocks" not in restored.edges["c", "a"]
+
+
+def test_open_cache(graph, tmp_path):
+    key = dtv_backend.network_cache.cache_key("http://example.com/network.pickle")
+    assert dtv_backend.network_cache.open_cache(key, cache_dir=tmp_path) is None
+    dtv_backend.network_cache.write_cache(graph, tmp_path / key)
+    cache = dtv_backend.network_cache.open_cache(key, cache_dir=tmp_path)
+    assert cache.manifest["n_edges"] == 3
+
+
+@pytest.fixture
+def bathy_gdf():
+    """bathymetry of two of the three edges, one in the opposite direction"""
+    return gpd.GeoDataFrame(
+        {
+            "start-id": ["b", "a", "a"],
+            "end-id": ["a", "c", "c"],
+            **{column: [1.0, 2.0, 3.0] for column in dtv_backend.fis.bathy_columns},
+        },
+        geometry=[shapely.geometry.Point(0, 0)] * 3,
+        crs=4326,
+    )
+
+
+def test_merge_bathymetry(graph, bathy_gdf):
+    edges_gdf = gpd.GeoDataFrame(
+        nx.to_pandas_edgelist(graph), geometry="geometry", crs=4326
+    )
+    result = dtv_backend.fis.merge_bathymetry(edges_gdf, bathy_gdf)
+    assert list(result["source"]) == ["a", "b", "c"]
+    # both directions match, the last record wins
+    np.testing.assert_equal(result["nap_p50"].to_numpy(), [1.0, np.nan, 3.0])
+
+
+def test_edges_gdf_cache(graph, bathy_gdf, tmp_path, monkeypatch):
+    """the edges with bathymetry are stored with the network cache"""
+    pytest.importorskip("pyarrow")
+    monkeypatch.setenv("DTV_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(dtv_backend, "get_src_path", lambda: tmp_path)
+    (tmp_path / "data").mkdir()
+    bathy_gdf.to_file(tmp_path / "data" / "edges_0.3_with_bathy.geojson")
+    graph.graph["network_key"] = "test"
+    dtv_backend.network_cache.write_cache(
+        graph, dtv_backend.network_cache.get_cache_dir() / "test"
+    )
+
+    edges_gdf = dtv_backend.fis.get_edges_gdf.__wrapped__(graph)
+    (path,) = (tmp_path / "cache" / "network" / "test").glob("edges_with_bathy-*")
+    stored = gpd.read_parquet(path)
+    assert stored["nap_p50"].tolist()[::2] == edges_gdf["nap_p50"].tolist()[::2]
+    assert dtv_backend.fis.get_edges_gdf.__wrapped__(graph).crs == edges_gdf.crs
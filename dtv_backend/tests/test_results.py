@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+import datetime
+import json
+import os
+import time
+import types
+import uuid
+
+import shapely.geometry
+import simpy
+
+import pytest
+
+import dtv_backend.charts
+import dtv_backend.logbook
+import dtv_backend.postprocessing
+import dtv_backend.results
+
+
+class Ship:
+    def __init__(self, name):
+        self.name = name
+        self.id = name
+
+
+@pytest.fixture
+def result():
+    """a result with trips of one ship"""
+    t_start = datetime.datetime(2020, 1, 1)
+    env = simpy.Environment(initial_time=t_start.timestamp())
+    env.epoch = t_start
+    logbook = dtv_backend.logbook.Logbook()
+    ship = Ship("ship")
+
+    def process():
+        for i in range(3):
+            with dtv_backend.logbook.LogDecorator(
+                env, logbook, "Cycle", actor=ship, description="Cycle"
+            ):
+                profile = [
+                    {
+                        "e": ("a", "b"),
+                        "geometry": shapely.geometry.Point(i, 0),
+                        "t": datetime.datetime(2020, 1, 1, i),
+                        "energy": 10.0,
+                        "distance": 100.0,
+                        "edge": {},
+                    }
+                ]
+                with dtv_backend.logbook.LogDecorator(
+                    env,
+                    logbook,
+                    "Sailing",
+                    actor=ship,
+                    description="Sailing",
+                    geometry=shapely.geometry.LineString([(0, i), (1, i)]),
+                    energy_profile=profile,
+                ):
+                    yield env.timeout(3600)
+
+    env.process(process())
+    env.run()
+    return {
+        "env": env,
+        "operator": types.SimpleNamespace(logbook=logbook),
+        "config": {"route": []},
+    }
+
+
+def test_result_tables(result):
+    tables = dtv_backend.results.result_tables(result, with_energy=True)
+    assert len(tables["log"]) == 6
+    assert tables["log"]["Stop"].notna().all()
+    assert len(tables["energy_log"]) == 3
+    assert "edge" not in tables["energy_log"]
+
+
+def test_shared_frames(result):
+    """the response and the stored tables use the same converted logbook"""
+    frames = dtv_backend.postprocessing.result_frames(result, with_energy=True)
+    # the logbook is not read again
+    result = {**result, "operator": None}
+    tables = dtv_backend.results.result_tables(result, with_energy=True, frames=frames)
+    assert len(tables["energy_log"]) == 3
+    response = json.loads(
+        "".join(
+            dtv_backend.postprocessing.iter_response_json(
+                result, with_energy=True, frames=frames
+            )
+        )
+    )
+    assert len(response["log"]["features"]) == len(tables["log"])
+
+
+def test_invalid_result_id(tmp_path):
+    with pytest.raises(dtv_backend.results.ResultNotFound):
+        dtv_backend.results.result_path("../etc", results_dir=tmp_path)
+    with pytest.raises(dtv_backend.results.ResultNotFound):
+        dtv_backend.results.read_table("0" * 32, "log", results_dir=tmp_path)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """a result store in a temporary directory"""
+    store = dtv_backend.results.ResultStore(results_dir=tmp_path)
+    monkeypatch.setattr(dtv_backend.results, "_result_store", store)
+    return store
+
+
+def test_store_result(result, store):
+    """charts can read a stored result by id, also from memory only"""
+    result_id = dtv_backend.results.store_result(result, with_energy=True)
+    log_gdf = store.table(result_id, "log")
+    assert len(log_gdf) == 6
+    assert log_gdf.geometry.iloc[1].geom_type == "LineString"
+    assert store.config(result_id) == {"route": []}
+
+    echart = dtv_backend.charts.trip_duration({"result_id": result_id})
+    # three cycles of one hour
+    assert echart["series"][0]["data"] == [1.0, 1.0, 1.0]
+    echart = dtv_backend.charts.energy_per_distance({"result_id": result_id})
+    assert echart["series"][0]["data"][-1] == [300.0, 0.1]
+    echart = dtv_backend.charts.energy_per_time({"result_id": result_id})
+    assert echart["series"][0]["data"][0] == ["2020-01-01 00:00:00", 0.1]
+    assert store.stats()["misses"] == 0
+
+
+def test_read_result(result, store):
+    """results are read from disk when they are not in memory"""
+    pytest.importorskip("pyarrow")
+    result_id = dtv_backend.results.store_result(result, with_energy=True)
+    store.clear()
+    log_gdf = store.table(result_id, "log")
+    assert len(log_gdf) == 6
+    assert log_gdf.geometry.iloc[1].geom_type == "LineString"
+    assert store.table(result_id, "log") is log_gdf
+    assert store.config(result_id) == {"route": []}
+    assert store.stats()["hits"] == 1
+
+
+def test_result_cache_budget(result, tmp_path):
+    """the least recently used tables are evicted"""
+    tables = dtv_backend.results.result_tables(result)
+    nbytes = dtv_backend.results.table_nbytes(tables["log"])
+    store = dtv_backend.results.ResultStore(
+        results_dir=tmp_path, max_bytes=int(2.5 * nbytes)
+    )
+    result_ids = [store.put(tables) for _ in range(3)]
+    # two logs and three configs
+    assert store.stats()["size"] == 2 + 3
+    assert store.nbytes <= store.max_bytes
+    assert store._cached((result_ids[0], "log")) is None
+    assert store._cached((result_ids[2], "log")) is tables["log"]
+
+
+def test_result_disk_budget(tmp_path):
+    """old results and the oldest results beyond the disk budget are removed"""
+    store = dtv_backend.results.ResultStore(
+        results_dir=tmp_path, max_disk_bytes=2500, ttl=3600
+    )
+    now = time.time()
+    result_ids = []
+    # results of 1000 bytes, from two hours to one minute old
+    for age in [7200, 300, 200, 100, 60]:
+        result_id = uuid.uuid4().hex
+        path = tmp_path / result_id
+        path.mkdir()
+        (path / "log.parquet").write_bytes(b"0" * 1000)
+        os.utime(path, (now - age, now - age))
+        result_ids.append(result_id)
+    # other files are left alone
+    (tmp_path / "other").mkdir()
+
+    removed = store.cleanup(keep=result_ids[-1])
+    # the expired one, and the oldest ones until 2 results are left
+    assert removed == result_ids[:3]
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(
+        result_ids[3:] + ["other"]
+    )
+
+
+def test_store_response(result, store):
+    """a posted response can be stored for the charts"""
+    response = dtv_backend.postprocessing.result_to_response(result, with_energy=True)
+    response = json.loads(
+        json.dumps(response, default=dtv_backend.postprocessing.json_default)
+    )
+    result_id = dtv_backend.results.store_response(response)
+    echart = dtv_backend.charts.trip_duration({"result_id": result_id})
+    assert echart["series"][0]["data"] == [1.0, 1.0, 1.0]
+    echart = dtv_backend.charts.energy_per_time(response)
+    assert echart["series"][0]["data"][0] == ["2020-01-01 00:00:00", 0.1]
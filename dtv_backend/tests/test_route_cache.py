@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+import networkx as nx
+
+import pytest
+
+import dtv_backend.fis
+import dtv_backend.route_cache
+
+
+@pytest.fixture
+def graph():
+    graph = nx.DiGraph()
+    graph.add_edge("a", "b", length_m=1.0)
+    graph.add_edge("b", "c", length_m=1.0)
+    graph.add_edge("a", "c", length_m=5.0)
+    return graph
+
+
+def test_lru_eviction():
+    cache = dtv_backend.route_cache.RouteCache(maxsize=2)
+    cache.put("x", ["a", "b"])
+    cache.put("y", ["b", "c"])
+    # use x, so y is the least recently used
+    assert cache.get("x") == ["a", "b"]
+    cache.put("z", ["c", "d"])
+    assert cache.get("y") is None
+    assert cache.get("z") == ["c", "d"]
+    stats = cache.stats()
+    assert stats["size"] == 2
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+
+
+def test_max_nodes():
+    cache = dtv_backend.route_cache.RouteCache(maxsize=10, max_nodes=4)
+    cache.put("x", ["a", "b", "c"])
+    cache.put("y", ["b", "c"])
+    assert len(cache) == 1
+    assert cache.n_nodes == 2
+
+
+def test_key_includes_network_and_constraints(graph):
+    key = dtv_backend.route_cache.route_key(graph, "a", "c")
+    # copies (that may be modified) are a different network
+    other = graph.copy()
+    assert key != dtv_backend.route_cache.route_key(other, "a", "c")
+    assert key != dtv_backend.route_cache.route_key(
+        graph, "a", "c", constraints={"cemt": "Va"}
+    )
+    assert dtv_backend.route_cache.route_key(
+        graph, "a", "c", constraints={"width": 1, "closures": {("a", "b")}}
+    ) == dtv_backend.route_cache.route_key(
+        graph, "a", "c", constraints={"closures": {("a", "b")}, "width": 1}
+    )
+
+
+def test_shorted_path_is_cached(graph):
+    cache = dtv_backend.route_cache.route_cache
+    cache.clear()
+    path = dtv_backend.fis.shorted_path(graph, "a", "c")
+    assert path == ["a", "b", "c"]
+    # modifying the result should not modify the cache
+    path.append("x")
+    assert dtv_backend.fis.shorted_path(graph, "a", "c") == ["a", "b", "c"]
+    assert cache.stats()["hits"] == 1
+
+
+def test_graph_token_not_reused(graph):
+    """a new copy never gets the routes of a collected copy"""
+    tokens = set()
+    for _ in range(100):
+        # copies are collected right away, so their ids are reused
+        tokens.add(dtv_backend.route_cache.graph_token(graph.copy()))
+    assert len(tokens) == 100
+
+
+def test_invalidate(graph):
+    """routes of a graph that is modified in place are recomputed after invalidate"""
+    cache = dtv_backend.route_cache.route_cache
+    cache.clear()
+    path = dtv_backend.fis.shorted_path(graph, "a", "c", backend="networkx")
+    assert path == ["a", "b", "c"]
+    graph.remove_edge("b", "c")
+    dtv_backend.route_cache.invalidate(graph)
+    path = dtv_backend.fis.shorted_path(graph, "a", "c", backend="networkx")
+    assert path == ["a", "c"]
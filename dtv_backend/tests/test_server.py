@@ -63,3 +63,33 @@ def test_v2_simulate(client, current_dir_path):
     except Exception as e:
         raise
     
+
+
+def test_ready(client):
+    """without warmup the server is ready immediately"""
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.json["ready"]
+
+
+def test_warmup(monkeypatch):
+    calls = []
+
+    def fail():
+        raise RuntimeError("no network")
+
+    steps = {"ships": lambda: calls.append("ships"), "network": fail}
+    monkeypatch.setattr("dtv_backend.server.warmup_steps", lambda: steps)
+
+    app = create_app(warmup="blocking")
+    response = app.test_client().get("/ready")
+    assert calls == ["ships"]
+    assert response.status_code == 503
+    assert response.json["finished"]
+    assert response.json["steps"]["ships"]["status"] == "done"
+    assert response.json["steps"]["network"]["status"] == "failed"
+
+    del steps["network"]
+    app = create_app(warmup="background")
+    assert app.extensions["dtv_warmup"].wait(timeout=10)
+    assert app.test_client().get("/ready").status_code == 200
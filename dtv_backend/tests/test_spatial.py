@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import networkx as nx
+import numpy as np
+import shapely.geometry
+import shapely.ops
+
+import pytest
+
+import dtv_backend.spatial
+
+
+@pytest.fixture
+def graph():
+    """a small random network with point nodes and line edges"""
+    rng = np.random.default_rng(42)
+    graph = nx.DiGraph()
+    coordinates = rng.uniform(0, 10, size=(50, 2))
+    for i, (x, y) in enumerate(coordinates):
+        graph.add_node(
+            str(i), X=x, Y=y, geometry=shapely.geometry.Point(x, y), n=str(i)
+        )
+    for i in range(49):
+        a, b = coordinates[i], coordinates[i + 1]
+        geometry = shapely.geometry.LineString([a, (a + b) / 2 + 0.1, b])
+        graph.add_edge(str(i), str(i + 1), geometry=geometry, Wkt=geometry.wkt)
+    return graph
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(1)
+    return [shapely.geometry.Point(x, y) for x, y in rng.uniform(0, 10, (20, 2))]
+
+
+def test_nearest_nodes(graph, points):
+    """the index should give the same results as a brute force search"""
+    index = dtv_backend.spatial.NetworkIndex(graph)
+    names, distances = index.nearest_nodes(points)
+    for point, name, distance in zip(points, names, distances):
+        brute = [point.distance(graph.nodes[n]["geometry"]) for n in graph.nodes]
+        assert name == list(graph.nodes)[np.argmin(brute)]
+        assert distance == pytest.approx(np.min(brute))
+
+
+def test_nearest_edges(graph, points):
+    """the closest edge is defined by the Hausdorff distance"""
+    index = dtv_backend.spatial.NetworkIndex(graph)
+    names, distances = index.nearest_edges(points)
+    for point, name, distance in zip(points, names, distances):
+        brute = [
+            point.hausdorff_distance(graph.edges[e]["geometry"]) for e in graph.edges
+        ]
+        assert name == list(graph.edges)[np.argmin(brute)]
+        assert distance == pytest.approx(np.min(brute))
+
+
+def test_k_nearest_and_within(graph, points):
+    index = dtv_backend.spatial.NetworkIndex(graph)
+    point = points[0]
+    names, distances = index.k_nearest_nodes([point], k=3)
+    assert len(names[0]) == 3
+    assert np.all(np.diff(distances[0]) >= 0), "closest nodes should come first"
+    assert names[0][0] == index.nearest_node(point)[0]
+
+    within, within_distances = index.nodes_within(point, radius=distances[0][-1])
+    assert within[:3] == names[0]
+    assert np.all(within_distances <= distances[0][-1])
+
+    edges, edge_distances = index.k_nearest_edges([point], k=4)
+    assert edges[0][0] == index.nearest_edge(point)[0]
+    assert np.all(np.diff(edge_distances[0]) >= 0)
+
+
+def test_edge_coordinates():
+    """edges are oriented from source to target and extended with the nodes"""
+    graph = nx.Graph()
+    for n, (x, y) in {"a": (0, 0), "b": (1, 0), "c": (2, 1)}.items():
+        graph.add_node(n, geometry=shapely.geometry.Point(x, y))
+    # stored in the direction of the edge
+    graph.add_edge("a", "b", Wkt="LINESTRING (0 0, 0.5 0.1, 1 0)")
+    # stored in the opposite direction of the edge
+    graph.add_edge("b", "c", Wkt="LINESTRING (2 1, 1.5 0.4, 1 0)")
+    edge_coordinates = dtv_backend.spatial.EdgeCoordinates(graph)
+
+    np.testing.assert_array_equal(
+        edge_coordinates.edge_coordinates("b", "c"),
+        [(1, 0), (1, 0), (1.5, 0.4), (2, 1), (2, 1)],
+    )
+    np.testing.assert_array_equal(
+        edge_coordinates.edge_coordinates("c", "b"),
+        [(2, 1), (2, 1), (1.5, 0.4), (1, 0), (1, 0)],
+    )
+    geometry = edge_coordinates.path_geometry(["a", "b", "c"])
+    expected = shapely.ops.linemerge(
+        [
+            shapely.geometry.LineString(edge_coordinates.edge_coordinates("a", "b")),
+            shapely.geometry.LineString(edge_coordinates.edge_coordinates("b", "c")),
+        ]
+    )
+    assert geometry.equals(expected)
+    assert geometry.coords[0] == (0, 0) and geometry.coords[-1] == (2, 1)
+
+
+def test_edge_coordinates_empty():
+    """an edge without coordinates does not shift the coordinates of later edges"""
+    graph = nx.Graph()
+    for n, (x, y) in {"a": (0, 0), "b": (1, 0), "c": (2, 1)}.items():
+        graph.add_node(n, geometry=shapely.geometry.Point(x, y))
+    graph.add_edge("a", "b", Wkt="LINESTRING EMPTY")
+    graph.add_edge("b", "c", Wkt="LINESTRING (1 0, 1.5 0.4, 2 1)")
+    edge_coordinates = dtv_backend.spatial.EdgeCoordinates(graph)
+    np.testing.assert_array_equal(
+        edge_coordinates.edge_coordinates("a", "b"), [(0, 0), (1, 0)]
+    )
+    np.testing.assert_array_equal(
+        edge_coordinates.edge_coordinates("b", "c"),
+        [(1, 0), (1, 0), (1.5, 0.4), (2, 1), (2, 1)],
+    )
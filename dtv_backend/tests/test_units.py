@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+import pytest
+
+import dtv_backend.units
+
+
+@pytest.mark.parametrize(
+    "cargo, loading_rate", [(1000, 200), (1, 1), (2500.5, 333.3), (0.1, 4000)]
+)
+def test_load_time(cargo, loading_rate):
+    """the unit-free loading time equals the pint conversion"""
+    expected = dtv_backend.units._checked_load_time(cargo, loading_rate)
+    assert dtv_backend.units.load_time(cargo, loading_rate) == pytest.approx(expected)
+
+
+def test_validate_units(monkeypatch):
+    monkeypatch.setattr(dtv_backend.units, "validate_units", True)
+    assert dtv_backend.units.load_time(1000, 200) == 5 * 3600
+    # a wrong conversion factor is detected
+    monkeypatch.setattr(dtv_backend.units, "seconds_per_hour", 60.0)
+    with pytest.raises(ValueError):
+        dtv_backend.units.load_time(1000, 200)
+
+
+def test_shared_registry():
+    registry = dtv_backend.units.get_unit_registry()
+    assert dtv_backend.units.get_unit_registry() is registry